@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Microbenchmarks de los caminos críticos del bot sobre datos sintéticos.
+# Uso: python bench.py --sizes 100,1000,10000 --backend json --output bench.json
+# Todo se ejecuta en un directorio temporal: main.py usa rutas relativas
+# (requests.json, blacklist.json, bot.log...) y no se toca ningún dato real.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = "100,1000,10000,100000,1000000"
+GROUPS = 50
+SEED = 1234
+
+# === DATOS SINTÉTICOS ===
+def build_dataset(path, size, rng):
+    now = int(time.time())
+    users = max(1, size // 2)
+    requests = []
+    for ticket in range(1, size + 1):
+        group = rng.randrange(GROUPS)
+        requests.append({
+            "ticket": ticket,
+            "user_id": rng.randrange(users),
+            "username": f"usuario_{ticket}",
+            "message": f"Solicitud de prueba número {ticket} (temporada {ticket % 10})",
+            "group_id": -1000000000000 - group,
+            "group_name": f"Grupo {group}",
+            "ts": now - 2 * 24 * 3600 + ticket * 2 * 24 * 3600 // size,
+            "source": "EntresHijos",
+            "priority": ticket % 20 == 0,
+            "status": "en espera"
+        })
+    blacklist = [
+        {"user_id": users + i, "username": f"bloqueado_{i}"}
+        for i in range(size)
+    ]
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "requests.json"), "w") as f:
+        json.dump({"requests": requests, "last_ticket": size}, f)
+    with open(os.path.join(path, "blacklist.json"), "w") as f:
+        json.dump(blacklist, f)
+    return users
+
+# === MEDICIÓN ===
+def measure(func, repeat=5, number=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "min_us": round(min(times) * 1e6, 3),
+        "median_us": round(statistics.median(times) * 1e6, 3),
+        "repeat": repeat,
+        "number": number
+    }
+
+class FakeMessage:
+    chat_id = -1000000000000
+    message_id = 1
+
+class FakeQuery:
+    # Sustituye al CallbackQuery: solo construye el teclado, no llama a la API
+    message = FakeMessage()
+
+    async def edit_message_text(self, text, **kwargs):
+        return self.message
+
+def bench_size(main, size, rng, quick):
+    path = os.path.abspath(f"size_{size}")
+    users = build_dataset(path, size, rng)
+    os.chdir(path)
+    slow_repeat = 1 if size >= 100000 else 3
+    fast_number = 1000 if quick else 10000
+    results = {}
+
+    main.storage = main.create_storage()
+    results["load"] = measure(lambda: main.request_store.load(main.storage), repeat=slow_repeat)
+    main.blacklist.load(main.storage)
+    main.rate_limiter.rebuild(main.request_store.all())
+
+    user_ids = [rng.randrange(users) for _ in range(fast_number)]
+    cursor = iter(user_ids * 10)
+    results["rate_limiter_check"] = measure(lambda: main.rate_limiter.check(next(cursor), -1000000000000), number=fast_number)
+
+    blocked = [users + rng.randrange(size) for _ in range(fast_number)]
+    cursor = iter((blocked + user_ids) * 10)
+    results["blacklist_check"] = measure(lambda: main.blacklist.contains(next(cursor)), number=fast_number)
+
+    loop = asyncio.new_event_loop()
+    query = FakeQuery()
+    middle = size // 2
+    results["view_tickets_first_page"] = measure(lambda: loop.run_until_complete(main.show_ticket_page(query, {})), number=100)
+    results["view_tickets_middle_page"] = measure(lambda: loop.run_until_complete(main.show_ticket_page(query, {}, after=middle)), number=100)
+    results["view_tickets_group_filter"] = measure(lambda: loop.run_until_complete(main.show_ticket_page(query, {"group_id": -1000000000001})), number=100)
+    loop.close()
+
+    messages = [f"Solicitud de prueba número {rng.randrange(1, size + 1)} (temporada {rng.randrange(10)})" for _ in range(100)]
+    cursor = iter(messages * 1000)
+    results["find_duplicate_hit"] = measure(lambda: main.request_store.find_duplicate(next(cursor), -1000000000000), number=100)
+    cursor = iter([f"Otra petición distinta {i}" for i in range(100)] * 1000)
+    results["find_duplicate_miss"] = measure(lambda: main.request_store.find_duplicate(next(cursor), -1000000000000), number=100)
+
+    requests = main.request_store.all()[:fast_number]
+    cursor = iter(requests * 10)
+    results["render_ticket_card"] = measure(lambda: main.render("ticket_panel", next(cursor)), number=len(requests))
+    main.ticket_cards.invalidate()
+    cursor = iter(requests * 10)
+    results["render_ticket_card_cold"] = measure(lambda: (main.ticket_cards.invalidate(), main.render("ticket_panel", next(cursor))), number=len(requests))
+
+    # Al final: crean tickets nuevos y cambiarían el resto de medidas
+    def create():
+        return main.request_store.create(
+            user_id=rng.randrange(users), username="nuevo", message=f"Solicitud nueva {rng.random()}",
+            group_id=-1000000000000 - rng.randrange(GROUPS), group_name="Grupo", ts=int(time.time()),
+            source="EntresHijos", priority=False, status="en espera"
+        )
+    results["create_request"] = measure(create, number=fast_number)
+    main.request_store.flush()
+
+    def create_and_flush():
+        for _ in range(100):
+            create()
+        main.request_store.flush()
+    results["create_100_and_flush"] = measure(create_and_flush, repeat=slow_repeat)
+
+    main.storage.close()
+    os.chdir("..")
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main_bench():
+    parser = argparse.ArgumentParser(description="Microbenchmarks del bot de EntresHijos")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Tamaños de los datos separados por comas")
+    parser.add_argument("--backend", default="json", choices=("json", "sqlite"))
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--quick", action="store_true", help="Menos iteraciones por operación")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+    os.environ["STORAGE_BACKEND"] = args.backend
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+
+    rng = random.Random(SEED)
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "backend": args.backend,
+        "timestamp": int(time.time()),
+        "results": {}
+    }
+    try:
+        for size in sizes:
+            print(f"⏱️ Midiendo {size} registros...", file=sys.stderr)
+            report["results"][str(size)] = bench_size(main, size, rng, args.quick)
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main_bench()
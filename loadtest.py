@@ -0,0 +1,406 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+# Prueba de carga de extremo a extremo contra una Bot API simulada en local.
+# Uso: python loadtest.py --users 200 --groups 20 --latency 0.05 --error-rate 0.01
+# El bot se construye con build_application() de main.py apuntando al servidor
+# simulado (TELEGRAM_API_URL) y recibe el tráfico sintético por getUpdates o,
+# con --webhook, por peticiones POST a su webhook con la cabecera secreta.
+# Los límites de salida (OUTBOUND_*) y demás ajustes se leen del entorno como
+# en producción.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_ID = 7714399570
+ADMIN_GROUP_ID = -1002305997509
+TOKEN = "123456:loadtest"
+SEED = 4321
+WEBHOOK_SECRET = "loadtest"
+
+# === BOT API SIMULADA ===
+class StubBotAPI:
+    def __init__(self, latency, error_rate, server_error_rate, admin_ids):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.admin_ids = admin_ids
+        self.rng = random.Random(SEED)
+        self.lock = threading.Lock()
+        self.updates_ready = threading.Condition(self.lock)
+        self.updates = []
+        self.delivered = {}  # update_id -> instante en que se entregó por getUpdates
+        self.calls = Counter()
+        self.errors = Counter()
+        self.next_message_id = 1000
+
+    def push(self, update):
+        with self.updates_ready:
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+
+    def message(self, chat_id, text=None, message_id=None):
+        with self.lock:
+            if message_id is None:
+                self.next_message_id += 1
+                message_id = self.next_message_id
+        chat = {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"}
+        return {"message_id": message_id, "date": int(time.time()), "chat": chat, "text": text or ""}
+
+    def member(self, user_id, status):
+        user = {"id": user_id, "is_bot": user_id == BOT_ID, "first_name": f"Usuario {user_id}", "username": f"usuario_{user_id}"}
+        if status == "administrator":
+            rights = ("can_be_edited", "is_anonymous", "can_manage_chat", "can_delete_messages", "can_manage_video_chats",
+                      "can_restrict_members", "can_promote_members", "can_change_info", "can_invite_users")
+            return {"status": status, "user": user, **{right: right != "is_anonymous" for right in rights}}
+        return {"status": status, "user": user}
+
+    def get_updates(self, params):
+        offset = int(params.get("offset", 0))
+        timeout = float(params.get("timeout", 0))
+        deadline = time.time() + timeout
+        with self.updates_ready:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            while not self.updates and time.time() < deadline:
+                self.updates_ready.wait(deadline - time.time())
+            batch = self.updates[:int(params.get("limit", 100))]
+            now = time.perf_counter()
+            for update in batch:
+                self.delivered.setdefault(update["update_id"], now)
+        return batch
+
+    def call(self, method, params):
+        # Devuelve (código HTTP, cuerpo JSON) de la llamada
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self.get_updates(params)}
+        with self.lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            with self.lock:
+                self.errors["429"] += 1
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}}
+        if roll < self.error_rate + self.server_error_rate:
+            with self.lock:
+                self.errors["500"] += 1
+            return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+
+        if method == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "EntresHijos", "username": "entreshijos_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            message_id = int(params["message_id"]) if "message_id" in params else None
+            result = self.message(int(params.get("chat_id", ADMIN_GROUP_ID)), params.get("text"), message_id)
+        elif method == "getChatAdministrators":
+            result = [self.member(user_id, "administrator") for user_id in self.admin_ids + [BOT_ID]]
+        elif method == "getChatMember":
+            # /blacklist pasa el @name como user_id; se traduce a un ID estable
+            user_id = params["user_id"]
+            user_id = int(user_id) if str(user_id).lstrip("-").isdigit() else victim_id(user_id)
+            result = self.member(user_id, "member")
+        else:
+            # deleteMessage, answerCallbackQuery, setWebhook, deleteWebhook...
+            result = True
+        return 200, {"ok": True, "result": result}
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            method = self.path.rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(body or "{}")
+            else:
+                params = {}
+                for key, value in parse_qsl(body):
+                    try:
+                        params[key] = json.loads(value)
+                    except ValueError:
+                        params[key] = value
+            status, payload = api.call(method, params)
+            data = json.dumps(payload).encode()
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente cerró la conexión (p. ej. un getUpdates al detener el bot)
+                pass
+
+        do_GET = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def post_updates(api, port, stopping):
+    # Modo --webhook: entrega los updates uno a uno, como Telegram, y repite
+    # los que el bot rechaza con 503 (cola llena)
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+    while not stopping.is_set():
+        with api.updates_ready:
+            if not api.updates:
+                api.updates_ready.wait(0.1)
+            batch, api.updates = api.updates, []
+        for update in batch:
+            body = json.dumps(update).encode()
+            api.delivered.setdefault(update["update_id"], time.perf_counter())
+            while not stopping.is_set():
+                conn.request("POST", "/webhook", body, headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 503:
+                    break
+                with api.lock:
+                    api.errors["webhook_503"] += 1
+                time.sleep(0.05)
+    conn.close()
+
+# === TRÁFICO SINTÉTICO ===
+def victim_id(username):
+    return 900000000 + int(username.rsplit("_", 1)[-1])
+
+class Traffic:
+    def __init__(self, api):
+        self.api = api
+        self.next_update_id = 1
+        self.next_message_id = 1
+
+    def user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"Usuario {user_id}", "username": f"usuario_{user_id}"}
+
+    def push(self, kind, **payload):
+        update = {"update_id": self.next_update_id, **payload}
+        self.next_update_id += 1
+        self.next_message_id += 1
+        self.api.push(update)
+        return update["update_id"], kind
+
+    def text(self, kind, user_id, chat_id, text, title):
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": title},
+            "from": self.user(user_id),
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self.push(kind, message=message)
+
+    def solicito(self, user_id, group):
+        return self.text("solicito", user_id, -1000000000000 - group, f"/solicito Petición {self.next_update_id} de {user_id}", f"Grupo {group}")
+
+    def callback(self, kind, admin_id, data):
+        message = {
+            "message_id": self.next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": ADMIN_GROUP_ID, "type": "supergroup", "title": "Admins"},
+            "text": "panel"
+        }
+        return self.push(kind, callback_query={
+            "id": str(self.next_update_id),
+            "from": self.user(admin_id),
+            "chat_instance": "loadtest",
+            "data": data,
+            "message": message
+        })
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(durations):
+    return {
+        "count": len(durations),
+        "p50_ms": round(percentile(durations, 0.5) * 1000, 2) if durations else None,
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 2) if durations else None,
+        "max_ms": round(max(durations) * 1000, 2) if durations else None,
+        "mean_ms": round(statistics.mean(durations) * 1000, 2) if durations else None
+    }
+
+# === EJECUCIÓN ===
+async def run(args, api):
+    import main
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    started, finished = {}, {}
+
+    async def mark_start(update, context):
+        started[update.update_id] = time.perf_counter()
+
+    async def mark_end(update, context):
+        finished[update.update_id] = time.perf_counter()
+
+    application = main.build_application()
+    application.add_handler(TypeHandler(Update, mark_start), group=-1)
+    application.add_handler(TypeHandler(Update, mark_end), group=1)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    stopping = threading.Event()
+    if args.webhook:
+        webhook_server = await main.start_webhook(application)
+        poster = threading.Thread(target=post_updates, args=(api, main.WEBHOOK_PORT, stopping), daemon=True)
+        poster.start()
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=Update.ALL_TYPES)
+
+    rng = random.Random(SEED)
+    traffic = Traffic(api)
+    admins = list(range(1, args.admins + 1))
+    kinds = {}
+
+    async def wait_for(ids):
+        deadline = time.time() + args.timeout
+        while any(update_id not in finished for update_id in ids) and time.time() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def send(batch):
+        ids = []
+        for make in batch:
+            update_id, kind = make()
+            kinds[update_id] = kind
+            ids.append(update_id)
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+        await wait_for(ids)
+        return ids
+
+    calls_before = sum(api.calls.values())
+    start = time.perf_counter()
+
+    # Fase 1: usuarios de muchos grupos piden con /solicito
+    batch = []
+    for user_id in range(1000, 1000 + args.users):
+        group = rng.randrange(args.groups)
+        for _ in range(args.requests_per_user):
+            batch.append(lambda user_id=user_id, group=group: traffic.solicito(user_id, group))
+    rng.shuffle(batch)
+    all_ids = await send(batch)
+
+    # Fase 2: los admins aceptan o deniegan los tickets abiertos
+    tickets = sorted(main.request_store.by_ticket)
+    batch = [
+        lambda ticket=ticket: traffic.callback("accept" if ticket % 2 else "deny", rng.choice(admins), f"{'accept' if ticket % 2 else 'deny'}_{ticket}")
+        for ticket in tickets
+    ]
+    all_ids += await send(batch)
+
+    # Fase 3: altas y bajas en la blacklist
+    for cycle in range(args.blacklist_churn):
+        admin_id = rng.choice(admins)
+        username = f"victima_{cycle}"
+        all_ids += await send([lambda admin_id=admin_id: traffic.callback("blacklist_menu", admin_id, "add_to_blacklist")])
+        all_ids += await send([lambda admin_id=admin_id, username=username: traffic.text("blacklist_add", admin_id, ADMIN_GROUP_ID, f"@{username} 1h", "Admins")])
+        all_ids += await send([lambda admin_id=admin_id, username=username: traffic.callback("blacklist_remove", admin_id, f"remove_from_blacklist_{victim_id(username)}")])
+
+    elapsed = time.perf_counter() - start
+    api_calls = sum(api.calls.values()) - calls_before
+
+    if args.webhook:
+        stopping.set()
+        await asyncio.to_thread(poster.join)
+        webhook_server.close()
+        await webhook_server.wait_closed()
+    else:
+        await application.updater.stop()
+    await application.stop()
+    await application.post_shutdown(application)
+    await application.shutdown()
+
+    done = [update_id for update_id in all_ids if update_id in finished]
+    handler_latency = [finished[update_id] - started[update_id] for update_id in done]
+    end_to_end = [finished[update_id] - api.delivered[update_id] for update_id in done if update_id in api.delivered]
+    by_kind = {}
+    for kind in sorted(set(kinds.values())):
+        by_kind[kind] = summarize([finished[update_id] - started[update_id] for update_id in done if kinds[update_id] == kind])
+    return {
+        "updates": len(all_ids),
+        "completed": len(done),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(len(done) / elapsed, 2) if elapsed else None,
+        "api_calls": api_calls,
+        "api_calls_per_update": round(api_calls / len(done), 3) if done else None,
+        "api_calls_by_method": dict(api.calls),
+        "injected_errors": dict(api.errors),
+        "handler_latency": summarize(handler_latency),
+        "delivery_to_done_latency": summarize(end_to_end),
+        "handler_latency_by_kind": by_kind
+    }
+
+def main_loadtest():
+    parser = argparse.ArgumentParser(description="Prueba de carga del bot de EntresHijos contra una Bot API simulada")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--requests-per-user", type=int, default=1)
+    parser.add_argument("--blacklist-churn", type=int, default=10, help="Ciclos de alta y baja en la blacklist")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia media de la API simulada en segundos")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de llamadas que responden 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Fracción de llamadas que responden 500")
+    parser.add_argument("--rate", type=float, default=0, help="Updates por segundo (0 = sin pausa)")
+    parser.add_argument("--timeout", type=float, default=120, help="Espera máxima por fase en segundos")
+    parser.add_argument("--webhook", action="store_true", help="Entregar los updates por webhook en lugar de getUpdates")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    args = parser.parse_args()
+
+    api = StubBotAPI(args.latency, args.error_rate, args.server_error_rate, list(range(1, args.admins + 1)))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["TELEGRAM_BOT_TOKEN"] = TOKEN
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/bot"
+    if args.webhook:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            webhook_port = probe.getsockname()[1]
+        os.environ["UPDATE_MODE"] = "webhook"
+        os.environ["WEBHOOK_URL"] = f"http://127.0.0.1:{webhook_port}/webhook"
+        os.environ["WEBHOOK_LISTEN"] = "127.0.0.1"
+        os.environ["WEBHOOK_PORT"] = str(webhook_port)
+        os.environ["WEBHOOK_SECRET"] = WEBHOOK_SECRET
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    try:
+        report = asyncio.run(run(args, api))
+    finally:
+        server.shutdown()
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report["config"] = vars(args)
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main_loadtest()
@@ -1,162 +1,2420 @@
 import json
 import os
+import re
 import logging
 import time
 import sys
+import random
+import socket
+import fcntl
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes, JobQueue
+from telegram.ext import Application, BaseRateLimiter, CommandHandler, CallbackQueryHandler, ChatMemberHandler, MessageHandler, filters, ContextTypes, JobQueue
 from telegram.helpers import escape_markdown
-from telegram.error import TelegramError, NetworkError
+from telegram.error import TelegramError, NetworkError, RetryAfter, Conflict
 from dotenv import load_dotenv
 import traceback
 import asyncio
+import threading
+import sqlite3
+import heapq
+import gzip
+import csv
+import tempfile
+import math
+import unicodedata
+import queue
+import atexit
+import hmac
+import secrets
+import signal
+from bisect import bisect_left, bisect_right, insort
+from collections import deque, Counter, OrderedDict
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from urllib.parse import urlparse
 
-# === CONSTANTES ===
-logging.basicConfig(
-    filename='bot.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# === LOGS ===
+# Los manejadores solo encolan cada registro (QueueHandler); un hilo aparte
+# (QueueListener) formatea y escribe en disco con rotación. Los mensajes usan
+# formato %: si el nivel está desactivado no se formatea nada. Con
+# LOG_FORMAT=json cada línea es un objeto JSON con los campos de LOG_FIELDS,
+# que se toman del update en curso (log_context) o de extra=.
+load_dotenv()
+LOG_FILE = "bot.log"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text o json (una línea JSON por registro)
+LOG_TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # Rotación por tamaño
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")  # Rotación por tiempo (p. ej. "midnight"); sustituye a la de tamaño
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))  # Ficheros rotados que se conservan
+LOG_FIELDS = ("handler", "ticket", "user_id", "chat_id", "latency")
+
+log_context = ContextVar("log_context", default={})
+log_queue = None
+log_listener = None
+
+def bind_log(**fields):
+    # Añade campos al contexto de logs del update en curso
+    log_context.set({**log_context.get(), **fields})
+
+class ContextFilter(logging.Filter):
+    # Se ejecuta en el hilo que emite, donde log_context tiene los datos del update
+    def filter(self, record):
+        for field, value in log_context.get().items():
+            if field == "start":
+                record.latency = round(time.perf_counter() - value, 4)
+            elif value is not None and not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging(path=LOG_FILE):
+    global log_queue, log_listener
+    if LOG_ROTATE_WHEN:
+        handler = TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    else:
+        handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(LOG_TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    log_listener = QueueListener(log_queue, handler)
+    log_listener.start()
+
+def stop_logging():
+    # Vacía la cola y cierra el fichero; se llama también al salir
+    if log_listener:
+        log_listener.stop()
+        for handler in log_listener.handlers:
+            handler.close()
+
+setup_logging()
+atexit.register(stop_logging)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# === CONSTANTES ===
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 if not TOKEN:
     logger.error("❌ TELEGRAM_BOT_TOKEN no encontrado en .env. Deteniendo el bot...")
     sys.exit(1)
 
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")  # Base de la Bot API (el token se añade al final)
 ADMIN_GROUP_ID = "-1002305997509"  # ID del grupo de administradores
 BOT_ID = 7714399570  # ID del bot a añadir como administrador
-REQUEST_LIMIT = 2  # Límite de solicitudes por usuario cada 24 horas
+REQUEST_LIMIT = 2  # Límite de solicitudes por usuario cada REQUEST_WINDOW segundos
+REQUEST_WINDOW = int(os.getenv("REQUEST_WINDOW", str(24 * 3600)))  # Ventana del límite (24 horas)
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))  # Días que se conservan las solicitudes
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))  # Cada cuántos segundos se caducan solicitudes
+RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "true").lower() == "true"  # Archivar las solicitudes resueltas y caducadas
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")  # Carpeta de los segmentos mensuales del archivo
+ARCHIVE_INDEX_CACHE = int(os.getenv("ARCHIVE_INDEX_CACHE", "12"))  # Índices de segmento que se mantienen en memoria
+GROUP_LIMITS = json.loads(os.getenv("GROUP_LIMITS", "{}"))  # Por grupo: {"<group_id>": {"limit": 3, "window": 43200}}
+ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", "600"))  # Segundos que se reutiliza la lista de admins de un grupo
+ADMIN_CACHE_SIZE = int(os.getenv("ADMIN_CACHE_SIZE", "1000"))  # Grupos como máximo en la caché de admins
+ADMIN_STATUSES = ("administrator", "creator")
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))  # Mensajes por segundo en total
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))  # Mensajes por segundo a un mismo grupo
+OUTBOUND_GROUP_BURST = int(os.getenv("OUTBOUND_GROUP_BURST", "20"))  # Mensajes seguidos que admite un grupo antes de limitar
+OUTBOUND_PRIVATE_RATE = float(os.getenv("OUTBOUND_PRIVATE_RATE", "1"))  # Mensajes por segundo a un mismo chat privado
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))  # Reintentos tras RetryAfter
+BLACKLIST_RELOAD_INTERVAL = float(os.getenv("BLACKLIST_RELOAD_INTERVAL", "5"))  # Segundos entre comprobaciones de cambios externos
 DB_FILE = "requests.json"
 BLACKLIST_FILE = "blacklist.json"
+MESSAGES_FILE = "messages.json"  # Registro de mensajes enviados por ticket
 AUTO_DELETE_TIME = 120  # 2 minutos en segundos
-PID_FILE = "bot.pid"  # Archivo para almacenar el PID del proceso
+MERGE_CONFIRMATION = os.getenv("MERGE_CONFIRMATION", "false").lower() == "true"  # Un solo mensaje de confirmación y cola
+DELETE_SWEEP_INTERVAL = int(os.getenv("DELETE_SWEEP_INTERVAL", "5"))  # Segundos entre barridos de autoeliminación
+DELETIONS_FILE = "deletions.json"  # Borrados pendientes para reanudarlos tras un reinicio
+LEASE_FILE = "bot.lease"  # Lease de liderazgo con el almacenamiento JSON (con SQLite va en la base)
+LEASE_TTL = float(os.getenv("LEASE_TTL", "9"))  # Segundos que dura el liderazgo si el líder deja de renovarlo
+POLLING_MAX_RETRIES = int(os.getenv("POLLING_MAX_RETRIES", "8"))  # Intentos de iniciar el polling antes de rendirse
+BACKOFF_BASE = 1  # Segundos de la primera espera entre reintentos
+BACKOFF_CAP = 60  # Espera máxima entre reintentos
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Puerto del endpoint Prometheus (/metrics); 0 lo desactiva
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0"))  # Segundos entre muestras del perfilador; 0 lo desactiva
+PROFILE_FILE = "profile.txt"  # Pilas muestreadas en formato "collapsed" (flamegraph.pl, speedscope)
+PROFILE_DUMP_INTERVAL = 60  # Segundos entre volcados del perfil a disco
 ENVIRONMENT = os.getenv("ENVIRONMENT", "production")  # production (Vultr) o development (Replit)
+UPDATE_MODE = os.getenv("UPDATE_MODE", "webhook" if ENVIRONMENT == "development" else "polling")  # polling o webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "https://telegram-request-bot.xavirmyx.repl.co/webhook")  # URL pública que se registra en Telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "80"))
+WEBHOOK_PATH = urlparse(WEBHOOK_URL).path or "/"  # Ruta en la que se aceptan los updates
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)  # Cabecera X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))  # Procesos que comparten el puerto (SO_REUSEPORT)
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # Updates en cola por worker antes de responder 503
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # Conexiones simultáneas que abre Telegram
+WEBHOOK_MAX_BODY = 1024 * 1024  # Bytes como máximo por update
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))  # Lo asigna el supervisor a cada worker
+SHARED_STORAGE = UPDATE_MODE == "webhook" and WEBHOOK_WORKERS > 1  # Varios procesos sobre la misma base SQLite
+CHANGES_KEEP = 10000  # Cambios que se conservan en la tabla changes para los demás workers
+SQLITE_BUSY_TIMEOUT = 30  # Segundos que espera una escritura si otro proceso tiene la base
+WORKER_LOCK_TIMEOUT = float(os.getenv("WORKER_LOCK_TIMEOUT", "10"))  # Espera máxima del bloqueo entre workers
+WORKER_LOCK_RETRY = 0.01  # Segundos entre intentos de bloqueo; entre medias el bucle sigue atendiendo
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "2"))  # Segundos que se agrupan cambios antes de escribir a disco
+JOURNAL_FILE = "requests.jsonl"  # Diario de cambios (una línea por operación)
+COMPACT_THRESHOLD = int(os.getenv("COMPACT_THRESHOLD", str(1024 * 1024)))  # Bytes del diario antes de compactar
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # json (ficheros) o sqlite
+SQLITE_FILE = os.getenv("SQLITE_FILE", "bot.db")
+TICKET_BLOCK_SIZE = int(os.getenv("TICKET_BLOCK_SIZE", "50"))  # Tickets reservados por cada escritura duradera
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))  # Updates procesados a la vez como máximo
+TICKETS_PAGE_SIZE = int(os.getenv("TICKETS_PAGE_SIZE", "10"))  # Tickets por página en la lista de gestión
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.75"))  # Similitud (Jaccard) para unir solicitudes; 0 lo desactiva
 
-# === FUNCIONES UTILITARIAS ===
-def load_requests():
-    if os.path.exists(DB_FILE):
-        with open(DB_FILE, "r") as f:
-            data = json.load(f)
-        now = datetime.now()
-        cutoff_time = now - timedelta(days=30)
-        original_count = len(data["requests"])
-        data["requests"] = [
-            req for req in data["requests"]
-            if datetime.strptime(req["date"], "%Y-%m-%d %H:%M:%S") > cutoff_time
-        ]
-        deleted_count = original_count - len(data["requests"])
-        if deleted_count > 0:
-            save_requests(data)
-            logger.info(f"🗑️ Eliminadas {deleted_count} solicitudes antiguas (EntresHijos)")
+# === FECHAS ===
+# Las solicitudes guardan la fecha como segundos epoch en "ts"; el texto
+# solo se genera al construir un mensaje.
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def format_date(request):
+    return datetime.fromtimestamp(request["ts"]).strftime(DATE_FORMAT)
+
+def migrate_request_date(request):
+    # Registros antiguos: convierte "date" en "ts" una sola vez
+    if "ts" in request or "date" not in request:
+        return False
+    request["ts"] = int(datetime.strptime(request.pop("date"), DATE_FORMAT).timestamp())
+    return True
+
+# === MÉTRICAS ===
+# Contadores e histogramas en memoria, con etiquetas, expuestos en formato de
+# texto de Prometheus (METRICS_PORT) y resumidos en /stats. Se actualizan desde
+# el bucle de eventos y desde el hilo de escritura, de ahí el lock.
+METRICS_PREFIX = "entreshijos_"
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRIC_HELP = {
+    "handler_seconds": "Duración de los manejadores, incluida la espera de locks",
+    "handler_errors_total": "Excepciones en manejadores",
+    "api_requests_total": "Llamadas a la Bot API",
+    "api_seconds": "Duración de las llamadas a la Bot API",
+    "api_errors_total": "Errores de la Bot API por tipo (incluye RetryAfter)",
+    "outbound_wait_seconds": "Espera en la cola de salida antes de enviar",
+    "storage_read_seconds": "Duración de las cargas desde el almacenamiento",
+    "storage_write_seconds": "Duración de las escrituras al almacenamiento",
+    "storage_bytes": "Tamaño en disco de los datos",
+    "open_tickets": "Tickets abiertos en memoria",
+    "blacklist_users": "Usuarios en la blacklist",
+    "pending_deletions": "Mensajes pendientes de autoeliminación",
+    "outbound_queue_depth": "Peticiones esperando en la cola de salida",
+    "update_queue_depth": "Updates recibidos pendientes de procesar",
+    "job_queue_jobs": "Trabajos programados en la JobQueue",
+    "uptime_seconds": "Segundos desde el arranque",
+    "webhook_updates_total": "Updates aceptados por el webhook",
+    "webhook_rejected_total": "Peticiones al webhook rechazadas por motivo",
+    "polling_errors_total": "Errores de getUpdates por tipo",
+    "log_queue_depth": "Registros de log pendientes de escribir",
+    "archive_pending": "Solicitudes resueltas pendientes de archivar"
+}
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Límite superior del bucket que contiene el cuantil
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return 0.0
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_values(self, name):
+        with self.lock:
+            return {labels: value for (key, labels), value in self.counters.items() if key == name}
+
+    def histogram_values(self, name):
+        with self.lock:
+            return {labels: histogram for (key, labels), histogram in self.histograms.items() if key == name}
+
+    def gauge_values(self):
+        values = {}
+        for name, func in self.gauges.items():
+            try:
+                values[name] = func()
+            except Exception as e:
+                logger.warning("⚠️ No se pudo leer la métrica %s: %s", name, e)
+        return values
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(((key, (list(h.counts), h.total, h.count)) for key, h in self.histograms.items()))
+        lines = []
+        seen = set()
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {METRICS_PREFIX}{name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{METRICS_PREFIX}{name}{label_text(labels)} {value}")
+        for (name, labels), (counts, total, count) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(HISTOGRAM_BUCKETS + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{METRICS_PREFIX}{name}_bucket{label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{METRICS_PREFIX}{name}_sum{label_text(labels)} {total}")
+            lines.append(f"{METRICS_PREFIX}{name}_count{label_text(labels)} {count}")
+        for name, value in sorted(self.gauge_values().items()):
+            header(name, "gauge")
+            lines.append(f"{METRICS_PREFIX}{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.gauge("uptime_seconds", lambda: round(time.time() - metrics.started))
+
+async def metrics_endpoint(reader, writer):
+    # Servidor HTTP mínimo para Prometheus: GET /metrics
+    try:
+        request_line = (await reader.readline()).split()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if len(request_line) > 1 and request_line[1] == b"/metrics":
+            status, body = "200 OK", metrics.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+# Perfilador por muestreo opcional (PROFILE_INTERVAL): un hilo toma la pila del
+# hilo del bucle de eventos cada intervalo y acumula las pilas repetidas.
+class SamplingProfiler(threading.Thread):
+    def __init__(self, interval, path):
+        super().__init__(name="sampling-profiler", daemon=True)
+        self.interval = interval
+        self.path = path
+        self.target = threading.get_ident()
+        self.samples = Counter()
+        self.stopping = threading.Event()
+
+    def run(self):
+        last_dump = time.monotonic()
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+            if time.monotonic() - last_dump >= PROFILE_DUMP_INTERVAL:
+                self.dump()
+                last_dump = time.monotonic()
+
+    def top(self, count):
+        leaves = Counter()
+        for stack, hits in list(self.samples.items()):
+            leaves[stack.rsplit(";", 1)[-1]] += hits
+        return leaves.most_common(count)
+
+    def dump(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for stack, hits in self.samples.most_common():
+                f.write(f"{stack} {hits}\n")
+        os.replace(tmp_path, self.path)
+
+    def stop(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+        self.dump()
+        logger.info("🔥 Perfil guardado en %s (%s muestras)", self.path, sum(self.samples.values()))
+
+profiler = None
+metrics_server = None
+
+# === ALMACENAMIENTO ===
+# Interfaz común de persistencia. JsonStorage usa los ficheros JSON de siempre
+# (instantánea + diario) y SqliteStorage una base SQLite en modo WAL. El resto
+# del bot solo habla con RequestStore, que mantiene los datos en memoria.
+class Storage:
+    def load(self):
+        raise NotImplementedError
+
+    def write(self, ops, snapshot=None):
+        raise NotImplementedError
+
+    def needs_snapshot(self):
+        return False
+
+    def reserve_tickets(self, count):
+        raise NotImplementedError
+
+    def load_blacklist(self):
+        raise NotImplementedError
+
+    def save_blacklist(self, blacklist):
+        raise NotImplementedError
+
+    def blacklist_version(self):
+        return None
+
+    def load_messages(self):
+        raise NotImplementedError
+
+    def save_messages(self, messages):
+        raise NotImplementedError
+
+    def load_deletions(self):
+        raise NotImplementedError
+
+    def save_deletions(self, deletions):
+        raise NotImplementedError
+
+    @contextmanager
+    def exclusive(self, busy_timeout=None):
+        yield
+
+    def size(self):
+        return 0
+
+    def close(self):
+        pass
+
+# Cada cambio se añade como una línea al diario (journal_path) y, cuando este
+# supera COMPACT_THRESHOLD bytes, se compacta en la instantánea (path).
+class JsonStorage(Storage):
+    def __init__(self, path, journal_path, blacklist_path, messages_path, deletions_path):
+        self.path = path
+        self.journal_path = journal_path
+        self.blacklist_path = blacklist_path
+        self.messages_path = messages_path
+        self.deletions_path = deletions_path
+        self.journal_size = 0
+        self.reserved_ticket = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        data = {"requests": [], "last_ticket": 0}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        by_ticket = {req["ticket"]: req for req in data["requests"]}
+        replayed = self.replay_journal(data, by_ticket)
+        data["requests"] = list(by_ticket.values())
+        self.reserved_ticket = max(data["last_ticket"], data.get("reserved_ticket", 0))
+        data["reserved_ticket"] = self.reserved_ticket
+        logger.info("📂 %s cambios reaplicados desde %s", replayed, self.journal_path)
         return data
-    return {"requests": [], "last_ticket": 0}
-
-def save_requests(data):
-    with open(DB_FILE, "w") as f:
-        json.dump(data, f, indent=4)
-
-def generate_ticket():
-    data = load_requests()
-    data["last_ticket"] += 1
-    save_requests(data)
-    return data["last_ticket"]
-
-def count_user_requests(user_id):
-    data = load_requests()
-    now = datetime.now()
-    cutoff_time = now - timedelta(hours=24)
-    user_requests = [req for req in data["requests"] if req["user_id"] == user_id and datetime.strptime(req["date"], "%Y-%m-%d %H:%M:%S") > cutoff_time]
-    return len(user_requests), min([datetime.strptime(req["date"], "%Y-%m-%d %H:%M:%S") for req in user_requests], default=None)
-
-def load_blacklist():
-    if os.path.exists(BLACKLIST_FILE):
-        with open(BLACKLIST_FILE, "r") as f:
-            return json.load(f)
-    return []
-
-def save_blacklist(blacklist):
-    with open(BLACKLIST_FILE, "w") as f:
-        json.dump(blacklist, f, indent=4)
 
+    def replay_journal(self, data, by_ticket):
+        if not os.path.exists(self.journal_path):
+            return 0
+        replayed = 0
+        valid_size = 0
+        with open(self.journal_path, "rb") as f:
+            for raw_line in f:
+                try:
+                    if not raw_line.endswith(b"\n"):
+                        raise ValueError("línea incompleta")
+                    op = json.loads(raw_line)
+                except ValueError:
+                    # Una última línea a medio escribir tras una caída se descarta
+                    logger.warning("⚠️ Línea corrupta en %s (byte %s), se ignora el resto", self.journal_path, valid_size)
+                    break
+                valid_size += len(raw_line)
+                if self.apply_op(data, by_ticket, op):
+                    replayed += 1
+        if valid_size != os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(valid_size)
+        self.journal_size = valid_size
+        return replayed
+
+    def apply_op(self, data, by_ticket, op):
+        # Reaplicar es idempotente: el diario puede solaparse con la instantánea
+        # si el proceso cayó entre la compactación y el vaciado del diario.
+        kind = op.get("op") if isinstance(op, dict) else None
+        if kind == "create":
+            request = op["request"]
+            by_ticket.setdefault(request["ticket"], request)
+            data["last_ticket"] = max(data["last_ticket"], request["ticket"])
+        elif kind == "reserve":
+            data["reserved_ticket"] = max(data.get("reserved_ticket", 0), op["upto"])
+        elif kind == "update":
+            request = by_ticket.get(op["ticket"])
+            if request:
+                request.update(op["fields"])
+        elif kind in ("resolve", "expire"):
+            by_ticket.pop(op["ticket"], None)
+        else:
+            return False
+        return True
+
+    def needs_snapshot(self):
+        return self.journal_size >= COMPACT_THRESHOLD
+
+    def write(self, ops, snapshot=None):
+        with self.lock:
+            if snapshot is not None:
+                self.compact(snapshot)
+            else:
+                self.append(ops)
+
+    def append(self, ops):
+        encoded = "".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops).encode("utf-8")
+        with open(self.journal_path, "ab") as f:
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_size += len(encoded)
+
+    def reserve_tickets(self, count):
+        # La reserva se escribe de inmediato: tras un reinicio se continúa
+        # después del bloque, aunque no se llegaran a usar todos sus números.
+        with self.lock:
+            start = self.reserved_ticket + 1
+            self.reserved_ticket += count
+            self.append([{"op": "reserve", "upto": self.reserved_ticket}])
+        return start, self.reserved_ticket
+
+    def compact(self, snapshot):
+        # La instantánea se sustituye de forma atómica antes de vaciar el diario
+        snapshot["reserved_ticket"] = max(snapshot.get("reserved_ticket", 0), self.reserved_ticket)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        with open(self.journal_path, "wb") as f:
+            os.fsync(f.fileno())
+        self.journal_size = 0
+        logger.info("🗜️ Diario compactado en %s", self.path)
+
+    def load_blacklist(self):
+        if os.path.exists(self.blacklist_path):
+            with open(self.blacklist_path, "r") as f:
+                return json.load(f)
+        return []
+
+    def save_blacklist(self, blacklist):
+        tmp_path = f"{self.blacklist_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(blacklist, f, indent=4)
+        os.replace(tmp_path, self.blacklist_path)
+
+    def blacklist_version(self):
+        try:
+            return os.stat(self.blacklist_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load_messages(self):
+        if os.path.exists(self.messages_path):
+            with open(self.messages_path, "r") as f:
+                return json.load(f)
+        return {}
+
+    def save_messages(self, messages):
+        tmp_path = f"{self.messages_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(messages, f)
+        os.replace(tmp_path, self.messages_path)
+
+    def load_deletions(self):
+        if os.path.exists(self.deletions_path):
+            with open(self.deletions_path, "r") as f:
+                return json.load(f)
+        return []
+
+    def save_deletions(self, deletions):
+        tmp_path = f"{self.deletions_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(deletions, f)
+        os.replace(tmp_path, self.deletions_path)
+
+    def size(self):
+        paths = (self.path, self.journal_path, self.blacklist_path, self.messages_path, self.deletions_path)
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+# Las lecturas salen siempre de RequestStore en memoria, así que la tabla
+# requests solo tiene la clave primaria: cada índice más sería coste de
+# escritura sin ninguna consulta que lo use. Con varios workers
+# (changelog), cada operación se anota también en changes para que los demás
+# procesos la apliquen en memoria, y cada worker guarda sus propios borrados.
+# Las escrituras fila a fila (add_blacklist_entry, add_message...) y
+# changes_since solo existen aquí: los almacenes solo las usan en modo
+# compartido, que exige SQLite.
+class SqliteStorage(Storage):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS requests (
+            ticket INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            group_id INTEGER,
+            ts INTEGER,
+            status TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS blacklist (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            key TEXT NOT NULL,
+            purpose TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS deletions (
+            due INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            worker INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin INTEGER NOT NULL,
+            op TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path, worker=0, changelog=False):
+        self.path = path
+        self.worker = worker
+        self.changelog = changelog
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def transaction(self, busy_timeout=None):
+        # BEGIN IMMEDIATE serializa las escrituras también entre procesos; las
+        # transacciones anidadas se integran en la exterior. Con busy_timeout
+        # se espera menos que SQLITE_BUSY_TIMEOUT si la base está ocupada.
+        with self.lock:
+            if self.depth:
+                self.depth += 1
+                try:
+                    yield
+                finally:
+                    self.depth -= 1
+                return
+            if busy_timeout is None:
+                self.conn.execute("BEGIN IMMEDIATE")
+            else:
+                self.conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+                try:
+                    self.conn.execute("BEGIN IMMEDIATE")
+                finally:
+                    self.conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT * 1000}")
+            self.depth = 1
+            try:
+                yield
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            finally:
+                self.depth = 0
+
+    def exclusive(self, busy_timeout=None):
+        return self.transaction(busy_timeout)
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def bump_last_ticket(self, ticket):
+        self.set_meta("last_ticket", max(int(self.get_meta("last_ticket", 0)), ticket))
+
+    def reserve_tickets(self, count):
+        with self.transaction():
+            start = max(int(self.get_meta("last_ticket", 0)), int(self.get_meta("reserved_ticket", 0))) + 1
+            self.set_meta("reserved_ticket", start + count - 1)
+        return start, start + count - 1
+
+    def load(self):
+        with self.lock:
+            # El último cambio se lee antes que los datos: lo que entre en medio
+            # se vuelve a aplicar después, y aplicar es idempotente.
+            change_seq = self.last_change()
+            rows = self.conn.execute("SELECT data FROM requests ORDER BY ticket").fetchall()
+            last_ticket = int(self.get_meta("last_ticket", 0))
+        return {"requests": [json.loads(row[0]) for row in rows], "last_ticket": last_ticket, "change_seq": change_seq}
+
+    def upsert(self, request):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO requests (ticket, user_id, group_id, ts, status, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (request["ticket"], request["user_id"], request.get("group_id"), request.get("ts"),
+             request.get("status"), json.dumps(request, ensure_ascii=False))
+        )
+
+    def write(self, ops, snapshot=None):
+        with self.transaction():
+            if snapshot is not None:
+                self.conn.execute("DELETE FROM requests")
+                for request in snapshot["requests"]:
+                    self.upsert(request)
+                self.set_meta("last_ticket", snapshot["last_ticket"])
+                self.set_meta("reserved_ticket", max(int(self.get_meta("reserved_ticket", 0)), snapshot.get("reserved_ticket", 0)))
+                ops = [{"op": "snapshot"}]
+            else:
+                for op in ops:
+                    self.apply_op(op)
+            if self.changelog:
+                self.log_changes(ops)
+
+    def log_changes(self, ops):
+        cursor = self.conn.executemany(
+            "INSERT INTO changes (origin, op) VALUES (?, ?)",
+            [(self.worker, json.dumps(op, ensure_ascii=False)) for op in ops]
+        )
+        seq = self.last_change()
+        if seq // 1000 != (seq - cursor.rowcount) // 1000:
+            self.conn.execute("DELETE FROM changes WHERE seq <= ?", (seq - CHANGES_KEEP,))
+
+    def last_change(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, seq):
+        # Devuelve las operaciones de otros workers posteriores a seq y el último
+        # seq; None en lugar de la lista si ya se purgaron cambios no vistos.
+        with self.lock:
+            oldest = self.conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            rows = self.conn.execute("SELECT seq, origin, op FROM changes WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+        if oldest is not None and oldest > seq + 1:
+            return None, max(row[0] for row in rows)
+        if not rows:
+            return [], seq
+        return [json.loads(op) for _, origin, op in rows if origin != self.worker], rows[-1][0]
+
+    def apply_op(self, op):
+        kind = op["op"]
+        if kind == "create":
+            self.upsert(op["request"])
+            self.bump_last_ticket(op["request"]["ticket"])
+        elif kind == "update":
+            row = self.conn.execute("SELECT data FROM requests WHERE ticket = ?", (op["ticket"],)).fetchone()
+            if row:
+                request = json.loads(row[0])
+                request.update(op["fields"])
+                self.upsert(request)
+        elif kind in ("resolve", "expire"):
+            self.conn.execute("DELETE FROM requests WHERE ticket = ?", (op["ticket"],))
+
+    def load_blacklist(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM blacklist ORDER BY rowid").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_blacklist(self, blacklist):
+        with self.transaction():
+            self.conn.execute("DELETE FROM blacklist")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO blacklist (user_id, username, data) VALUES (?, ?, ?)",
+                [(entry["user_id"], entry.get("username"), json.dumps(entry, ensure_ascii=False)) for entry in blacklist]
+            )
+            self.bump_blacklist_version()
+
+    def bump_blacklist_version(self):
+        self.set_meta("blacklist_version", int(self.get_meta("blacklist_version", 0)) + 1)
+
+    def add_blacklist_entry(self, entry):
+        with self.transaction():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blacklist (user_id, username, data) VALUES (?, ?, ?)",
+                (entry["user_id"], entry.get("username"), json.dumps(entry, ensure_ascii=False))
+            )
+            self.bump_blacklist_version()
+
+    def remove_blacklist_entry(self, user_id):
+        with self.transaction():
+            self.conn.execute("DELETE FROM blacklist WHERE user_id = ?", (user_id,))
+            self.bump_blacklist_version()
+
+    def blacklist_version(self):
+        with self.lock:
+            return self.get_meta("blacklist_version")
+
+    def load_messages(self):
+        messages = {}
+        with self.lock:
+            rows = self.conn.execute("SELECT key, purpose, chat_id, message_id FROM messages ORDER BY rowid").fetchall()
+        for key, purpose, chat_id, message_id in rows:
+            messages.setdefault(key, {}).setdefault(purpose, []).append([chat_id, message_id])
+        return messages
+
+    def save_messages(self, messages):
+        with self.transaction():
+            self.conn.execute("DELETE FROM messages")
+            self.conn.executemany(
+                "INSERT INTO messages (key, purpose, chat_id, message_id) VALUES (?, ?, ?, ?)",
+                [(key, purpose, chat_id, message_id)
+                 for key, purposes in messages.items()
+                 for purpose, sent in purposes.items()
+                 for chat_id, message_id in sent]
+            )
+
+    def add_message(self, key, purpose, chat_id, message_id):
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO messages (key, purpose, chat_id, message_id) VALUES (?, ?, ?, ?)",
+                (key, purpose, chat_id, message_id)
+            )
+
+    def pop_messages(self, key, purpose=None):
+        condition, params = ("key = ?", (key,)) if purpose is None else ("key = ? AND purpose = ?", (key, purpose))
+        with self.transaction():
+            rows = self.conn.execute(f"SELECT chat_id, message_id FROM messages WHERE {condition} ORDER BY rowid", params).fetchall()
+            self.conn.execute(f"DELETE FROM messages WHERE {condition}", params)
+        return [list(row) for row in rows]
+
+    def load_deletions(self):
+        with self.lock:
+            return [list(row) for row in self.conn.execute("SELECT due, chat_id, message_id FROM deletions WHERE worker = ?", (self.worker,))]
+
+    def save_deletions(self, deletions):
+        with self.transaction():
+            self.conn.execute("DELETE FROM deletions WHERE worker = ?", (self.worker,))
+            self.conn.executemany(
+                "INSERT INTO deletions (due, chat_id, message_id, worker) VALUES (?, ?, ?, ?)",
+                [(due, chat_id, message_id, self.worker) for due, chat_id, message_id in deletions]
+            )
+
+    def migrate_from(self, source):
+        # Migración única desde los ficheros JSON, la primera vez que se abre la base
+        with self.lock:
+            if self.get_meta("migrated_from_json"):
+                return False
+        data = source.load()
+        blacklist = source.load_blacklist()
+        self.write([], snapshot=data)
+        self.save_blacklist(blacklist)
+        self.save_messages(source.load_messages())
+        self.save_deletions(source.load_deletions())
+        with self.lock:
+            self.set_meta("migrated_from_json", datetime.now().strftime(DATE_FORMAT))
+        logger.info("🚚 Migradas %s solicitudes y %s entradas de blacklist a %s", len(data['requests']), len(blacklist), self.path)
+        return True
+
+    def size(self):
+        paths = (self.path, f"{self.path}-wal")
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def create_storage():
+    json_storage = JsonStorage(DB_FILE, JOURNAL_FILE, BLACKLIST_FILE, MESSAGES_FILE, DELETIONS_FILE)
+    if STORAGE_BACKEND == "sqlite":
+        sqlite_storage = SqliteStorage(SQLITE_FILE, worker=WORKER_INDEX, changelog=SHARED_STORAGE)
+        sqlite_storage.migrate_from(json_storage)
+        return sqlite_storage
+    return json_storage
+
+# === DUPLICADOS ===
+# Índice invertido (grupo, palabra) -> tickets abiertos sobre el texto
+# normalizado: minúsculas, sin acentos y sin palabras vacías. Se actualiza con
+# cada operación del almacén. La búsqueda solo mira los tickets que comparten
+# alguna de las palabras más raras del mensaje: con similitud >= umbral, un
+# candidato tiene que contener al menos una de las len - ceil(umbral * len) + 1
+# primeras (prefix filtering), así que no hace falta recorrer el resto.
+DUPLICATE_STOPWORDS = frozenset((
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los", "me", "mi", "o", "para",
+    "por", "que", "se", "su", "un", "una", "y", "hola", "favor", "porfa", "gracias", "necesito",
+    "quiero", "busco", "pido", "solicito", "alguien", "tiene", "tienen"
+))
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return frozenset(token for token in re.findall(r"\w+", text)
+                     if token not in DUPLICATE_STOPWORDS and (len(token) > 1 or token.isdigit()))
+
+class TextIndex:
+    def __init__(self):
+        self.postings = {}  # (grupo, palabra) -> tickets
+        self.tokens = {}  # ticket -> (grupo, palabras)
+
+    def clear(self):
+        self.postings = {}
+        self.tokens = {}
+
+    def add(self, ticket, group_id, text):
+        tokens = normalize_text(text)
+        self.tokens[ticket] = (group_id, tokens)
+        for token in tokens:
+            self.postings.setdefault((group_id, token), set()).add(ticket)
+
+    def discard(self, ticket):
+        group_id, tokens = self.tokens.pop(ticket, (None, ()))
+        for token in tokens:
+            postings = self.postings[(group_id, token)]
+            postings.discard(ticket)
+            if not postings:
+                del self.postings[(group_id, token)]
+
+    def similar(self, text, group_id, threshold):
+        # Devuelve [(similitud, ticket)], de más a menos parecido y, a igualdad, el más antiguo
+        query = normalize_text(text)
+        if not query:
+            return []
+        ordered = sorted(query, key=lambda token: len(self.postings.get((group_id, token), ())))
+        prefix = ordered[:len(query) - math.ceil(threshold * len(query)) + 1]
+        candidates = set().union(*(self.postings.get((group_id, token), ()) for token in prefix))
+        found = []
+        for ticket in candidates:
+            tokens = self.tokens[ticket][1]
+            overlap = len(query & tokens)
+            score = overlap / (len(query) + len(tokens) - overlap)
+            if score >= threshold:
+                found.append((score, ticket))
+        found.sort(key=lambda item: (-item[0], item[1]))
+        return found
+
+# === ALMACÉN EN MEMORIA ===
+INDEXED_FIELDS = ("group_id", "priority", "user_id")  # Campos con índice ordenado para filtrar la lista
+# Los números de ticket se reservan en bloques de TICKET_BLOCK_SIZE: solo la
+# reserva del bloque se escribe de forma síncrona, cada ticket dentro del bloque
+# se asigna en memoria bajo el mismo cerrojo que registra la solicitud.
+class TicketAllocator:
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.backend = None
+        self.next_ticket = 1
+        self.block_end = 0
+
+    def reset(self, backend):
+        self.backend = backend
+        self.next_ticket = 1
+        self.block_end = 0
+
+    def allocate(self):
+        if self.next_ticket > self.block_end:
+            self.next_ticket, self.block_end = self.backend.reserve_tickets(self.block_size)
+        ticket = self.next_ticket
+        self.next_ticket += 1
+        return ticket
+
+# Los manejadores leen y modifican los datos en memoria; un hilo en segundo plano
+# vuelca a disco los cambios pendientes, agrupados cada FLUSH_INTERVAL segundos.
+# by_date es un montículo (ts, ticket) para caducar solo lo que ha vencido;
+# las entradas de tickets ya resueltos se descartan al salir del montículo.
+# Con varios workers (shared) cada cambio se escribe al momento en la base y
+# sync() aplica los de los demás procesos a partir de change_seq.
+class RequestStore:
+    def __init__(self):
+        self.backend = None
+        self.by_ticket = {}
+        self.by_date = []
+        self.index = {}
+        self.text_index = TextIndex()
+        self.archive = None
+        self.rate_limiter = None
+        self.last_ticket = 0
+        self.lock = threading.RLock()
+        self.pending_ops = []
+        self.needs_compaction = False
+        self.writer = None
+        self.tickets = TicketAllocator(TICKET_BLOCK_SIZE)
+        self.shared = False
+        self.change_seq = 0
+
+    def load(self, backend):
+        with self.lock:
+            self.backend = backend
+            self.shared = SHARED_STORAGE
+            # Con varios workers se reserva ticket a ticket dentro de la
+            # transacción que crea la solicitud: el orden de ticket sigue
+            # siendo el de fecha aunque los creen procesos distintos.
+            self.tickets.block_size = 1 if self.shared else TICKET_BLOCK_SIZE
+            self.tickets.reset(backend)
+            data = backend.load()
+            migrated = [req for req in data["requests"] if migrate_request_date(req)]
+            if migrated:
+                if self.shared:
+                    for req in migrated:
+                        self.record({"op": "update", "ticket": req["ticket"], "fields": {"ts": req["ts"]}})
+                else:
+                    self.mark_dirty()
+                logger.info("🔧 %s solicitudes migradas a marca de tiempo epoch", len(migrated))
+            self.replace(data)
+        logger.info("📂 Cargadas %s solicitudes en memoria (%s)", len(self.by_ticket), type(backend).__name__)
+
+    def replace(self, data):
+        with self.lock:
+            self.by_ticket = {req["ticket"]: req for req in data["requests"]}
+            self.by_date = [(req["ts"], req["ticket"]) for req in data["requests"]]
+            heapq.heapify(self.by_date)
+            ticket_cards.invalidate()
+            self.index = {}
+            self.text_index.clear()
+            for ticket in sorted(self.by_ticket):
+                request = self.by_ticket[ticket]
+                for key in self.index_keys(request):
+                    self.index.setdefault(key, []).append(ticket)
+                self.text_index.add(ticket, request["group_id"], request["message"])
+            self.last_ticket = data["last_ticket"]
+            self.change_seq = data.get("change_seq", 0)
+
+    def record(self, op):
+        self.record_batch([op])
+
+    def record_batch(self, ops):
+        # Las operaciones de un mismo lote se escriben en una sola transacción
+        if self.shared:
+            self.backend.write(ops)
+            return
+        self.pending_ops.extend(ops)
+        if self.writer:
+            self.writer.notify()
+
+    def sync(self):
+        # Devuelve las operaciones de otros workers aplicadas en memoria, o
+        # None si hubo que recargarlo todo (cambios purgados o instantánea).
+        with self.lock:
+            ops, self.change_seq = self.backend.changes_since(self.change_seq)
+            if ops is None or any(op["op"] == "snapshot" for op in ops):
+                logger.warning("⚠️ Cambios de otros workers no disponibles, recargando solicitudes")
+                self.replace(self.backend.load())
+                return None
+            for op in ops:
+                self.apply(op)
+            return ops
+
+    def apply(self, op):
+        # Aplica una operación del diario en memoria. Es idempotente, como la
+        # reaplicación en el almacenamiento, porque los cambios de otros workers
+        # pueden llegar solapados con lo ya cargado.
+        kind = op["op"]
+        if kind == "create":
+            request = op["request"]
+            if request["ticket"] not in self.by_ticket:
+                self.by_ticket[request["ticket"]] = request
+                heapq.heappush(self.by_date, (request["ts"], request["ticket"]))
+                self.index_add(request)
+                self.text_index.add(request["ticket"], request["group_id"], request["message"])
+                self.last_ticket = max(self.last_ticket, request["ticket"])
+        elif kind == "update":
+            request = self.by_ticket.get(op["ticket"])
+            if request:
+                fields = op["fields"]
+                reindex = any(field in fields for field in INDEXED_FIELDS)
+                if reindex:
+                    self.index_discard(request)
+                request.update(fields)
+                ticket_cards.invalidate(op["ticket"], fields)
+                if reindex:
+                    self.index_add(request)
+                if "message" in fields or "group_id" in fields:
+                    self.text_index.discard(op["ticket"])
+                    self.text_index.add(op["ticket"], request["group_id"], request["message"])
+                if "ts" in fields:
+                    heapq.heappush(self.by_date, (request["ts"], request["ticket"]))
+        elif kind in ("resolve", "expire"):
+            request = self.by_ticket.pop(op["ticket"], None)
+            if request:
+                self.index_discard(request)
+                self.text_index.discard(op["ticket"])
+                if self.rate_limiter:
+                    # También al aplicar cambios de otros workers: todos liberan el cupo
+                    self.rate_limiter.forget(request["user_id"], request["ts"])
+                ticket_cards.invalidate(op["ticket"])
+                if op.get("status"):
+                    request["status"] = op["status"]
+
+    def mark_dirty(self):
+        self.needs_compaction = True
+        if self.writer:
+            self.writer.notify()
+
+    # index guarda, por cada (campo, valor), la lista de tickets abiertos en orden.
+    # Los tickets se asignan de forma creciente, así que ese orden es también el
+    # de fecha; (None, None) indexa todos los tickets abiertos.
+    @staticmethod
+    def index_keys(request):
+        return [(None, None)] + [(field, request.get(field)) for field in INDEXED_FIELDS]
+
+    def index_add(self, request):
+        for key in self.index_keys(request):
+            insort(self.index.setdefault(key, []), request["ticket"])
+
+    def index_discard(self, request):
+        for key in self.index_keys(request):
+            tickets = self.index.get(key, [])
+            i = bisect_left(tickets, request["ticket"])
+            if i < len(tickets) and tickets[i] == request["ticket"]:
+                del tickets[i]
+            if not tickets and key != (None, None):
+                self.index.pop(key, None)
+
+    def index_values(self, field):
+        return sorted(value for key_field, value in self.index if key_field == field)
+
+    def scan(self, tickets, start, step, filters, limit):
+        found = []
+        i = start
+        while 0 <= i < len(tickets) and len(found) < limit:
+            request = self.by_ticket[tickets[i]]
+            if all(request.get(field) == value for field, value in filters.items()):
+                found.append(request)
+            i += step
+        return found
+
+    def page(self, filters=None, after=0, before=None, size=TICKETS_PAGE_SIZE):
+        # Recorre el índice más pequeño de los filtros desde el cursor; devuelve
+        # la página y si hay páginas anteriores y siguientes.
+        filters = filters or {}
+        with self.lock:
+            keys = list(filters.items()) or [(None, None)]
+            tickets = min((self.index.get(key, []) for key in keys), key=len)
+            if before is not None:
+                end = bisect_left(tickets, before)
+                found = self.scan(tickets, end - 1, -1, filters, size + 1)
+                has_prev = len(found) > size
+                found = found[:size][::-1]
+                has_next = bool(self.scan(tickets, end, 1, filters, 1))
+            else:
+                start = bisect_right(tickets, after)
+                found = self.scan(tickets, start, 1, filters, size + 1)
+                has_next = len(found) > size
+                found = found[:size]
+                has_prev = bool(self.scan(tickets, start - 1, -1, filters, 1))
+            return found, has_prev, has_next
+
+    def get(self, ticket):
+        return self.by_ticket.get(ticket)
+
+    def all(self):
+        return list(self.by_ticket.values())
+
+    def next_ticket(self):
+        with self.lock:
+            ticket = self.tickets.allocate()
+            self.last_ticket = max(self.last_ticket, ticket)
+            return ticket
+
+    def create(self, **fields):
+        # Asigna el ticket y registra la solicitud en una única operación del diario
+        with self.lock:
+            request = {"ticket": self.next_ticket(), **fields}
+            self.apply({"op": "create", "request": request})
+            self.record({"op": "create", "request": dict(request)})
+            return request
+
+    def update(self, ticket, **fields):
+        with self.lock:
+            request = self.by_ticket.get(ticket)
+            if request:
+                op = {"op": "update", "ticket": ticket, "fields": fields}
+                self.apply(op)
+                self.record(op)
+            return request
+
+    def remove(self, ticket, status=None, reason="resolve"):
+        with self.lock:
+            request = self.by_ticket.get(ticket)
+            if request:
+                op = {"op": "expire" if reason == "expired" else "resolve", "ticket": ticket}
+                if status:
+                    op["status"] = status
+                self.apply(op)
+                self.record(op)
+                self.archive_closed([request])
+            return request
+
+    def find_duplicate(self, message, group_id, threshold=DUPLICATE_THRESHOLD):
+        # Ticket abierto del mismo grupo más parecido al mensaje, si supera el umbral
+        if threshold <= 0:
+            return None
+        with self.lock:
+            found = self.text_index.similar(message, group_id, threshold)
+            return self.by_ticket[found[0][1]] if found else None
+
+    def add_follower(self, ticket, user_id, username):
+        # Los seguidores reciben el aviso de la solicitud original al resolverse
+        with self.lock:
+            request = self.by_ticket[ticket]
+            follower = {"user_id": user_id, "username": username, "ts": int(time.time())}
+            return self.update(ticket, followers=request.get("followers", []) + [follower])
+
+    def remove_many(self, tickets, status):
+        # Cierra varios tickets de una vez; devuelve los que seguían abiertos
+        with self.lock:
+            removed, ops = [], []
+            for ticket in tickets:
+                request = self.by_ticket.get(ticket)
+                if request:
+                    op = {"op": "resolve", "ticket": ticket, "status": status}
+                    self.apply(op)
+                    removed.append(request)
+                    ops.append(op)
+            if ops:
+                self.record_batch(ops)
+                self.archive_closed(removed)
+            return removed
+
+    def archive_closed(self, requests):
+        # Solo archiva el proceso que cierra el ticket, no los que aplican el cambio
+        if self.archive:
+            resolved_ts = int(time.time())
+            self.archive.add([{**request, "resolved_ts": resolved_ts} for request in requests])
+
+    def expire(self, cutoff_time):
+        expired = []
+        with self.lock:
+            while self.by_date and self.by_date[0][0] <= cutoff_time:
+                ts, ticket = heapq.heappop(self.by_date)
+                request = self.by_ticket.get(ticket)
+                if request and request["ts"] == ts:
+                    expired.append(self.remove(ticket, status="caducada", reason="expired"))
+        return expired
+
+    def flush(self):
+        with self.lock:
+            if not self.backend:
+                return False
+            ops, self.pending_ops = self.pending_ops, []
+            snapshot = None
+            if self.needs_compaction or self.backend.needs_snapshot():
+                snapshot = {
+                    "requests": [dict(req) for req in self.by_ticket.values()],
+                    "last_ticket": self.last_ticket,
+                    "reserved_ticket": self.tickets.block_end
+                }
+                self.needs_compaction = False
+            elif not ops:
+                return False
+        try:
+            self.backend.write(ops, snapshot)
+        except Exception:
+            # Se reintenta en la siguiente escritura; reaplicar es idempotente
+            with self.lock:
+                self.pending_ops[:0] = ops
+                if snapshot:
+                    self.needs_compaction = True
+            if self.writer:
+                self.writer.notify()
+            raise
+        return True
+
+class StorageWriter(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name="storage-writer", daemon=True)
+        self.interval = interval
+        self.stores = []
+        self.pending = threading.Event()
+        self.stopping = threading.Event()
+
+    def register(self, store):
+        store.writer = self
+        self.stores.append(store)
+        self.notify()
+
+    def notify(self):
+        self.pending.set()
+
+    def flush(self):
+        for store in self.stores:
+            try:
+                start = time.perf_counter()
+                if store.flush():
+                    metrics.observe("storage_write_seconds", time.perf_counter() - start, store=type(store).__name__)
+            except Exception as e:
+                logger.error("❌ Error al guardar %s: %s", type(store).__name__, e)
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.pending.wait()
+            self.stopping.wait(self.interval)  # Agrupar ráfagas de cambios en una sola escritura
+            self.pending.clear()
+            self.flush()
+
+    def stop(self):
+        self.stopping.set()
+        self.pending.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+        logger.info("💾 Datos pendientes guardados en disco")
+
+storage = None
+request_store = RequestStore()
+storage_writer = StorageWriter(FLUSH_INTERVAL)
+
+# === ARCHIVO ===
+# Las solicitudes resueltas o caducadas se guardan en segmentos mensuales
+# (según la fecha de la solicitud) ARCHIVE_DIR/requests-AAAA-MM.jsonl.gz.
+# Cada escritura añade un miembro gzip nuevo al final del segmento y anota su
+# posición en requests-AAAA-MM.idx ("ticket posición" por línea), así que
+# buscar un ticket solo descomprime su lote. Los segmentos se bloquean con
+# flock al escribir: varios workers pueden archivar a la vez.
+ARCHIVE_SEGMENT = re.compile(r"^requests-(\d{4}-\d{2})\.jsonl\.gz$")
+EXPORT_FIELDS = ("ticket", "date", "user_id", "username", "group_id", "group_name", "message", "status", "priority", "resolved", "followers")
+
+class RequestArchive:
+    def __init__(self, path):
+        self.path = path
+        self.pending = []
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.indexes = OrderedDict()  # segmento -> [bytes leídos del índice, {ticket: posición}]
+        self.writer = None
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, f"requests-{segment}.jsonl.gz")
+
+    def index_path(self, segment):
+        return os.path.join(self.path, f"requests-{segment}.idx")
+
+    def segments(self):
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(match.group(1) for match in map(ARCHIVE_SEGMENT.match, names) if match)
+
+    def add(self, requests):
+        with self.lock:
+            self.pending.extend(requests)
+        if self.writer:
+            self.writer.notify()
+
+    def flush(self):
+        with self.lock:
+            requests, self.pending = self.pending, []
+        if not requests:
+            return False
+        by_segment = {}
+        for request in requests:
+            segment = datetime.fromtimestamp(request["ts"]).strftime("%Y-%m")
+            by_segment.setdefault(segment, []).append(request)
+        os.makedirs(self.path, exist_ok=True)
+        for segment, batch in by_segment.items():
+            try:
+                self.append(segment, batch)
+            except Exception:
+                self.add(batch)  # Se reintenta en la siguiente escritura
+                raise
+        return True
+
+    def append(self, segment, batch):
+        data = "".join(json.dumps(request, ensure_ascii=False) + "\n" for request in batch).encode()
+        with open(self.segment_path(segment), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                with gzip.GzipFile(fileobj=f, mode="wb") as member:
+                    member.write(data)
+                f.flush()
+                with open(self.index_path(segment), "a") as index:
+                    index.write("".join(f"{request['ticket']} {offset}\n" for request in batch))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def index(self, segment):
+        # Lee solo lo añadido al índice desde la última consulta
+        entry = self.indexes.pop(segment, None) or [0, {}]
+        self.indexes[segment] = entry
+        while len(self.indexes) > ARCHIVE_INDEX_CACHE:
+            self.indexes.popitem(last=False)
+        try:
+            with open(self.index_path(segment), "rb") as f:
+                f.seek(entry[0])
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    ticket, offset = line.split()
+                    entry[1][int(ticket)] = int(offset)
+                    entry[0] += len(line)
+        except FileNotFoundError:
+            pass
+        return entry[1]
+
+    def find(self, ticket):
+        self.flush()
+        for segment in reversed(self.segments()):
+            with self.index_lock:
+                offset = self.index(segment).get(ticket)
+            if offset is None:
+                continue
+            with open(self.segment_path(segment), "rb") as f:
+                f.seek(offset)
+                with gzip.GzipFile(fileobj=f) as member:
+                    for line in member:
+                        request = json.loads(line)
+                        if request["ticket"] == ticket:
+                            return request
+        return None
+
+    def scan(self, start_ts, end_ts):
+        # Recorre en streaming los segmentos que pueden contener el intervalo
+        first = datetime.fromtimestamp(start_ts).strftime("%Y-%m")
+        last = datetime.fromtimestamp(end_ts - 1).strftime("%Y-%m")
+        for segment in self.segments():
+            if not first <= segment <= last:
+                continue
+            with open(self.segment_path(segment), "rb") as f:
+                fcntl.flock(f, fcntl.LOCK_SH)  # No leer un lote a medio escribir
+                with gzip.GzipFile(fileobj=f) as data:
+                    for line in data:
+                        request = json.loads(line)
+                        if start_ts <= request["ts"] < end_ts:
+                            yield request
+
+    def export(self, start_ts, end_ts):
+        # Genera el CSV en un fichero temporal sin cargar el archivo en memoria
+        self.flush()
+        fd, path = tempfile.mkstemp(prefix="export_", suffix=".csv")
+        count = 0
+        try:
+            with open(fd, "w", newline="", encoding="utf-8") as out:
+                writer = csv.writer(out)
+                writer.writerow(EXPORT_FIELDS)
+                for request in self.scan(start_ts, end_ts):
+                    writer.writerow((
+                        request["ticket"], format_date(request), request["user_id"], request["username"],
+                        request["group_id"], request["group_name"], request["message"], request.get("status", ""),
+                        request.get("priority", False), datetime.fromtimestamp(request["resolved_ts"]).strftime(DATE_FORMAT),
+                        " ".join(f"@{follower['username']}" for follower in request.get("followers", ()))
+                    ))
+                    count += 1
+        except BaseException:
+            os.remove(path)
+            raise
+        return path, count
+
+request_archive = RequestArchive(ARCHIVE_DIR)
+
+# === LÍMITE DE SOLICITUDES ===
+# Ventana deslizante por usuario con las marcas de tiempo de sus solicitudes
+# abiertas. Se reconstruye desde el almacén al arrancar y RequestStore quita la
+# marca al resolver o caducar un ticket; cada consulta cuesta O(solicitudes de
+# ese usuario) y devuelve la hora exacta de reinicio.
+class RateLimiter:
+    def __init__(self, default_limit, default_window, group_limits):
+        self.default_limit = default_limit
+        self.default_window = default_window
+        self.group_limits = {str(group_id): config for group_id, config in group_limits.items()}
+        self.max_window = max([default_window] + [config.get("window", default_window) for config in self.group_limits.values()])
+        self.windows = {}
+        self.extra_quota = {}
+
+    def rebuild(self, requests):
+        self.windows = {}
+        for req in sorted(requests, key=lambda r: r["ts"]):
+            self.record(req["user_id"], req["ts"])
+        logger.info("⏱️ Límite de solicitudes reconstruido para %s usuarios", len(self.windows))
+
+    def limits_for(self, group_id):
+        config = self.group_limits.get(str(group_id), {})
+        return config.get("limit", self.default_limit), config.get("window", self.default_window)
+
+    def prune(self, user_id, now):
+        window = self.windows.get(user_id)
+        if window is None:
+            return None
+        while window and window[0] <= now - self.max_window:
+            window.popleft()
+        if not window:
+            del self.windows[user_id]
+            return None
+        return window
+
+    def check(self, user_id, group_id=None, now=None):
+        # Devuelve (solicitudes en la ventana, límite efectivo, hora de reinicio o None)
+        now = now or time.time()
+        limit, window_length = self.limits_for(group_id)
+        limit += self.extra_quota.get(user_id, 0)
+        window = self.prune(user_id, now) or ()
+        in_window = [ts for ts in window if ts > now - window_length]
+        reset_time = None
+        if len(in_window) >= limit > 0:
+            # Momento en que sale de la ventana la solicitud que deja al usuario bajo el límite
+            reset_time = datetime.fromtimestamp(in_window[len(in_window) - limit] + window_length)
+        return len(in_window), limit, reset_time
+
+    def record(self, user_id, timestamp, group_id=None):
+        if group_id is not None and self.extra_quota.get(user_id):
+            count, limit, _ = self.check(user_id, group_id, timestamp)
+            if count >= limit - self.extra_quota[user_id]:
+                self.extra_quota[user_id] -= 1
+        self.windows.setdefault(user_id, deque()).append(timestamp)
+
+    def forget(self, user_id, timestamp):
+        # Solo cuentan las solicitudes abiertas, como al reconstruir tras un
+        # reinicio: aceptar, denegar o caducar un ticket libera su hueco.
+        window = self.windows.get(user_id)
+        if window and timestamp in window:
+            window.remove(timestamp)
+            if not window:
+                del self.windows[user_id]
+
+    def grant(self, user_id, amount):
+        # Punto de extensión para que los admins concedan cupo adicional
+        self.extra_quota[user_id] = max(self.extra_quota.get(user_id, 0) + amount, 0)
+        return self.extra_quota[user_id]
+
+rate_limiter = RateLimiter(REQUEST_LIMIT, REQUEST_WINDOW, GROUP_LIMITS)
+
+# === BLACKLIST ===
+# Conjunto en memoria indexado por user_id, con índice secundario por username.
+# Los bloqueos temporales ("expires") se levantan al salir de un montículo por
+# fecha. Se guarda con el mismo hilo de escritura diferida y se recarga si el
+# fichero (o la base) cambia desde fuera.
+class Blacklist:
+    def __init__(self, reload_interval):
+        self.reload_interval = reload_interval
+        self.backend = None
+        self.by_user = {}
+        self.by_username = {}
+        self.expiries = []
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.writer = None
+        self.version = None
+        self.last_check = 0
+        self.shared = False
+
+    def load(self, backend):
+        with self.lock:
+            self.backend = backend
+            # Con varios workers cada alta o baja se escribe al momento y los
+            # cambios de los demás se comprueban en cada consulta.
+            self.shared = SHARED_STORAGE
+            self.replace(backend.load_blacklist(), persist=False)
+            self.version = backend.blacklist_version()
+        logger.info("⛔ Blacklist cargada: %s usuarios", len(self.by_user))
+
+    def replace(self, entries, persist=True):
+        with self.lock:
+            self.by_user = {entry["user_id"]: entry for entry in entries}
+            self.by_username = {entry["username"].lower(): entry["user_id"] for entry in entries if entry.get("username")}
+            self.expiries = [(entry["expires"], entry["user_id"]) for entry in entries if entry.get("expires")]
+            heapq.heapify(self.expiries)
+            if persist:
+                self.mark_dirty()
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.writer:
+            self.writer.notify()
+
+    def refresh(self):
+        now = time.time()
+        with self.lock:
+            while self.expiries and self.expiries[0][0] <= now:
+                expires, user_id = heapq.heappop(self.expiries)
+                entry = self.by_user.get(user_id)
+                if entry and entry.get("expires") == expires:
+                    self.remove(user_id)
+                    logger.info("⏳ Bloqueo temporal de ID %s levantado", user_id)
+            if self.backend and not self.dirty and (self.shared or now - self.last_check >= self.reload_interval):
+                self.last_check = now
+                version = self.backend.blacklist_version()
+                if version != self.version:
+                    self.replace(self.backend.load_blacklist(), persist=False)
+                    self.version = version
+                    logger.info("🔄 Blacklist recargada tras un cambio externo (%s usuarios)", len(self.by_user))
+
+    def contains(self, user_id):
+        self.refresh()
+        return user_id in self.by_user
+
+    def find_username(self, username):
+        self.refresh()
+        return self.by_username.get(username.lower())
+
+    def entries(self):
+        self.refresh()
+        return list(self.by_user.values())
+
+    def add(self, user_id, username, expires=None):
+        with self.lock:
+            entry = {"username": username, "user_id": user_id}
+            if expires:
+                entry["expires"] = int(expires)
+                heapq.heappush(self.expiries, (entry["expires"], user_id))
+            self.by_user[user_id] = entry
+            if username:
+                self.by_username[username.lower()] = user_id
+            if self.shared:
+                self.backend.add_blacklist_entry(entry)
+            else:
+                self.mark_dirty()
+            return entry
+
+    def remove(self, user_id):
+        with self.lock:
+            entry = self.by_user.pop(user_id, None)
+            if entry:
+                if entry.get("username"):
+                    self.by_username.pop(entry["username"].lower(), None)
+                if self.shared:
+                    self.backend.remove_blacklist_entry(user_id)
+                else:
+                    self.mark_dirty()
+            return entry
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty or not self.backend:
+                return False
+            self.dirty = False
+            try:
+                self.backend.save_blacklist(list(self.by_user.values()))
+            except Exception:
+                self.mark_dirty()
+                raise
+            self.version = self.backend.blacklist_version()
+        return True
+
+blacklist = Blacklist(BLACKLIST_RELOAD_INTERVAL)
+
+# === REGISTRO DE MENSAJES ===
+# Guarda los mensajes que envía el bot por clave (número de ticket o "admin"
+# para los paneles del grupo de admins) y propósito, para borrarlos después
+# sin consultar getUpdates. Se persiste para sobrevivir a reinicios. Con
+# varios workers se lee y escribe directamente en la base, fila a fila.
+class MessageRegistry:
+    def __init__(self):
+        self.backend = None
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.writer = None
+        self.shared = False
+
+    def load(self, backend):
+        with self.lock:
+            self.backend = backend
+            self.shared = SHARED_STORAGE
+            self.entries = {} if self.shared else backend.load_messages()
+        logger.info("📨 Registro de mensajes cargado: %s claves", len(self.entries))
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.writer:
+            self.writer.notify()
+
+    def add(self, key, purpose, chat_id, message_id):
+        if self.shared:
+            self.backend.add_message(str(key), purpose, int(chat_id), message_id)
+            return
+        with self.lock:
+            self.entries.setdefault(str(key), {}).setdefault(purpose, []).append([int(chat_id), message_id])
+            self.mark_dirty()
+
+    def pop(self, key, purpose=None):
+        # Devuelve y olvida los mensajes de una clave (de un propósito o de todos)
+        if self.shared:
+            return self.backend.pop_messages(str(key), purpose)
+        with self.lock:
+            purposes = self.entries.get(str(key))
+            if not purposes:
+                return []
+            if purpose is None:
+                del self.entries[str(key)]
+                sent = [message for messages in purposes.values() for message in messages]
+            else:
+                sent = purposes.pop(purpose, [])
+                if not purposes:
+                    del self.entries[str(key)]
+            if sent:
+                self.mark_dirty()
+            return sent
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty or not self.backend:
+                return False
+            self.dirty = False
+            payload = {key: {purpose: list(sent) for purpose, sent in purposes.items()} for key, purposes in self.entries.items()}
+        try:
+            self.backend.save_messages(payload)
+        except Exception:
+            self.mark_dirty()
+            raise
+        return True
+
+message_registry = MessageRegistry()
+
+# === AUTOELIMINACIÓN ===
+# Cola de borrados agrupada en cubetas de DELETE_SWEEP_INTERVAL segundos y por
+# chat. Un único barrido periódico borra lo vencido en bloque, en lugar de un
+# temporizador por mensaje. Se persiste para reanudar los borrados al reiniciar.
+class DeletionScheduler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.backend = None
+        self.buckets = {}
+        self.due_buckets = []
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.writer = None
+
+    def load(self, backend):
+        with self.lock:
+            self.backend = backend
+            self.buckets = {}
+            self.due_buckets = []
+            for due, chat_id, message_id in backend.load_deletions():
+                self.add(due, chat_id, message_id)
+            self.dirty = False
+        logger.info("🕒 %s mensajes pendientes de autoeliminar", len(self))
+
+    def __len__(self):
+        return sum(len(ids) for chats in self.buckets.values() for ids in chats.values())
+
+    def mark_dirty(self):
+        self.dirty = True
+        if self.writer:
+            self.writer.notify()
+
+    def add(self, due, chat_id, message_id):
+        bucket = int(due // self.interval)
+        if bucket not in self.buckets:
+            self.buckets[bucket] = {}
+            heapq.heappush(self.due_buckets, bucket)
+        self.buckets[bucket].setdefault(int(chat_id), []).append(message_id)
+
+    def schedule(self, chat_id, message_id, delay=AUTO_DELETE_TIME):
+        with self.lock:
+            self.add(time.time() + delay, chat_id, message_id)
+            self.mark_dirty()
+
+    def pop_due(self, now):
+        # Agrupa por chat todos los mensajes de las cubetas ya vencidas
+        due = {}
+        with self.lock:
+            while self.due_buckets and (self.due_buckets[0] + 1) * self.interval <= now:
+                for chat_id, message_ids in self.buckets.pop(heapq.heappop(self.due_buckets)).items():
+                    due.setdefault(chat_id, []).extend(message_ids)
+            if due:
+                self.mark_dirty()
+        return due
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty or not self.backend:
+                return False
+            self.dirty = False
+            payload = [
+                [(bucket + 1) * self.interval, chat_id, message_id]
+                for bucket, chats in self.buckets.items()
+                for chat_id, message_ids in chats.items()
+                for message_id in message_ids
+            ]
+        try:
+            self.backend.save_deletions(payload)
+        except Exception:
+            self.mark_dirty()
+            raise
+        return True
+
+deletion_scheduler = DeletionScheduler(DELETE_SWEEP_INTERVAL)
+
+def parse_duration(text):
+    # "30m", "12h" o "7d" -> segundos; None si no es una duración válida
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if len(text) < 2 or text[-1].lower() not in units or not text[:-1].isdigit():
+        return None
+    return int(text[:-1]) * units[text[-1].lower()]
+
+# === CACHÉ DE ADMINISTRADORES ===
+# Lista de admins por grupo con caducidad (ADMIN_CACHE_TTL) y tamaño acotado
+# (LRU). Las actualizaciones ChatMemberUpdated la corrigen al instante, y el
+# estado de admin del propio bot se comprueba una vez y luego se vigila.
+class AdminCache:
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.bot_is_admin = None
+
+    def get(self, chat_id):
+        entry = self.entries.get(str(chat_id))
+        if entry is None:
+            return None
+        admin_ids, expires = entry
+        if expires < time.monotonic():
+            del self.entries[str(chat_id)]
+            return None
+        self.entries.move_to_end(str(chat_id))
+        return admin_ids
+
+    def set(self, chat_id, admin_ids):
+        self.entries[str(chat_id)] = (admin_ids, time.monotonic() + self.ttl)
+        self.entries.move_to_end(str(chat_id))
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def apply_member_update(self, chat_id, user_id, status):
+        if str(chat_id) == ADMIN_GROUP_ID and user_id == BOT_ID:
+            self.bot_is_admin = status in ADMIN_STATUSES
+        admin_ids = self.get(chat_id)
+        if admin_ids is None:
+            return
+        if status in ADMIN_STATUSES:
+            admin_ids.add(user_id)
+        else:
+            admin_ids.discard(user_id)
+
+    async def admin_ids(self, bot, chat_id):
+        admin_ids = self.get(chat_id)
+        if admin_ids is None:
+            admins = await bot.get_chat_administrators(chat_id)
+            admin_ids = {admin.user.id for admin in admins}
+            self.set(chat_id, admin_ids)
+            if str(chat_id) == ADMIN_GROUP_ID:
+                self.bot_is_admin = BOT_ID in admin_ids
+        return admin_ids
+
+admin_cache = AdminCache(ADMIN_CACHE_TTL, ADMIN_CACHE_SIZE)
+
+# === COLA DE SALIDA ===
+# Limitador de python-telegram-bot (BaseRateLimiter) con cubetas de tokens
+# global y por chat. La cubeta por chat (20 mensajes por minuto en grupos)
+# solo se aplica a los envíos: ediciones y borrados cuentan únicamente para
+# el límite global. Las peticiones esperan en una cola por prioridad: las
+# respuestas interactivas (PRIORITY_INTERACTIVE, por defecto) pasan antes que
+# las notificaciones masivas (rate_limit_args={"priority": PRIORITY_BULK}).
+# Ante RetryAfter se bloquea el chat el tiempo indicado y se reintenta.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+SEND_ENDPOINTS = {"sendMessage", "sendDocument", "sendPhoto", "forwardMessage", "copyMessage"}
+THROTTLED_ENDPOINTS = SEND_ENDPOINTS | {"editMessageText", "editMessageReplyMarkup", "deleteMessage"}
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self.refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class OutboundRateLimiter(BaseRateLimiter):
+    def __init__(self, global_rate, group_rate, group_burst, private_rate, max_retries):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.waiting = []
+        self.sequence = 0
+        self.wakeup = None
+        self.dispatcher = None
+        self.stats = {"sent": 0, "retry_after": 0, "retries": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    async def initialize(self):
+        self.wakeup = asyncio.Event()
+        self.dispatcher = asyncio.create_task(self.dispatch())
+
+    async def shutdown(self):
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            try:
+                await self.dispatcher
+            except asyncio.CancelledError:
+                pass
+            self.dispatcher = None
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                # Descartar cubetas llenas de chats inactivos
+                now = time.monotonic()
+                self.chat_buckets = {key: b for key, b in self.chat_buckets.items() if b.wait_time(now) > 0 or b.tokens < b.capacity}
+            if int(chat_id) > 0:
+                bucket = TokenBucket(self.private_rate, max(1, self.private_rate))
+            else:
+                bucket = TokenBucket(self.group_rate, max(1, self.group_burst))
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def queue_depth(self):
+        return len(self.waiting)
+
+    def average_wait(self):
+        return self.stats["wait_total"] / self.stats["sent"] if self.stats["sent"] else 0.0
+
+    async def dispatch(self):
+        while True:
+            now = time.monotonic()
+            sleep_for = None
+            deferred = []
+            while self.waiting:
+                global_wait = self.global_bucket.wait_time(now)
+                if global_wait > 0:
+                    sleep_for = global_wait
+                    break
+                item = heapq.heappop(self.waiting)
+                future, chat_id = item[2], item[3]
+                if future.done():
+                    continue
+                chat_wait = self.chat_bucket(chat_id).wait_time(now) if chat_id is not None else 0
+                if chat_wait > 0:
+                    # El chat está saturado: no bloquea al resto de la cola
+                    deferred.append(item)
+                    sleep_for = chat_wait if sleep_for is None else min(sleep_for, chat_wait)
+                    continue
+                if chat_id is not None:
+                    self.chat_buckets[chat_id].take()
+                self.global_bucket.take()
+                future.set_result(None)
+            for item in deferred:
+                heapq.heappush(self.waiting, item)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=sleep_for)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, chat_id, priority):
+        future = asyncio.get_running_loop().create_future()
+        self.sequence += 1
+        heapq.heappush(self.waiting, (priority, self.sequence, future, chat_id))
+        self.wakeup.set()
+        await future
+
+    async def call(self, callback, args, kwargs, endpoint):
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except TelegramError as e:
+            metrics.inc("api_errors_total", method=endpoint, error=type(e).__name__)
+            raise
+        finally:
+            metrics.inc("api_requests_total", method=endpoint)
+            metrics.observe("api_seconds", time.perf_counter() - start, method=endpoint)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in THROTTLED_ENDPOINTS:
+            return await self.call(callback, args, kwargs, endpoint)
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        chat_id = data.get("chat_id")
+        chat_id = str(chat_id) if chat_id is not None else None
+        bucket_id = chat_id if endpoint in SEND_ENDPOINTS else None
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            await self.acquire(bucket_id, priority)
+            waited = time.monotonic() - queued_at
+            self.stats["sent"] += 1
+            self.stats["wait_total"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+            metrics.observe("outbound_wait_seconds", waited)
+            try:
+                return await self.call(callback, args, kwargs, endpoint)
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                if attempt == self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                blocked_until = time.monotonic() + e.retry_after
+                bucket = self.chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.blocked_until = max(bucket.blocked_until, blocked_until)
+                logger.warning("🚦 RetryAfter de %ss en %s (Chat ID: %s), reintento %s/%s", e.retry_after, endpoint, chat_id, attempt + 1, self.max_retries)
+                if chat_id is not None and bucket_id is None:
+                    # Las ediciones y borrados no pasan por la cubeta del chat
+                    await asyncio.sleep(e.retry_after)
+
+# Cada worker tiene su propio limitador: se reparten los límites de Telegram
+# para que entre todos no los superen.
+OUTBOUND_SHARE = WEBHOOK_WORKERS if SHARED_STORAGE else 1
+outbound_limiter = OutboundRateLimiter(
+    OUTBOUND_GLOBAL_RATE / OUTBOUND_SHARE, OUTBOUND_GROUP_RATE / OUTBOUND_SHARE, max(1, OUTBOUND_GROUP_BURST // OUTBOUND_SHARE),
+    OUTBOUND_PRIVATE_RATE / OUTBOUND_SHARE, OUTBOUND_MAX_RETRIES
+)
+
+# === CONCURRENCIA ===
+# Los updates se procesan en paralelo (hasta CONCURRENT_UPDATES); los que
+# tocan el mismo usuario o el mismo ticket se serializan con un lock por
+# clave. Las claves se adquieren siempre ordenadas para evitar interbloqueos.
+TICKET_ACTIONS = ("manage_", "priority_", "deny_", "accept_", "reply_")
+USER_ACTIONS = ("remove_from_blacklist_",)
+COMMAND_KEYS = {"/reply": "ticket", "/cupo": "user"}  # Comandos cuyo primer argumento es una clave
+
+class KeyedLocks:
+    def __init__(self):
+        self.locks = {}  # clave -> [asyncio.Lock, usuarios]
+
+    def acquire_entry(self, key):
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = self.locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry
+
+    def release_entry(self, key, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.locks[key]
+
+    async def run(self, keys, coro_func, *args):
+        keys = sorted(set(keys))
+        entries = [self.acquire_entry(key) for key in keys]
+        acquired = []
+        try:
+            for entry in entries:
+                await entry[0].acquire()
+                acquired.append(entry)
+            return await coro_func(*args)
+        finally:
+            for entry in reversed(acquired):
+                entry[0].release()
+            for key, entry in zip(keys, entries):
+                self.release_entry(key, entry)
+
+def update_keys(update: Update):
+    keys = []
+    if update.effective_user:
+        keys.append(("user", update.effective_user.id))
+    if update.callback_query and update.callback_query.data:
+        action = update.callback_query.data
+        for prefix in TICKET_ACTIONS:
+            if action.startswith(prefix) and action[len(prefix):].isdigit():
+                keys.append(("ticket", int(action[len(prefix):])))
+        for prefix in USER_ACTIONS:
+            if action.startswith(prefix) and action[len(prefix):].isdigit():
+                keys.append(("user", int(action[len(prefix):])))
+    elif update.message and update.message.text:
+        args = update.message.text.split()
+        kind = COMMAND_KEYS.get(args[0].split("@")[0]) if args else None
+        if kind and len(args) > 1 and args[1].isdigit():
+            keys.append((kind, int(args[1])))
+    return keys
+
+def sync_workers():
+    # Aplica lo que han escrito los demás workers, también en el límite de
+    # solicitudes (solicitudes nuevas y cupos concedidos)
+    ops = request_store.sync()
+    if ops is None:
+        rate_limiter.rebuild(request_store.all())
+        return
+    for op in ops:
+        if op["op"] == "create":
+            request = op["request"]
+            rate_limiter.record(request["user_id"], request["ts"], request["group_id"])
+        elif op["op"] == "grant":
+            rate_limiter.grant(op["user_id"], op["amount"])
+
+@asynccontextmanager
+async def across_workers():
+    # Con varios workers bloquea la base (BEGIN IMMEDIATE) y se pone al día
+    # antes de entrar: comprobar el límite y crear el ticket es atómico entre
+    # procesos. El bloque no debe contener awaits. Si otro worker tiene la
+    # base, se reintenta sin bloquear el bucle hasta WORKER_LOCK_TIMEOUT.
+    if not request_store.shared:
+        yield
+        return
+    deadline = time.monotonic() + WORKER_LOCK_TIMEOUT
+    with ExitStack() as stack:
+        while True:
+            try:
+                stack.enter_context(storage.exclusive(busy_timeout=0))
+                break
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or time.monotonic() >= deadline:
+                    raise
+                await asyncio.sleep(WORKER_LOCK_RETRY)
+        sync_workers()
+        yield
+
+def serialized(handler):
+    async def synced(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if request_store.shared:
+            sync_workers()
+        return await handler(update, context)
+
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        start = time.perf_counter()
+        keys = update_keys(update)
+        log_context.set({
+            "handler": handler.__name__,
+            "user_id": update.effective_user.id if update.effective_user else None,
+            "chat_id": update.effective_chat.id if update.effective_chat else None,
+            "ticket": next((key for kind, key in keys if kind == "ticket"), None),
+            "start": start
+        })
+        try:
+            return await update_locks.run(keys, synced, update, context)
+        except Exception:
+            metrics.inc("handler_errors_total", handler=handler.__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe("handler_seconds", elapsed, handler=handler.__name__)
+            logger.debug("⏱️ %s atendido en %.1f ms", handler.__name__, elapsed * 1000)
+    wrapper.__name__ = handler.__name__
+    return wrapper
+
+update_locks = KeyedLocks()
+
+# === FUNCIONES UTILITARIAS ===
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat_id = str(update.effective_chat.id)
     if chat_id != ADMIN_GROUP_ID:
         await context.bot.send_message(chat_id=chat_id, text="❌ ¡Solo en el grupo de admins de EntresHijos! 😊")
-        logger.warning(f"🚫 Intento de comando admin por {user.id} fuera de grupo")
+        logger.warning("🚫 Intento de comando admin por %s fuera de grupo", user.id)
         return False
     try:
-        admins = await context.bot.get_chat_administrators(chat_id)
-        bot_admin = any(admin.user.id == BOT_ID for admin in admins)
-        if not bot_admin:
-            logger.warning(f"⚠️ Bot ID {BOT_ID} no es administrador en {ADMIN_GROUP_ID}")
+        admin_ids = await admin_cache.admin_ids(context.bot, chat_id)
+        if admin_cache.bot_is_admin is False:
+            logger.warning("⚠️ Bot ID %s no es administrador en %s", BOT_ID, ADMIN_GROUP_ID)
             await context.bot.send_message(chat_id=chat_id, text="⚠️ El bot necesita ser administrador. Añade al ID 7714399570.")
-        return any(admin.user.id == user.id for admin in admins)
+        return user.id in admin_ids
     except Exception as e:
         await context.bot.send_message(chat_id=chat_id, text=f"❌ Error al verificar admins: {str(e)} - EntresHijos")
-        logger.error(f"❌ Error al verificar admins: {str(e)}")
+        logger.error("❌ Error al verificar admins: %s", e)
         return False
 
+async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    member_update = update.chat_member or update.my_chat_member
+    chat_id = member_update.chat.id
+    member = member_update.new_chat_member
+    admin_cache.apply_member_update(chat_id, member.user.id, member.status)
+    if str(chat_id) == ADMIN_GROUP_ID and member.user.id == BOT_ID:
+        logger.info("👑 Estado del bot en el grupo admin: %s", member.status)
+
+async def delete_messages(context: ContextTypes.DEFAULT_TYPE, messages):
+    for chat_id, message_id in messages:
+        try:
+            await context.bot.delete_message(chat_id=chat_id, message_id=message_id, rate_limit_args={"priority": PRIORITY_BULK})
+            logger.info("🗑️ Mensaje eliminado (Chat ID: %s, Message ID: %s)", chat_id, message_id)
+        except TelegramError as e:
+            logger.warning("⚠️ No se pudo eliminar mensaje (Chat ID: %s, Message ID: %s): %s", chat_id, message_id, e)
+
+async def send_tracked(context: ContextTypes.DEFAULT_TYPE, chat_id, text, ticket=None, purpose=None, **kwargs):
+    # Envía aislando errores, programa la autoeliminación y registra el mensaje
+    try:
+        msg = await context.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+    except TelegramError as e:
+        logger.error("❌ No se pudo enviar mensaje a %s (Ticket #%s): %s", chat_id, ticket, e)
+        return None
+    deletion_scheduler.schedule(chat_id, msg.message_id)
+    if ticket is not None:
+        message_registry.add(ticket, purpose, chat_id, msg.message_id)
+    return msg
+
+async def edit_tracked(query, text, **kwargs):
+    try:
+        msg = await query.edit_message_text(text, **kwargs)
+    except TelegramError as e:
+        logger.error("❌ No se pudo editar mensaje (Chat ID: %s): %s", query.message.chat_id, e)
+        return None
+    deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
+    return msg
+
 async def clean_admin_messages(context: ContextTypes.DEFAULT_TYPE, chat_id: int, current_message_id: int):
+    # Borra los paneles anteriores del grupo admin y registra el actual
     try:
-        updates = await context.bot.get_updates(offset=-1, limit=50)
-        for update in updates:
-            if (update.message and update.message.chat_id == chat_id and
-                update.message.message_id != current_message_id and
-                update.message.from_user and update.message.from_user.is_bot):
-                admin_keywords = ["/tickets", "/blacklist", "/unblacklist", "Solicitud - Ticket", "Respuesta Enviada", "Estadísticas"]
-                if any(keyword in update.message.text for keyword in admin_keywords):
-                    try:
-                        await context.bot.delete_message(chat_id=chat_id, message_id=update.message.message_id)
-                        logger.info(f"🗑️ Mensaje eliminado (ID: {update.message.message_id}) en grupo admin")
-                    except TelegramError as e:
-                        logger.warning(f"⚠️ No se pudo eliminar mensaje (ID: {update.message.message_id}): {str(e)}")
+        previous = [message for message in message_registry.pop("admin", "panel") if message[1] != current_message_id]
+        message_registry.add("admin", "panel", chat_id, current_message_id)
+        await delete_messages(context, previous)
     except Exception as e:
-        logger.error(f"❌ Error al limpiar mensajes: {str(e)}")
+        logger.error("❌ Error al limpiar mensajes: %s", e)
 
-async def auto_delete_message(context: ContextTypes.DEFAULT_TYPE):
-    job = context.job
-    if job.context:
-        try:
-            chat_id, message_id = job.context
-            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-            logger.info(f"🕒 Mensaje autoeliminado (Chat ID: {chat_id}, Message ID: {message_id})")
-        except TelegramError as e:
-            logger.warning(f"⚠️ No se pudo autoeliminar mensaje (Chat ID: {chat_id}, Message ID: {message_id}): {str(e)}")
+async def delete_due(context: ContextTypes.DEFAULT_TYPE, chat_id, message_ids):
+    # python-telegram-bot 20.0 no tiene deleteMessages: se borran uno a uno,
+    # en paralelo y en tandas de 100 para no llenar de golpe la cola de salida.
+    for start in range(0, len(message_ids), 100):
+        chunk = message_ids[start:start + 100]
+        results = await asyncio.gather(
+            *(context.bot.delete_message(chat_id=chat_id, message_id=message_id, rate_limit_args={"priority": PRIORITY_BULK}) for message_id in chunk),
+            return_exceptions=True
+        )
+        failed = [message_id for message_id, result in zip(chunk, results) if isinstance(result, Exception)]
+        if failed:
+            logger.warning("⚠️ No se pudieron autoeliminar %s mensajes (Chat ID: %s): %s", len(failed), chat_id, failed)
+        logger.info("🕒 %s mensajes autoeliminados (Chat ID: %s)", len(chunk) - len(failed), chat_id)
+
+async def deletion_sweep(context: ContextTypes.DEFAULT_TYPE):
+    # Una tarea por chat: un chat con muchos borrados no retrasa a los demás
+    # y el barrido termina enseguida, sin que la JobQueue salte ejecuciones.
+    for chat_id, message_ids in deletion_scheduler.pop_due(time.time()).items():
+        context.application.create_task(delete_due(context, chat_id, message_ids))
+
+# === RETENCIÓN ===
+# Tarea periódica: saca del montículo por fecha solo las solicitudes vencidas.
+retention_stats = {"runs": 0, "expired": 0}
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    cutoff_time = time.time() - RETENTION_DAYS * 24 * 3600
+    # Al día con los demás workers: no caducar lo que otro ya ha resuelto
+    async with across_workers():
+        expired = request_store.expire(cutoff_time)
+    for request in expired:
+        message_registry.pop(request["ticket"])
+    retention_stats["runs"] += 1
+    retention_stats["expired"] += len(expired)
+    if not expired:
+        return
+    logger.info("🗑️ Caducadas %s solicitudes de más de %s días (total: %s, archivadas: %s)", len(expired), RETENTION_DAYS, retention_stats['expired'], RETENTION_ARCHIVE)
 
 # === MANEJADORES DE ERRORES ===
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     error_msg = str(context.error)
     error_details = f"Update {update} caused error {error_msg}\n{traceback.format_exc()}"
-    logger.error(f"❌ {error_details}")
-
-    if "Conflict: terminated by other getUpdates request" in error_msg:
-        logger.error("❌ Conflicto detectado: otra instancia del bot está corriendo. Intentando reconectar en 10 segundos...")
-        await asyncio.sleep(10)  # Esperar antes de reintentar
-        return  # No detener el bot, permitir que intente reconectarse
+    logger.error("❌ %s", error_details)
 
     if update and update.message:
         msg = await update.message.reply_text("❌ ¡Error en EntresHijos! Intenta de nuevo o contacta a un admin. 😊")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.message.chat_id, msg.message_id))
+        deletion_scheduler.schedule(update.message.chat_id, msg.message_id)
+
+# === LIDERAZGO ===
+# Solo el líder atiende updates. El liderazgo es un lease con caducidad en el
+# almacenamiento local (tabla leases en SQLite o LEASE_FILE con JSON) que un
+# hilo renueva cada LEASE_TTL / 3 segundos. Las instancias en espera ya tienen
+# el bot inicializado y lo intentan con la misma frecuencia: si el líder cae,
+# el relevo llega en menos de LEASE_TTL segundos. Un líder que no puede
+# renovar a tiempo se detiene antes de que otro tome el relevo.
+class FileLease:
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        # flock hace atómico leer y reescribir el lease entre procesos
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.read(fd, 4096)
+            yield fd, json.loads(raw) if raw.strip() else {}
+        finally:
+            os.close(fd)
+
+    def write(self, fd, lease):
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, json.dumps(lease).encode())
+        os.fsync(fd)
+
+    def try_acquire(self, holder, ttl):
+        # Devuelve el titular del lease tras el intento
+        now = time.time()
+        with self.locked() as (fd, lease):
+            if lease.get("holder", holder) != holder and lease.get("expires", 0) > now:
+                return lease["holder"]
+            self.write(fd, {"holder": holder, "expires": now + ttl})
+        return holder
+
+    def release(self, holder):
+        with self.locked() as (fd, lease):
+            if lease.get("holder") == holder:
+                self.write(fd, {})
+
+    def close(self):
+        pass
+
+class SqliteLease:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=LEASE_TTL / 3)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def try_acquire(self, holder, ttl):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT holder, expires FROM leases WHERE name = 'leader'").fetchone()
+            if row and row[0] != holder and row[1] > now:
+                current = row[0]
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO leases (name, holder, expires) VALUES ('leader', ?, ?)", (holder, now + ttl))
+                current = holder
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return current
+
+    def release(self, holder):
+        self.conn.execute("DELETE FROM leases WHERE name = 'leader' AND holder = ?", (holder,))
+
+    def close(self):
+        self.conn.close()
+
+class LeaderLease:
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.current = None
+        self.lost = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
 
-# === VERIFICAR INSTANCIA ÚNICA ===
-def check_single_instance():
-    if os.path.exists(PID_FILE):
-        with open(PID_FILE, "r") as f:
-            old_pid = f.read().strip()
+    def renew(self):
+        # Devuelve el titular actual, o None si no se pudo consultar
         try:
-            os.kill(int(old_pid), 0)  # Verificar si el proceso sigue vivo
-            logger.error(f"❌ Otra instancia del bot ya está corriendo con PID {old_pid}. Deteniendo esta instancia...")
-            print(f"❌ Error: Otra instancia del bot ya está corriendo con PID {old_pid}. Por favor, deténla antes de iniciar una nueva.")
-            sys.exit(1)
-        except (OSError, ValueError):
-            logger.info(f"🗑️ PID anterior {old_pid} no está activo. Continuando...")
-    with open(PID_FILE, "w") as f:
-        f.write(str(os.getpid()))
-    logger.info(f"✅ PID del bot registrado: {os.getpid()}")
+            return self.backend.try_acquire(self.holder, self.ttl)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("⚠️ No se pudo renovar el lease de liderazgo: %s", e)
+            return None
+
+    def acquire(self):
+        current = self.renew()
+        if current == self.holder:
+            logger.info("👑 Liderazgo adquirido (%s)", self.holder)
+            return True
+        if current and current != self.current:
+            logger.info("🕰️ En espera: el líder actual es %s", current)
+        self.current = current
+        return False
+
+    def start_heartbeat(self, on_lost):
+        self.thread = threading.Thread(target=self.heartbeat, args=(on_lost,), name="leader-lease", daemon=True)
+        self.thread.start()
+
+    def heartbeat(self, on_lost):
+        # El plazo se mide con el reloj monótono del propio proceso: si no se
+        # renueva antes de que venza, otro podría estar ya a cargo.
+        deadline = time.monotonic() + self.ttl
+        while not self.stopping.wait(self.ttl / 3):
+            current = self.renew()
+            if current == self.holder:
+                deadline = time.monotonic() + self.ttl
+                continue
+            if current is not None or time.monotonic() >= deadline - self.ttl / 3:
+                logger.error("❌ Liderazgo perdido (titular: %s). Deteniendo el bot...", current)
+                self.lost.set()
+                on_lost()
+                return
+
+    def release(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+        if not self.lost.is_set():
+            try:
+                self.backend.release(self.holder)
+                logger.info("👋 Liderazgo liberado")
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("⚠️ No se pudo liberar el lease de liderazgo: %s", e)
+        self.backend.close()
+
+def create_leader_lease():
+    backend = SqliteLease(SQLITE_FILE) if STORAGE_BACKEND == "sqlite" else FileLease(LEASE_FILE)
+    return LeaderLease(backend, LEASE_TTL)
+
+async def wait_for_leadership(lease, stop):
+    # Devuelve False si se pidió parar antes de conseguir el liderazgo
+    while not await asyncio.to_thread(lease.acquire):
+        if await wait_or_stop(stop, lease.ttl / 3):
+            return False
+    return True
+
+async def wait_or_stop(stop, delay):
+    try:
+        await asyncio.wait_for(stop.wait(), delay)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+def backoff_delays(base, cap):
+    # Espera exponencial con jitter: la mitad fija y la otra mitad al azar,
+    # para que varias instancias no reintenten a la vez
+    attempt = 0
+    while True:
+        ceiling = min(cap, base * 2 ** attempt)
+        yield ceiling / 2 + random.uniform(0, ceiling / 2)
+        attempt += 1
 
 # === LIMPIAR SESIONES DE TELEGRAM ===
 async def clear_telegram_sessions(app: Application):
@@ -166,161 +2424,675 @@ async def clear_telegram_sessions(app: Application):
         await app.bot.delete_webhook()  # Eliminar webhook para forzar uso de getUpdates
         logger.info("✅ Sesiones de Telegram limpiadas.")
     except TelegramError as e:
-        logger.warning(f"⚠️ No se pudo limpiar sesiones de Telegram: {str(e)}")
+        logger.warning("⚠️ No se pudo limpiar sesiones de Telegram: %s", e)
 
-# === COMANDOS PRINCIPALES ===
-async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    welcome_text = (
-        "🌟 **¡Bienvenido a EntresHijos Bot!** 🌟\n"
+# === WEBHOOK ===
+# Servidor HTTP mínimo sobre el bucle del bot: PTB 20.0 no permite SO_REUSEPORT
+# en run_webhook, y con él varios workers escuchan en el mismo puerto. Cada
+# update se valida (ruta y cabecera secreta) y se encola en update_queue, que
+# está acotada: con la cola llena se responde 503 y Telegram lo reintenta.
+def accept_webhook(application: Application, request_line, headers, body):
+    parts = request_line.split()
+    if len(parts) < 2 or parts[0] != b"POST" or parts[1].decode("latin-1") != WEBHOOK_PATH:
+        return "404 Not Found"
+    if not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", "").encode(), WEBHOOK_SECRET.encode()):
+        metrics.inc("webhook_rejected_total", reason="secret")
+        return "403 Forbidden"
+    try:
+        update = Update.de_json(json.loads(body), application.bot)
+    except (ValueError, TypeError, KeyError):
+        metrics.inc("webhook_rejected_total", reason="invalid")
+        return "400 Bad Request"
+    try:
+        application.update_queue.put_nowait(update)
+    except asyncio.QueueFull:
+        metrics.inc("webhook_rejected_total", reason="queue_full")
+        logger.warning("⚠️ Cola de updates llena (%s), se pide a Telegram que reintente", WEBHOOK_QUEUE_SIZE)
+        return "503 Service Unavailable"
+    metrics.inc("webhook_updates_total")
+    return "200 OK"
+
+async def webhook_endpoint(reader, writer, application: Application):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            keep_alive = headers.get("connection", "").lower() != "close"
+            if length > WEBHOOK_MAX_BODY:
+                status, keep_alive = "413 Payload Too Large", False
+            else:
+                body = await reader.readexactly(length)
+                status = accept_webhook(application, request_line, headers, body)
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def start_webhook(application: Application):
+    server = await asyncio.start_server(
+        lambda reader, writer: webhook_endpoint(reader, writer, application),
+        WEBHOOK_LISTEN, WEBHOOK_PORT, reuse_port=WEBHOOK_WORKERS > 1
+    )
+    if WORKER_INDEX == 0:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    logger.info("🌐 Webhook %s escuchando en %s:%s%s (worker %s)", WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WORKER_INDEX)
+    return server
+
+# === POLLING ===
+def polling_error(error: TelegramError):
+    # PTB reintenta getUpdates por su cuenta (espera creciente hasta 30 s)
+    metrics.inc("polling_errors_total", error=type(error).__name__)
+    if isinstance(error, Conflict):
+        logger.error("❌ Conflicto en getUpdates: otra instancia fuera del lease está haciendo polling con este token")
+    else:
+        logger.warning("⚠️ Error en getUpdates: %s", error)
+
+async def start_polling(application: Application, stop):
+    # Devuelve False si no se pudo iniciar o se pidió parar mientras se reintentaba
+    delays = backoff_delays(BACKOFF_BASE, BACKOFF_CAP)
+    for attempt in range(1, POLLING_MAX_RETRIES + 1):
+        try:
+            await application.updater.start_polling(
+                allowed_updates=Update.ALL_TYPES, bootstrap_retries=0, error_callback=polling_error
+            )
+            return True
+        except (NetworkError, Conflict) as e:
+            delay = next(delays)
+            logger.error("❌ No se pudo iniciar el polling: %s. Reintentando en %.1f segundos... (Intento %s/%s)", e, delay, attempt, POLLING_MAX_RETRIES)
+            if await wait_or_stop(stop, delay):
+                return False
+    logger.error("❌ Máximo número de reintentos alcanzado. Deteniendo el bot...")
+    return False
+
+async def run_application(application: Application, stop):
+    # Arranca la aplicación sin run_polling/run_webhook (que crean su propio
+    # bucle) y la detiene cuando se activa stop
+    server = None
+    started = False
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        started = True
+        await application.start()
+        if UPDATE_MODE == "webhook":
+            server = await start_webhook(application)
+        else:
+            await clear_telegram_sessions(application)
+            if not await start_polling(application, stop):
+                return False
+        await stop.wait()
+        return True
+    finally:
+        if server:
+            server.close()
+            await server.wait_closed()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        if started and application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+# === PLANTILLAS ===
+# Todos los mensajes se envían en MarkdownV2. En las plantillas, "*" marca la
+# negrita, `...` el código y {campo} los valores; el resto del texto se escapa
+# una sola vez al cargar el módulo. Los valores se escapan al renderizar.
+PARSE_MODE = "MarkdownV2"
+TEMPLATE_TOKEN = re.compile(r"(\{\w+\}|`[^`]*`|\*)")
+CARD_FIELDS = ("username", "message", "group_name", "ts", "status")  # Campos que invalidan la tarjeta cacheada
+
+TEMPLATE_TEXTS = {
+    "welcome": (
+        "🌟 *¡Bienvenido a EntresHijos Bot!* 🌟\n"
         "📢 Gestiona solicitudes para la comunidad EntresHijos.\n"
         "👥 Usa `/solicito <mensaje>` para enviar una solicitud.\n"
         "👑 Admins, usa `/tickets` o `/blacklist` para gestionar.\n"
         "ℹ️ ¡Estamos aquí para ayudarte! 🙌"
-    )
+    ),
+    "solicito_help": (
+        "📝 *Enviar Solicitud - EntresHijos*\n"
+        "Usa `/solicito <tu_mensaje>` (ej. `/solicito Necesito ayuda`). 😊"
+    ),
+    "blacklisted": "⛔ @{username} estás en la blacklist de EntresHijos. No puedes enviar solicitudes. 😔",
+    "solicito_empty": "❌ ¡Ingresa un mensaje! Ejemplo: `/solicito Necesito ayuda` - EntresHijos. 😊",
+    "admin_check_error": "❌ Error al verificar admin: {error} - EntresHijos.",
+    "limit_reached": (
+        "⛔ @{username}, agotaste tus {limit} solicitudes - EntresHijos. 😔\n"
+        "⏳ Vuelve en {hours}h {minutes}m (a las {reset})."
+    ),
+    "request_registered": (
+        "✅ *Solicitud Registrada - EntresHijos* 🎉\n"
+        "👤 @{username}\n"
+        "🎟️ Ticket #{ticket}\n"
+        "📝 Mensaje: {message}\n"
+        "🏠 Grupo: {group_name}\n"
+        "🕒 Fecha: {date}"
+    ),
+    "requests_remaining": "\n📊 Solicitudes restantes: {remaining}",
+    "queue_status": "\n📋 Estado: En espera de revisión.",
+    "queue_notice": (
+        "📢 *Solicitud en Cola - EntresHijos* ⏳\n"
+        "👤 @{username}\n"
+        "🎟️ Ticket #{ticket}\n"
+        "📝 Mensaje: {message}\n"
+        "🏠 Grupo: {group_name}\n"
+        "🕒 Fecha: {date}\n"
+        "📋 Estado: En espera de revisión."
+    ),
+    "admin_notification": (
+        "🔔 *Nueva Solicitud - EntresHijos* 🔔\n"
+        "🎟️ Ticket #{ticket}\n"
+        "👤 @{username}\n"
+        "📝 Mensaje: {message}\n"
+        "🏠 Grupo: {group_name}\n"
+        "🕒 Fecha: {date}\n"
+        "🔧 Usa /tickets para gestionarla."
+    ),
+    "no_tickets": "📪 *Sin Solicitudes - EntresHijos* 😊\nNo hay tickets pendientes.",
+    "no_tickets_filtered": "📪 *Sin Solicitudes - EntresHijos* 😊\nNo hay tickets con estos filtros.",
+    "ticket_list": "📋 *Lista de Tickets - EntresHijos* 📋\nSelecciona un ticket para gestionarlo:",
+    "admin_menu": "🔧 *Menú de Gestión - EntresHijos* 🔧\nSelecciona una opción:",
+    "blacklist_menu": "⛔ *Blacklist - EntresHijos* ⛔\nPulsa para añadir un usuario a la blacklist.",
+    "blacklist_empty": "✅ *Blacklist Vacía - EntresHijos* ✅\nNo hay usuarios bloqueados.",
+    "blacklist_list": "✅ *Lista de Blacklist - EntresHijos* ✅\nSelecciona un usuario para desbloquear:",
+    "blacklist_prompt": (
+        "⛔ *Añadir a Blacklist - EntresHijos* ⛔\n"
+        "Envía el @name del usuario a bloquear (ej. @username).\n"
+        "Para un bloqueo temporal añade la duración (ej. @username 7d)."
+    ),
+    "blacklist_bad_name": "❌ El @name debe comenzar con @ - EntresHijos. 😕",
+    "blacklist_exists": "⛔ @{username} ya está en la blacklist - EntresHijos. 😕",
+    "blacklist_added": (
+        "⛔ *Usuario Añadido a Blacklist - EntresHijos* ⛔\n"
+        "@{username} (ID: {user_id}) bloqueado{until}."
+    ),
+    "blacklist_error": "❌ Error al añadir a blacklist: {error} - EntresHijos.",
+    "blacklist_removed": "✅ *Usuario Desbloqueado - EntresHijos* ✅\nID {user_id} eliminado de la blacklist.",
+    "reply_usage": "❌ Uso: `/reply <ticket> <mensaje>` - EntresHijos.",
+    "reply_bad_ticket": "❌ Ticket debe ser numérico. Ejemplo: `/reply 1 Hola` - EntresHijos.",
+    "reply_prompt": (
+        "📩 *Responder - EntresHijos* 📩\n"
+        "🎟️ Ticket #{ticket}\n"
+        "Usa `/reply {ticket} <mensaje>` (ej. `/reply {ticket} Solicitud procesada`)."
+    ),
+    "reply_user": (
+        "📩 *Respuesta - EntresHijos* 📩\n"
+        "🎟️ Ticket #{ticket}\n"
+        "👤 @{username}\n"
+        "📝 Respuesta: {reply}"
+    ),
+    "reply_admin": (
+        "📢 *Respuesta Enviada - EntresHijos* 📢\n"
+        "🎟️ Ticket #{ticket}\n"
+        "👤 @{username}\n"
+        "📝 Mensaje: {reply}"
+    ),
+    "ticket_not_found": "❌ Ticket #{ticket} no encontrado - EntresHijos.",
+    "ticket_missing": "❌ Ticket #{ticket} no encontrado - EntresHijos. 😕",
+    "ticket_not_owned": "❌ Ticket #{ticket} no encontrado o no te pertenece - EntresHijos. 😕",
+    "cupo_usage": "❌ Uso: `/cupo <user_id> <cantidad>` - EntresHijos.",
+    "cupo_granted": "✅ ID {user_id} tiene ahora {extra} solicitudes extra - EntresHijos.",
+    "pendiente_usage": "❌ Uso: `/pendiente <ticket>` - EntresHijos. 😊",
+    "ticket_status": (
+        "ℹ️ *Estado - EntresHijos* ℹ️\n"
+        "🎟️ Ticket #{ticket}\n"
+        "👤 @{username}\n"
+        "📝 Mensaje: {message}\n"
+        "🏠 Grupo: {group_name}\n"
+        "🕒 Fecha: {date}\n"
+        "📋 Estado: {status}"
+    ),
+    "status_uploaded_hint": "\n🔍 Busca en el canal correspondiente.",
+    "status_denied_hint": "\n❌ Contacta a un admin si necesitas ayuda.",
+    "status_expired_hint": "\n⌛ Caducó sin resolverse; puedes volver a pedirlo con /solicito.",
+    "export_usage": "❌ Uso: `/exportar <desde> <hasta>` con fechas AAAA-MM-DD - EntresHijos.",
+    "export_disabled": "❌ El archivo de solicitudes está desactivado (RETENTION_ARCHIVE) - EntresHijos.",
+    "export_empty": "📭 No hay solicitudes archivadas entre {start} y {end} - EntresHijos.",
+    "export_done": "📤 *Exportación - EntresHijos* 📤\n📋 {count} solicitudes archivadas entre {start} y {end}.",
+    "ticket_panel": (
+        "📋 *Ticket #{ticket} - EntresHijos* 📋\n"
+        "👤 @{username}\n"
+        "📝 Mensaje: {message}\n"
+        "🏠 Grupo: {group_name}\n"
+        "🕒 Fecha: {date}\n"
+        "📋 Estado: {status}\n"
+        "🔧 ¿Qué acción deseas tomar?"
+    ),
+    "request_denied": (
+        "📢 *Actualización - EntresHijos* 📢\n"
+        "👤 @{username}\n"
+        "🎟️ Ticket #{ticket}\n"
+        "📝 Mensaje: {message}\n"
+        "🏠 Grupo: {group_name}\n"
+        "🕒 Fecha: {date}\n"
+        "❌ Estado: Solicitud NO Aceptada\n"
+        "Contacta a un admin si necesitas ayuda."
+    ),
+    "request_accepted": (
+        "📢 *Actualización - EntresHijos* 📢\n"
+        "👤 @{username}\n"
+        "🎟️ Ticket #{ticket}\n"
+        "📝 Mensaje: {message}\n"
+        "🏠 Grupo: {group_name}\n"
+        "🕒 Fecha: {date}\n"
+        "✅ Estado: Solicitud Subida\n"
+        "🔍 Busca en el canal correspondiente."
+    ),
+    "denied_done": "❌ *Solicitud Denegada - EntresHijos* ❌\n🎟️ Ticket #{ticket} procesado.",
+    "accepted_done": "✅ *Solicitud Aceptada - EntresHijos* ✅\n🎟️ Ticket #{ticket} procesado.",
+    "stats": "📊 *Estadísticas - EntresHijos* 📊\n{body}",
+    "bulk_accepted": (
+        "📢 *Actualización - EntresHijos* 📢\n"
+        "✅ Solicitudes Subidas: {count}\n"
+        "🔍 Busca en el canal correspondiente.\n"
+    ),
+    "bulk_denied": (
+        "📢 *Actualización - EntresHijos* 📢\n"
+        "❌ Solicitudes NO Aceptadas: {count}\n"
+        "Contacta a un admin si necesitas ayuda.\n"
+    ),
+    "bulk_line": "\n🎟️ Ticket #{ticket} · @{username}: {message}",
+    "followers_line": "\n👥 También lo pidieron: {mentions}",
+    "duplicate_followed": (
+        "🔗 *Solicitud Repetida - EntresHijos* 🔗\n"
+        "👤 @{follower}, ya hay una solicitud igual en cola.\n"
+        "🎟️ Ticket #{ticket}\n"
+        "📝 Mensaje: {message}\n"
+        "🕒 Fecha: {date}\n"
+        "🔔 Te avisaremos cuando se resuelva."
+    ),
+    "duplicate_own": (
+        "ℹ️ @{follower}, ya estás en esta solicitud - EntresHijos.\n"
+        "🎟️ Ticket #{ticket}\n"
+        "📝 Mensaje: {message}"
+    ),
+    "bulk_confirm": (
+        "⚠️ *Acción Masiva - EntresHijos* ⚠️\n"
+        "{verb} {count} tickets ({target}).\n"
+        "¿Confirmas?"
+    ),
+    "bulk_done": (
+        "✅ *Acción Masiva - EntresHijos* ✅\n"
+        "🎟️ {count} tickets {result}.\n"
+        "📢 Avisos enviados a {groups} grupos."
+    ),
+    "bulk_empty": "📪 No hay tickets abiertos para esta acción - EntresHijos. 😊",
+}
+
+def compile_template(text):
+    parts = TEMPLATE_TOKEN.split(text)
+    compiled = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            compiled.append(part)
+        else:
+            compiled.append(escape_markdown(part, version=2).replace("{", "{{").replace("}", "}}"))
+    return "".join(compiled)
+
+TEMPLATES = {name: compile_template(text) for name, text in TEMPLATE_TEXTS.items()}
+
+def escape(value):
+    return escape_markdown(str(value), version=2)
+
+# Campos escapados de la tarjeta de cada ticket abierto. RequestStore invalida
+# la entrada cuando cambia alguno de CARD_FIELDS o el ticket se cierra.
+class TicketCards:
+    def __init__(self):
+        self.cache = {}
+
+    def fields(self, request):
+        ticket = request["ticket"]
+        cached = self.cache.get(ticket)
+        if cached is None:
+            cached = {
+                "ticket": str(ticket),
+                "username": escape(request["username"]),
+                "message": escape(request["message"]),
+                "group_name": escape(request["group_name"]),
+                "date": escape(format_date(request)),
+                "status": escape(request.get("status", "en espera"))
+            }
+            if request_store.get(ticket) is request:
+                self.cache[ticket] = cached
+        return cached
+
+    def invalidate(self, ticket=None, fields=None):
+        if ticket is None:
+            self.cache.clear()
+        elif fields is None or any(field in CARD_FIELDS for field in fields):
+            self.cache.pop(ticket, None)
+
+ticket_cards = TicketCards()
+
+def render(name, request=None, **fields):
+    values = dict(ticket_cards.fields(request)) if request else {}
+    values.update((key, escape(value)) for key, value in fields.items())
+    return TEMPLATES[name].format(**values)
+
+def followers_text(request):
+    followers = request.get("followers")
+    if not followers:
+        return ""
+    return render("followers_line", mentions=", ".join(f"@{follower['username']}" for follower in followers))
+
+def follows(request, user_id):
+    return request["user_id"] == user_id or any(follower["user_id"] == user_id for follower in request.get("followers", ()))
+
+# === LISTA DE TICKETS ===
+# El callback de cada página lleva el cursor y los filtros: "tl_n<ticket>_<filtros>"
+# pide la página siguiente a <ticket> y "tl_p<ticket>_<filtros>" la anterior. Los
+# filtros se codifican como "p" (prioridad) y "g<grupo>", unidos por "." o "a"
+# sin filtros, para no pasar de los 64 bytes de callback_data. No hay filtro de
+# estado: aceptar o denegar cierra el ticket, así que todos siguen en espera.
+# "ts<ticket>_<cursor>_<filtros>" marca o desmarca un ticket para las acciones
+# masivas y "tc_<cursor>_<filtros>" vacía la selección; ambos vuelven a pintar
+# la misma página. La selección se guarda en user_data de cada admin.
+def encode_filters(filters):
+    parts = []
+    if filters.get("priority"):
+        parts.append("p")
+    if "group_id" in filters:
+        parts.append(f"g{filters['group_id']}")
+    return ".".join(parts) or "a"
+
+def decode_filters(code):
+    filters = {}
+    for part in code.split("."):
+        if part == "p":
+            filters["priority"] = True
+        elif part.startswith("g") and part[1:].lstrip("-").isdigit():
+            filters["group_id"] = int(part[1:])
+    return filters
+
+def cycle_filter(filters, field, values):
+    # Pasa al siguiente valor del filtro; tras el último se quita el filtro
+    filters = dict(filters)
+    values = list(values)
+    current = filters.pop(field, None)
+    if current not in values:
+        if values:
+            filters[field] = values[0]
+    elif values.index(current) + 1 < len(values):
+        filters[field] = values[values.index(current) + 1]
+    return filters
+
+def group_name(group_id):
+    tickets = request_store.index.get(("group_id", group_id))
+    return request_store.get(tickets[0])["group_name"] if tickets else str(group_id)
+
+async def show_ticket_page(query, filters, after=0, before=None, selected=()):
+    requests, has_prev, has_next = request_store.page(filters, after=after, before=before)
+    code = encode_filters(filters)
+    cursor = requests[0]["ticket"] - 1 if requests else after
+    keyboard = []
+    for req in requests:
+        priority_mark = "⭐ " if req.get("priority") else ""
+        followers_mark = f" 👥{len(req['followers'])}" if req.get("followers") else ""
+        button_text = f"{priority_mark}🎟️ Ticket #{req['ticket']} (@{req['username']}){followers_mark}"
+        keyboard.append([
+            InlineKeyboardButton(button_text, callback_data=f"manage_{req['ticket']}"),
+            InlineKeyboardButton("☑️" if req["ticket"] in selected else "⬜", callback_data=f"ts{req['ticket']}_{cursor}_{code}")
+        ])
+    if selected:
+        keyboard.append([
+            InlineKeyboardButton(f"✅ Aceptar ({len(selected)})", callback_data="bulk_a_s"),
+            InlineKeyboardButton(f"❌ Denegar ({len(selected)})", callback_data="bulk_d_s"),
+            InlineKeyboardButton("🧹 Limpiar", callback_data=f"tc_{cursor}_{code}")
+        ])
+    if "group_id" in filters and requests:
+        keyboard.append([
+            InlineKeyboardButton("✅ Aceptar grupo", callback_data=f"bulk_a_g{filters['group_id']}"),
+            InlineKeyboardButton("❌ Denegar grupo", callback_data=f"bulk_d_g{filters['group_id']}")
+        ])
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"tl_p{requests[0]['ticket']}_{code}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("➡️ Siguiente", callback_data=f"tl_n{requests[-1]['ticket']}_{code}"))
+    if navigation:
+        keyboard.append(navigation)
+    priority_filter = dict(filters)
+    if priority_filter.pop("priority", None) is None:
+        priority_filter["priority"] = True
+    group_filter = cycle_filter(filters, "group_id", request_store.index_values("group_id"))
+    keyboard.append([
+        InlineKeyboardButton("⭐ Prioridad" if filters.get("priority") else "☆ Prioridad", callback_data=f"tl_n0_{encode_filters(priority_filter)}"),
+        InlineKeyboardButton(f"🏠 {group_name(filters['group_id']) if 'group_id' in filters else 'Grupo'}", callback_data=f"tl_n0_{encode_filters(group_filter)}")
+    ])
+    keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data="tickets_start")])
+    text = render("ticket_list" if requests else "no_tickets_filtered")
+    msg = await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=PARSE_MODE)
+    deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
+
+# === ACCIONES MASIVAS ===
+# "bulk_<a|d>_<destino>" pide confirmación y "bulkok_<a|d>_<destino>" la
+# ejecuta; el destino es "s" (selección del admin), "g<grupo>" o "u<usuario>".
+# Los tickets se cierran en una sola escritura y cada grupo recibe un único
+# aviso con todos sus tickets (partido si pasa del límite de Telegram).
+BULK_ACTIONS = {"a": ("Aceptar", "subida", "aceptados", "bulk_accepted"), "d": ("Denegar", "no aceptada", "denegados", "bulk_denied")}
+MESSAGE_LIMIT = 4096  # Caracteres por mensaje en la Bot API
+
+def bulk_tickets(context: ContextTypes.DEFAULT_TYPE, target):
+    if target == "s":
+        return sorted(ticket for ticket in context.user_data.get("selected", ()) if request_store.get(ticket))
+    field = "group_id" if target[0] == "g" else "user_id"
+    return list(request_store.index.get((field, int(target[1:])), []))
+
+def bulk_target_name(target):
+    if target == "s":
+        return "selección"
+    if target[0] == "g":
+        return f"grupo {group_name(int(target[1:]))}"
+    return f"usuario {target[1:]}"
+
+def bulk_notices(requests, header):
+    texts, text = [], None
+    for request in requests:
+        line = render("bulk_line", request) + followers_text(request)
+        if text is None or len(text) + len(line) > MESSAGE_LIMIT:
+            if text:
+                texts.append(text)
+            text = render(header, count=len(requests))
+        text += line
+    texts.append(text)
+    return texts
+
+async def confirm_bulk(query, context: ContextTypes.DEFAULT_TYPE, verb_code, target):
+    tickets = bulk_tickets(context, target)
+    if not tickets:
+        msg = await query.edit_message_text(render("bulk_empty"), parse_mode=PARSE_MODE)
+    else:
+        keyboard = [
+            [InlineKeyboardButton(f"✔️ Confirmar ({len(tickets)})", callback_data=f"bulkok_{verb_code}_{target}")],
+            [InlineKeyboardButton("🔙 Cancelar", callback_data="view_tickets")]
+        ]
+        msg = await query.edit_message_text(
+            render("bulk_confirm", verb=BULK_ACTIONS[verb_code][0], count=len(tickets), target=bulk_target_name(target)),
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode=PARSE_MODE
+        )
+    deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
+
+async def resolve_bulk(query, context: ContextTypes.DEFAULT_TYPE, verb_code, target):
+    _, status, result, header = BULK_ACTIONS[verb_code]
+    async with across_workers():
+        removed = request_store.remove_many(bulk_tickets(context, target), status)
+    if not removed:
+        msg = await query.edit_message_text(render("bulk_empty"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
+        return
+    by_group = {}
+    for request in removed:
+        by_group.setdefault(request["group_id"], []).append(request)
+        # Los avisos de cola se borran en el siguiente barrido, no en este manejador
+        for chat_id, message_id in message_registry.pop(request["ticket"], "queue_notice"):
+            deletion_scheduler.schedule(chat_id, message_id, delay=0)
+        message_registry.pop(request["ticket"])
+    context.user_data["selected"] = set(context.user_data.get("selected", ())) - {request["ticket"] for request in removed}
+    await edit_tracked(query, render("bulk_done", count=len(removed), result=result, groups=len(by_group)), parse_mode=PARSE_MODE)
+    for group_id, requests in by_group.items():
+        for text in bulk_notices(requests, header):
+            context.application.create_task(
+                send_tracked(context, group_id, text, parse_mode=PARSE_MODE, rate_limit_args={"priority": PRIORITY_BULK})
+            )
+    logger.info("📦 %s tickets %s en bloque (%s grupos)", len(removed), result, len(by_group))
+
+# === COMANDOS PRINCIPALES ===
+async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("📝 Enviar Solicitud", callback_data="solicito_start")],
         [InlineKeyboardButton("ℹ️ Menú Admin", callback_data="tickets_start")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    msg = await update.message.reply_text(welcome_text, reply_markup=reply_markup, parse_mode="Markdown")
-    context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.message.chat_id, msg.message_id))
-    logger.info(f"🌱 Usuario {update.effective_user.id} ejecutó /start")
+    msg = await update.message.reply_text(render("welcome"), reply_markup=reply_markup, parse_mode=PARSE_MODE)
+    deletion_scheduler.schedule(update.message.chat_id, msg.message_id)
+    logger.info("🌱 Usuario %s ejecutó /start", update.effective_user.id)
 
 async def button_start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     action = query.data
     if action == "solicito_start":
-        msg = await query.edit_message_text(
-            "📝 **Enviar Solicitud - EntresHijos**\n"
-            "Usa `/solicito <tu_mensaje>` (ej. `/solicito Necesito ayuda`). 😊"
-        )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
-        logger.info(f"📝 Usuario {update.effective_user.id} accedió a enviar solicitud")
+        msg = await query.edit_message_text(render("solicito_help"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
+        logger.info("📝 Usuario %s accedió a enviar solicitud", update.effective_user.id)
     elif action == "tickets_start":
         await tickets_command(update, context)
-        logger.info(f"🔧 Usuario {update.effective_user.id} accedió al menú de tickets")
+        logger.info("🔧 Usuario %s accedió al menú de tickets", update.effective_user.id)
 
 async def solicito_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user = update.effective_user
     message = " ".join(context.args)
 
-    blacklist = load_blacklist()
-    if any(user.id == entry["user_id"] for entry in blacklist):
+    if blacklist.contains(user.id):
         msg = await update.message.reply_text(
-            f"⛔ @{escape_markdown(user.username or f'Usuario_{user.id}')} estás en la blacklist de EntresHijos. No puedes enviar solicitudes. 😔"
+            render("blacklisted", username=user.username or f"Usuario_{user.id}"), parse_mode=PARSE_MODE
         )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-        logger.warning(f"⛔ Usuario {user.id} intentó solicitar estando en blacklist")
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.warning("⛔ Usuario %s intentó solicitar estando en blacklist", user.id)
         return
 
     if not message:
-        msg = await update.message.reply_text("❌ ¡Ingresa un mensaje! Ejemplo: `/solicito Necesito ayuda` - EntresHijos. 😊")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-        logger.warning(f"🚫 Intento de solicitud sin mensaje por {user.id}")
+        msg = await update.message.reply_text(render("solicito_empty"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.warning("🚫 Intento de solicitud sin mensaje por %s", user.id)
         return
 
     try:
-        is_admin_user = await context.bot.get_chat_member(ADMIN_GROUP_ID, user.id)
-        is_admin_flag = is_admin_user.status in ["administrator", "creator"]
+        is_admin_flag = user.id in await admin_cache.admin_ids(context.bot, ADMIN_GROUP_ID)
     except TelegramError as e:
-        msg = await update.message.reply_text(f"❌ Error al verificar admin: {str(e)} - EntresHijos.")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-        logger.error(f"❌ Error al verificar admin: {str(e)}")
+        msg = await update.message.reply_text(render("admin_check_error", error=e), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.error("❌ Error al verificar admin: %s", e)
         return
 
     username = user.username or f"Usuario_{user.id}"
-    if not is_admin_flag:
-        request_count, _ = count_user_requests(user.id)
-        if request_count >= REQUEST_LIMIT:
-            reset_time = datetime.now() + timedelta(hours=24)
-            time_left = reset_time - datetime.now()
-            hours_left = int(time_left.total_seconds() // 3600)
-            minutes_left = int((time_left.total_seconds() % 3600) // 60)
-            msg = await update.message.reply_text(
-                f"⛔ @{escape_markdown(username)}, agotaste tus {REQUEST_LIMIT} solicitudes diarias - EntresHijos. 😔\n"
-                f"⏳ Vuelve en {hours_left}h {minutes_left}m (a las {reset_time.strftime('%H:%M:%S')})."
+    group_name = update.effective_chat.title or "Grupo sin nombre"
+    async with across_workers():
+        request_count, request_limit, reset_time = rate_limiter.check(user.id, chat_id)
+        limited = not is_admin_flag and request_count >= request_limit
+        duplicate = None if limited else request_store.find_duplicate(message, chat_id)
+        already_following = duplicate is not None and follows(duplicate, user.id)
+        if duplicate and not already_following:
+            request_store.add_follower(duplicate["ticket"], user.id, username)
+        if not limited and not duplicate:
+            request = request_store.create(
+                user_id=user.id,
+                username=username,
+                message=message,
+                group_id=chat_id,
+                group_name=group_name,
+                ts=int(time.time()),
+                source="EntresHijos",
+                priority=False,
+                status="en espera"
             )
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-            logger.info(f"⏰ Límite alcanzado por {username}")
-            return
+            rate_limiter.record(user.id, request["ts"], chat_id)
+    if limited:
+        reset_time = reset_time or datetime.now() + timedelta(seconds=rate_limiter.limits_for(chat_id)[1])
+        time_left = reset_time - datetime.now()
+        hours_left = int(time_left.total_seconds() // 3600)
+        minutes_left = int((time_left.total_seconds() % 3600) // 60)
+        msg = await update.message.reply_text(
+            render("limit_reached", username=username, limit=request_limit, hours=hours_left,
+                   minutes=minutes_left, reset=reset_time.strftime('%H:%M:%S')),
+            parse_mode=PARSE_MODE
+        )
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.info("⏰ Límite alcanzado por %s", username)
+        return
 
-    ticket = generate_ticket()
-    group_name = update.effective_chat.title or "Grupo sin nombre"
+    if duplicate:
+        # Se une a la solicitud existente: no crea ticket ni consume cupo
+        bind_log(ticket=duplicate["ticket"])
+        await send_tracked(
+            context, chat_id, render("duplicate_own" if already_following else "duplicate_followed", duplicate, follower=username),
+            duplicate["ticket"], "queue_notice", parse_mode=PARSE_MODE
+        )
+        logger.info("🔗 Solicitud de @%s unida al Ticket #%s", username, duplicate["ticket"])
+        return
 
-    data = load_requests()
-    request = {
-        "ticket": ticket,
-        "user_id": user.id,
-        "username": username,
-        "message": message,
-        "group_id": chat_id,
-        "group_name": group_name,
-        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "source": "EntresHijos",
-        "priority": False,
-        "status": "en espera"
-    }
-    data["requests"].append(request)
-    save_requests(data)
-
-    response_text = (
-        f"✅ **Solicitud Registrada - EntresHijos** 🎉\n"
-        f"👤 @{escape_markdown(username)}\n"
-        f"🎟️ Ticket #{ticket}\n"
-        f"📝 Mensaje: {escape_markdown(message)}\n"
-        f"🏠 Grupo: {escape_markdown(group_name)}\n"
-        f"🕒 Fecha: {request['date']}"
-    )
+    ticket = request["ticket"]
+    bind_log(ticket=ticket)
+
+    response_text = render("request_registered", request)
     if not is_admin_flag:
-        response_text += f"\n📊 Solicitudes restantes: {REQUEST_LIMIT - request_count - 1}"
-
-    msg = await context.bot.send_message(chat_id=chat_id, text=response_text, parse_mode="Markdown")
-    context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-
-    queue_msg = await context.bot.send_message(
-        chat_id=chat_id,
-        text=(
-            f"📢 **Solicitud en Cola - EntresHijos** ⏳\n"
-            f"👤 @{escape_markdown(username)}\n"
-            f"🎟️ Ticket #{ticket}\n"
-            f"📝 Mensaje: {escape_markdown(message)}\n"
-            f"🏠 Grupo: {escape_markdown(group_name)}\n"
-            f"🕒 Fecha: {request['date']}\n"
-            f"📋 Estado: En espera de revisión."
-        ),
-        parse_mode="Markdown"
-    )
-    context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, queue_msg.message_id))
-
-    admin_msg = await context.bot.send_message(
-        chat_id=ADMIN_GROUP_ID,
-        text=(
-            f"🔔 **Nueva Solicitud - EntresHijos** 🔔\n"
-            f"🎟️ Ticket #{ticket}\n"
-            f"👤 @{escape_markdown(username)}\n"
-            f"📝 Mensaje: {escape_markdown(message)}\n"
-            f"🏠 Grupo: {escape_markdown(group_name)}\n"
-            f"🕒 Fecha: {request['date']}\n"
-            f"🔧 Usa /tickets para gestionarla."
-        ),
-        parse_mode="Markdown"
+        response_text += render("requests_remaining", remaining=request_limit - request_count - 1)
+    queue_text = render("queue_notice", request)
+    admin_text = render("admin_notification", request)
+
+    # La notificación a admins sigue en segundo plano; el manejador solo
+    # espera a los mensajes que ve el usuario.
+    context.application.create_task(
+        send_tracked(context, ADMIN_GROUP_ID, admin_text, ticket, "admin_notification",
+                     parse_mode=PARSE_MODE, rate_limit_args={"priority": PRIORITY_BULK}),
+        update=update
     )
-    context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(ADMIN_GROUP_ID, admin_msg.message_id))
-    logger.info(f"📥 Solicitud registrada - Ticket #{ticket} por @{username}")
+    if MERGE_CONFIRMATION:
+        await send_tracked(context, chat_id, response_text + render("queue_status"), ticket, "queue_notice", parse_mode=PARSE_MODE)
+    else:
+        # Dos mensajes al mismo chat: el aviso de cola no retrasa la respuesta
+        context.application.create_task(
+            send_tracked(context, chat_id, queue_text, ticket, "queue_notice", parse_mode=PARSE_MODE), update=update
+        )
+        await send_tracked(context, chat_id, response_text, ticket, "user_confirmation", parse_mode=PARSE_MODE)
+    logger.info("📥 Solicitud registrada - Ticket #%s por @%s", ticket, username)
 
 async def tickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update, context):
         return
 
-    data = load_requests()
-    if not data["requests"]:
+    if not request_store.by_ticket:
         msg = await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text="📪 **Sin Solicitudes - EntresHijos** 😊\nNo hay tickets pendientes."
+            text=render("no_tickets"),
+            parse_mode=PARSE_MODE
         )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+        deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
         await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
         return
 
@@ -331,11 +3103,11 @@ async def tickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     msg = await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="🔧 **Menú de Gestión - EntresHijos** 🔧\nSelecciona una opción:",
+        text=render("admin_menu"),
         reply_markup=reply_markup,
-        parse_mode="Markdown"
+        parse_mode=PARSE_MODE
     )
-    context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+    deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
     await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
     logger.info("🔧 Menú de tickets mostrado")
 
@@ -347,11 +3119,11 @@ async def blacklist_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     msg = await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="⛔ **Blacklist - EntresHijos** ⛔\nPulsa para añadir un usuario a la blacklist.",
+        text=render("blacklist_menu"),
         reply_markup=reply_markup,
-        parse_mode="Markdown"
+        parse_mode=PARSE_MODE
     )
-    context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+    deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
     await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
     logger.info("⛔ Menú de blacklist mostrado")
 
@@ -359,29 +3131,30 @@ async def unblacklist_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not await is_admin(update, context):
         return
 
-    blacklist = load_blacklist()
-    if not blacklist:
+    entries = blacklist.entries()
+    if not entries:
         msg = await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text="✅ **Blacklist Vacía - EntresHijos** ✅\nNo hay usuarios bloqueados."
+            text=render("blacklist_empty"),
+            parse_mode=PARSE_MODE
         )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+        deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
         await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
         return
 
     keyboard = []
-    for entry in blacklist:
-        button_text = f"❌ @{escape_markdown(entry['username'])} (ID: {entry['user_id']})"
+    for entry in entries:
+        button_text = f"❌ @{entry['username']} (ID: {entry['user_id']})"
         keyboard.append([InlineKeyboardButton(button_text, callback_data=f"remove_from_blacklist_{entry['user_id']}")])
     keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data="blacklist_start")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     msg = await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="✅ **Lista de Blacklist - EntresHijos** ✅\nSelecciona un usuario para desbloquear:",
+        text=render("blacklist_list"),
         reply_markup=reply_markup,
-        parse_mode="Markdown"
+        parse_mode=PARSE_MODE
     )
-    context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+    deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
     await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
     logger.info("✅ Menú de unblacklist mostrado")
 
@@ -389,79 +3162,161 @@ async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update, context):
         return
     if not context.args or len(context.args) < 2:
-        msg = await update.message.reply_text("❌ Uso: `/reply <ticket> <mensaje>` - EntresHijos.", parse_mode="Markdown")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+        msg = await update.message.reply_text(render("reply_usage"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
         await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
         logger.warning("🚫 Uso incorrecto de /reply")
         return
     try:
         ticket = int(context.args[0])
     except ValueError:
-        msg = await update.message.reply_text("❌ Ticket debe ser numérico. Ejemplo: `/reply 1 Hola` - EntresHijos.", parse_mode="Markdown")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+        msg = await update.message.reply_text(render("reply_bad_ticket"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
         await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
         logger.warning("🚫 Ticket inválido en /reply")
         return
     reply_message = " ".join(context.args[1:])
-    data = load_requests()
-    request = next((req for req in data["requests"] if req["ticket"] == ticket), None)
+    request = request_store.get(ticket)
     if request:
-        user_response = (
-            f"📩 **Respuesta - EntresHijos** 📩\n"
-            f"🎟️ Ticket #{ticket}\n"
-            f"👤 @{escape_markdown(request['username'])}\n"
-            f"📝 Respuesta: {escape_markdown(reply_message)}"
-        )
-        admin_response = (
-            f"📢 **Respuesta Enviada - EntresHijos** 📢\n"
-            f"🎟️ Ticket #{ticket}\n"
-            f"👤 @{escape_markdown(request['username'])}\n"
-            f"📝 Mensaje: {escape_markdown(reply_message)}"
-        )
-        await context.bot.send_message(chat_id=request["group_id"], text=user_response, parse_mode="Markdown")
-        msg = await context.bot.send_message(chat_id=update.effective_chat.id, text=admin_response, parse_mode="Markdown")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+        user_response = render("reply_user", request, reply=reply_message)
+        admin_response = render("reply_admin", request, reply=reply_message)
+        await context.bot.send_message(chat_id=request["group_id"], text=user_response, parse_mode=PARSE_MODE, rate_limit_args={"priority": PRIORITY_BULK})
+        msg = await context.bot.send_message(chat_id=update.effective_chat.id, text=admin_response, parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
         await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
-        logger.info(f"📩 Respuesta enviada para Ticket #{ticket}")
+        logger.info("📩 Respuesta enviada para Ticket #%s", ticket)
     else:
-        msg = await update.message.reply_text(f"❌ Ticket #{ticket} no encontrado - EntresHijos.", parse_mode="Markdown")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.effective_chat.id, msg.message_id))
+        msg = await update.message.reply_text(render("ticket_not_found", ticket=ticket), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
         await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
-        logger.warning(f"🚫 Ticket #{ticket} no encontrado")
+        logger.warning("🚫 Ticket #%s no encontrado", ticket)
+
+async def cupo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context):
+        return
+    if len(context.args) != 2 or not context.args[0].isdigit() or not context.args[1].lstrip("-").isdigit():
+        msg = await update.message.reply_text(render("cupo_usage"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
+        logger.warning("🚫 Uso incorrecto de /cupo")
+        return
+    user_id, amount = int(context.args[0]), int(context.args[1])
+    extra = rate_limiter.grant(user_id, amount)
+    if request_store.shared:
+        request_store.record({"op": "grant", "user_id": user_id, "amount": amount})
+    msg = await update.message.reply_text(render("cupo_granted", user_id=user_id, extra=extra), parse_mode=PARSE_MODE)
+    deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
+    logger.info("🎁 Cupo extra de %s concedido a ID %s (total %s)", amount, user_id, extra)
+
+def stats_text():
+    def ms(seconds):
+        return "∞" if seconds == float("inf") else f"{seconds * 1000:.0f}"
+
+    uptime = int(time.time() - metrics.started)
+    lines = [f"⏱️ Activo: {uptime // 3600}h {uptime % 3600 // 60}m"]
+    handler_errors = {dict(labels)["handler"]: value for labels, value in metrics.counter_values("handler_errors_total").items()}
+    handlers = sorted(metrics.histogram_values("handler_seconds").items(), key=lambda item: -item[1].count)
+    lines.append(f"📥 Updates: {sum(h.count for _, h in handlers)} (errores: {sum(handler_errors.values())})")
+    for labels, histogram in handlers:
+        name = dict(labels)["handler"]
+        lines.append(f"  • {name}: {histogram.count} · p50 {ms(histogram.quantile(0.5))} / p99 {ms(histogram.quantile(0.99))} ms")
+    api = sorted(metrics.histogram_values("api_seconds").items(), key=lambda item: -item[1].count)
+    api_errors = metrics.counter_values("api_errors_total")
+    retry_after = sum(value for labels, value in api_errors.items() if dict(labels)["error"] == "RetryAfter")
+    lines.append(f"📡 Bot API: {sum(h.count for _, h in api)} llamadas, {sum(api_errors.values())} errores, {retry_after} RetryAfter")
+    for labels, histogram in api[:6]:
+        lines.append(f"  • {dict(labels)['method']}: {histogram.count} · p50 {ms(histogram.quantile(0.5))} / p99 {ms(histogram.quantile(0.99))} ms")
+    gauges = metrics.gauge_values()
+    lines.append(f"🚦 Cola de salida: {gauges.get('outbound_queue_depth', 0)} en espera, espera media {outbound_limiter.average_wait() * 1000:.0f} ms")
+    lines.append(f"📬 Updates en cola: {gauges.get('update_queue_depth', 0)} · Trabajos programados: {gauges.get('job_queue_jobs', 0)}")
+    writes = metrics.histogram_values("storage_write_seconds")
+    write_count = sum(h.count for h in writes.values())
+    write_avg = sum(h.total for h in writes.values()) / write_count if write_count else 0
+    lines.append(f"💾 Escrituras: {write_count} (media {write_avg * 1000:.1f} ms) · Tamaño: {gauges.get('storage_bytes', 0) / 1024:.0f} KB")
+    lines.append(
+        f"🎟️ Tickets abiertos: {gauges.get('open_tickets', 0)} · ⛔ Blacklist: {gauges.get('blacklist_users', 0)} · "
+        f"🗑️ Borrados pendientes: {gauges.get('pending_deletions', 0)}"
+    )
+    if profiler:
+        hot = ", ".join(f"{name} ({hits})" for name, hits in profiler.top(3))
+        lines.append(f"🔥 Perfil: {hot or 'sin muestras'}")
+    return "\n".join(lines)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context):
+        return
+    msg = await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text=render("stats", body=stats_text()),
+        parse_mode=PARSE_MODE
+    )
+    deletion_scheduler.schedule(update.effective_chat.id, msg.message_id)
+    await clean_admin_messages(context, update.effective_chat.id, msg.message_id)
+    logger.info("📊 Estadísticas mostradas")
+
+async def exportar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin(update, context):
+        return
+    chat_id = update.effective_chat.id
+    if not RETENTION_ARCHIVE:
+        msg = await update.message.reply_text(render("export_disabled"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        return
+    try:
+        start, end = (datetime.strptime(arg, "%Y-%m-%d") for arg in context.args)
+        if end < start:
+            raise ValueError(end)
+    except ValueError:
+        msg = await update.message.reply_text(render("export_usage"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.warning("🚫 Uso incorrecto de /exportar")
+        return
+    first, last = context.args
+    # La lectura de los segmentos y el CSV se generan fuera del bucle de eventos
+    path, count = await asyncio.to_thread(request_archive.export, start.timestamp(), (end + timedelta(days=1)).timestamp())
+    try:
+        if not count:
+            msg = await update.message.reply_text(render("export_empty", start=first, end=last), parse_mode=PARSE_MODE)
+            deletion_scheduler.schedule(chat_id, msg.message_id)
+        else:
+            with open(path, "rb") as f:
+                await context.bot.send_document(
+                    chat_id=chat_id, document=f, filename=f"solicitudes_{first}_{last}.csv",
+                    caption=render("export_done", count=count, start=first, end=last), parse_mode=PARSE_MODE
+                )
+    finally:
+        os.remove(path)
+    logger.info("📤 Exportadas %s solicitudes archivadas (%s a %s)", count, first, last)
 
 async def pendiente_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     user = update.effective_user
     if not context.args or not context.args[0].isdigit():
-        msg = await update.message.reply_text("❌ Uso: `/pendiente <ticket>` - EntresHijos. 😊", parse_mode="Markdown")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-        logger.warning(f"🚫 Intento de /pendiente sin ticket por {user.id}")
+        msg = await update.message.reply_text(render("pendiente_usage"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.warning("🚫 Intento de /pendiente sin ticket por %s", user.id)
         return
     ticket = int(context.args[0])
-    data = load_requests()
-    request = next((req for req in data["requests"] if req["ticket"] == ticket and req["user_id"] == user.id), None)
+    request = request_store.get(ticket)
+    if request is None and RETENTION_ARCHIVE:
+        request = await asyncio.to_thread(request_archive.find, ticket)
+    if request and not follows(request, user.id):
+        request = None
     if request:
         status = request.get("status", "en espera")
-        response_text = (
-            f"ℹ️ **Estado - EntresHijos** ℹ️\n"
-            f"🎟️ Ticket #{ticket}\n"
-            f"👤 @{escape_markdown(request['username'])}\n"
-            f"📝 Mensaje: {escape_markdown(request['message'])}\n"
-            f"🏠 Grupo: {escape_markdown(request['group_name'])}\n"
-            f"🕒 Fecha: {request['date']}\n"
-            f"📋 Estado: {status}"
-        )
+        response_text = render("ticket_status", request)
         if status == "subida":
-            response_text += "\n🔍 Busca en el canal correspondiente."
+            response_text += render("status_uploaded_hint")
         elif status == "no aceptada":
-            response_text += "\n❌ Contacta a un admin si necesitas ayuda."
-        msg = await update.message.reply_text(response_text, parse_mode="Markdown")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-        logger.info(f"ℹ️ Estado de Ticket #{ticket} mostrado a @{request['username']}")
+            response_text += render("status_denied_hint")
+        elif status == "caducada":
+            response_text += render("status_expired_hint")
+        msg = await update.message.reply_text(response_text, parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.info("ℹ️ Estado de Ticket #%s mostrado a @%s", ticket, request['username'])
     else:
-        msg = await update.message.reply_text(f"❌ Ticket #{ticket} no encontrado o no te pertenece - EntresHijos. 😕", parse_mode="Markdown")
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(chat_id, msg.message_id))
-        logger.warning(f"🚫 Ticket #{ticket} no encontrado para {user.id}")
+        msg = await update.message.reply_text(render("ticket_not_owned", ticket=ticket), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(chat_id, msg.message_id)
+        logger.warning("🚫 Ticket #%s no encontrado para %s", ticket, user.id)
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -469,261 +3324,333 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     action = query.data
 
     if action == "solicito_start":
-        msg = await query.edit_message_text(
-            "📝 **Enviar Solicitud - EntresHijos**\n"
-            "Usa `/solicito <tu_mensaje>` (ej. `/solicito Necesito ayuda`). 😊"
-        )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
+        msg = await query.edit_message_text(render("solicito_help"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
     elif action == "tickets_start":
         await tickets_command(update, context)
     elif action == "view_tickets":
-        data = load_requests()
-        sorted_requests = sorted(data["requests"], key=lambda x: x["date"])
-        if not sorted_requests:
-            msg = await query.edit_message_text("📪 **Sin Solicitudes - EntresHijos** 😊\nNo hay tickets pendientes.")
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
+        if not request_store.by_ticket:
+            msg = await query.edit_message_text(render("no_tickets"), parse_mode=PARSE_MODE)
+            deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
             return
-        keyboard = []
-        for req in sorted_requests:
-            status_mark = f" ({req['status']})" if req["status"] != "en espera" else ""
-            button_text = f"🎟️ Ticket #{req['ticket']}{status_mark} (@{req['username']})"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"manage_{req['ticket']}")])
-        keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data="tickets_start")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        msg = await query.edit_message_text(
-            "📋 **Lista de Tickets - EntresHijos** 📋\nSelecciona un ticket para gestionarlo:",
-            reply_markup=reply_markup,
-            parse_mode="Markdown"
-        )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
-    elif action.startswith("manage_"):
+        await show_ticket_page(query, {}, selected=context.user_data.get("selected", set()))
+    elif action.startswith("tl_"):
+        _, cursor, code = action.split("_", 2)
+        filters = decode_filters(code)
+        selected = context.user_data.get("selected", set())
+        if cursor[0] == "p":
+            await show_ticket_page(query, filters, before=int(cursor[1:]), selected=selected)
+        else:
+            await show_ticket_page(query, filters, after=int(cursor[1:]), selected=selected)
+    elif action.startswith("ts") or action.startswith("tc_"):
+        target, cursor, code = action.split("_", 2)
+        selected = context.user_data.setdefault("selected", set())
+        if target == "tc":
+            selected.clear()
+        else:
+            selected ^= {int(target[2:])}
+        await show_ticket_page(query, decode_filters(code), after=int(cursor), selected=selected)
+    elif action.startswith("bulk_") or action.startswith("bulkok_"):
+        step, verb_code, target = action.split("_", 2)
+        if step == "bulk":
+            await confirm_bulk(query, context, verb_code, target)
+        else:
+            await resolve_bulk(query, context, verb_code, target)
+    elif action.startswith("manage_") or action.startswith("priority_"):
         ticket = int(action.split("_")[1])
-        data = load_requests()
-        request = next((req for req in data["requests"] if req["ticket"] == ticket), None)
+        request = request_store.get(ticket)
+        if request and action.startswith("priority_"):
+            request = request_store.update(ticket, priority=not request.get("priority"))
+            logger.info("⭐ Prioridad de Ticket #%s: %s", ticket, request['priority'])
         if not request:
-            msg = await query.edit_message_text(f"❌ Ticket #{ticket} no encontrado - EntresHijos. 😕")
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
+            msg = await query.edit_message_text(render("ticket_missing", ticket=ticket), parse_mode=PARSE_MODE)
+            deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
             return
         keyboard = [
             [InlineKeyboardButton("❌ Denegar", callback_data=f"deny_{ticket}")],
             [InlineKeyboardButton("✅ Aceptar", callback_data=f"accept_{ticket}")],
             [InlineKeyboardButton("📩 Responder", callback_data=f"reply_{ticket}")],
-            [InlineKeyboardButton("🔙 Volver", callback_data="view_tickets")]
+            [InlineKeyboardButton("☆ Quitar prioridad" if request.get("priority") else "⭐ Marcar prioridad", callback_data=f"priority_{ticket}")]
         ]
+        user_tickets = len(request_store.index.get(("user_id", request["user_id"]), []))
+        if user_tickets > 1:
+            keyboard.append([
+                InlineKeyboardButton(f"✅ Aceptar todas ({user_tickets})", callback_data=f"bulk_a_u{request['user_id']}"),
+                InlineKeyboardButton(f"❌ Denegar todas ({user_tickets})", callback_data=f"bulk_d_u{request['user_id']}")
+            ])
+        keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data="view_tickets")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         msg = await query.edit_message_text(
-            f"📋 **Ticket #{ticket} - EntresHijos** 📋\n"
-            f"👤 @{escape_markdown(request['username'])}\n"
-            f"📝 Mensaje: {escape_markdown(request['message'])}\n"
-            f"🏠 Grupo: {escape_markdown(request['group_name'])}\n"
-            f"🕒 Fecha: {request['date']}\n"
-            f"📋 Estado: {request.get('status', 'en espera')}\n"
-            f"🔧 ¿Qué acción deseas tomar?",
+            render("ticket_panel", request) + followers_text(request),
             reply_markup=reply_markup,
-            parse_mode="Markdown"
+            parse_mode=PARSE_MODE
         )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
+        deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
     elif action.startswith("deny_"):
         ticket = int(action.split("_")[1])
-        data = load_requests()
-        request = next((req for req in data["requests"] if req["ticket"] == ticket), None)
+        async with across_workers():
+            request = request_store.remove(ticket, status="no aceptada")
         if request:
-            request["status"] = "no aceptada"
-            data["requests"] = [req for req in data["requests"] if req["ticket"] != ticket]
-            save_requests(data)
-            notification = (
-                f"📢 **Actualización - EntresHijos** 📢\n"
-                f"👤 @{escape_markdown(request['username'])}\n"
-                f"🎟️ Ticket #{ticket}\n"
-                f"📝 Mensaje: {escape_markdown(request['message'])}\n"
-                f"🏠 Grupo: {escape_markdown(request['group_name'])}\n"
-                f"🕒 Fecha: {request['date']}\n"
-                f"❌ Estado: Solicitud NO Aceptada\n"
-                f"Contacta a un admin si necesitas ayuda."
-            )
-            msg = await context.bot.send_message(chat_id=request["group_id"], text=notification, parse_mode="Markdown")
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(request["group_id"], msg.message_id))
-            try:
-                updates = await context.bot.get_updates(offset=-1, limit=50)
-                for update in updates:
-                    if (update.message and update.message.chat_id == request["group_id"] and
-                        f"Ticket #{ticket}" in update.message.text and "Solicitud en Cola" in update.message.text):
-                        await context.bot.delete_message(chat_id=request["group_id"], message_id=update.message.message_id)
-                        logger.info(f"🗑️ Mensaje 'Solicitud en Cola' eliminado (Ticket #{ticket})")
-                        break
-            except TelegramError as e:
-                logger.error(f"⚠️ Error al eliminar mensaje original (Ticket #{ticket}): {str(e)}")
-            msg = await query.edit_message_text(
-                f"❌ **Solicitud Denegada - EntresHijos** ❌\n"
-                f"🎟️ Ticket #{ticket} procesado."
+            # El aviso al grupo va en segundo plano: el clic solo espera a la edición del panel
+            context.application.create_task(
+                send_tracked(context, request["group_id"], render("request_denied", request) + followers_text(request), parse_mode=PARSE_MODE, rate_limit_args={"priority": PRIORITY_BULK}),
+                update=update
             )
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
-            logger.info(f"❌ Ticket #{ticket} denegado")
+            context.application.create_task(delete_messages(context, message_registry.pop(ticket, "queue_notice")), update=update)
+            message_registry.pop(ticket)
+            await edit_tracked(query, render("denied_done", ticket=ticket), parse_mode=PARSE_MODE)
+            logger.info("❌ Ticket #%s denegado", ticket)
     elif action.startswith("accept_"):
         ticket = int(action.split("_")[1])
-        data = load_requests()
-        request = next((req for req in data["requests"] if req["ticket"] == ticket), None)
+        async with across_workers():
+            request = request_store.remove(ticket, status="subida")
         if request:
-            request["status"] = "subida"
-            data["requests"] = [req for req in data["requests"] if req["ticket"] != ticket]
-            save_requests(data)
-            notification = (
-                f"📢 **Actualización - EntresHijos** 📢\n"
-                f"👤 @{escape_markdown(request['username'])}\n"
-                f"🎟️ Ticket #{ticket}\n"
-                f"📝 Mensaje: {escape_markdown(request['message'])}\n"
-                f"🏠 Grupo: {escape_markdown(request['group_name'])}\n"
-                f"🕒 Fecha: {request['date']}\n"
-                f"✅ Estado: Solicitud Subida\n"
-                f"🔍 Busca en el canal correspondiente."
-            )
-            msg = await context.bot.send_message(chat_id=request["group_id"], text=notification, parse_mode="Markdown")
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(request["group_id"], msg.message_id))
-            try:
-                updates = await context.bot.get_updates(offset=-1, limit=50)
-                for update in updates:
-                    if (update.message and update.message.chat_id == request["group_id"] and
-                        f"Ticket #{ticket}" in update.message.text and "Solicitud en Cola" in update.message.text):
-                        await context.bot.delete_message(chat_id=request["group_id"], message_id=update.message.message_id)
-                        logger.info(f"🗑️ Mensaje 'Solicitud en Cola' eliminado (Ticket #{ticket})")
-                        break
-            except TelegramError as e:
-                logger.error(f"⚠️ Error al eliminar mensaje original (Ticket #{ticket}): {str(e)}")
-            msg = await query.edit_message_text(
-                f"✅ **Solicitud Aceptada - EntresHijos** ✅\n"
-                f"🎟️ Ticket #{ticket} procesado."
+            # El aviso al grupo va en segundo plano: el clic solo espera a la edición del panel
+            context.application.create_task(
+                send_tracked(context, request["group_id"], render("request_accepted", request) + followers_text(request), parse_mode=PARSE_MODE, rate_limit_args={"priority": PRIORITY_BULK}),
+                update=update
             )
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
-            logger.info(f"✅ Ticket #{ticket} aceptado")
+            context.application.create_task(delete_messages(context, message_registry.pop(ticket, "queue_notice")), update=update)
+            message_registry.pop(ticket)
+            await edit_tracked(query, render("accepted_done", ticket=ticket), parse_mode=PARSE_MODE)
+            logger.info("✅ Ticket #%s aceptado", ticket)
     elif action.startswith("reply_"):
         ticket = int(action.split("_")[1])
-        data = load_requests()
-        request = next((req for req in data["requests"] if req["ticket"] == ticket), None)
+        request = request_store.get(ticket)
         if request:
-            msg = await query.edit_message_text(
-                f"📩 **Responder - EntresHijos** 📩\n"
-                f"🎟️ Ticket #{ticket}\n"
-                f"Usa `/reply {ticket} <mensaje>` (ej. `/reply {ticket} Solicitud procesada`)."
-            )
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
-            logger.info(f"📩 Opción de respuesta para Ticket #{ticket} activada")
+            msg = await query.edit_message_text(render("reply_prompt", ticket=ticket), parse_mode=PARSE_MODE)
+            deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
+            logger.info("📩 Opción de respuesta para Ticket #%s activada", ticket)
     elif action == "add_to_blacklist":
-        msg = await query.edit_message_text(
-            "⛔ **Añadir a Blacklist - EntresHijos** ⛔\n"
-            "Envía el @name del usuario a bloquear (ej. @username).",
-            parse_mode="Markdown"
-        )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
+        msg = await query.edit_message_text(render("blacklist_prompt"), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
         context.user_data["awaiting_blacklist"] = True
         logger.info("⛔ Esperando @name para añadir a blacklist")
     elif action.startswith("remove_from_blacklist_"):
         user_id = int(action.split("_")[2])
-        blacklist = load_blacklist()
-        blacklist = [entry for entry in blacklist if entry["user_id"] != user_id]
-        save_blacklist(blacklist)
-        msg = await query.edit_message_text(
-            f"✅ **Usuario Desbloqueado - EntresHijos** ✅\n"
-            f"ID {user_id} eliminado de la blacklist."
-        )
-        context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(query.message.chat_id, msg.message_id))
-        logger.info(f"✅ Usuario ID {user_id} desbloqueado")
+        blacklist.remove(user_id)
+        msg = await query.edit_message_text(render("blacklist_removed", user_id=user_id), parse_mode=PARSE_MODE)
+        deletion_scheduler.schedule(query.message.chat_id, msg.message_id)
+        logger.info("✅ Usuario ID %s desbloqueado", user_id)
 
 async def reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message and context.user_data.get("awaiting_blacklist"):
-        username = update.message.text.strip()
+        parts = update.message.text.split()
+        username = parts[0] if parts else ""
+        duration = parse_duration(parts[1]) if len(parts) > 1 else None
         if not username.startswith("@"):
-            msg = await update.message.reply_text("❌ El @name debe comenzar con @ - EntresHijos. 😕", parse_mode="Markdown")
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.message.chat_id, msg.message_id))
+            msg = await update.message.reply_text(render("blacklist_bad_name"), parse_mode=PARSE_MODE)
+            deletion_scheduler.schedule(update.message.chat_id, msg.message_id)
             return
         try:
             user = await context.bot.get_chat_member(update.message.chat_id, username[1:])
             user_id = user.user.id
-            blacklist = load_blacklist()
-            if any(entry["user_id"] == user_id for entry in blacklist):
-                msg = await update.message.reply_text(f"⛔ @{escape_markdown(username[1:])} ya está en la blacklist - EntresHijos. 😕", parse_mode="Markdown")
-                context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.message.chat_id, msg.message_id))
+            if blacklist.contains(user_id):
+                msg = await update.message.reply_text(render("blacklist_exists", username=username[1:]), parse_mode=PARSE_MODE)
+                deletion_scheduler.schedule(update.message.chat_id, msg.message_id)
             else:
-                blacklist.append({"username": username[1:], "user_id": user_id})
-                save_blacklist(blacklist)
+                blacklist.add(user_id, username[1:], time.time() + duration if duration else None)
+                until = f" hasta {(datetime.now() + timedelta(seconds=duration)).strftime(DATE_FORMAT)}" if duration else ""
                 msg = await update.message.reply_text(
-                    f"⛔ **Usuario Añadido a Blacklist - EntresHijos** ⛔\n"
-                    f"@{escape_markdown(username[1:])} (ID: {user_id}) bloqueado.",
-                    parse_mode="Markdown"
+                    render("blacklist_added", username=username[1:], user_id=user_id, until=until),
+                    parse_mode=PARSE_MODE
                 )
-                context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.message.chat_id, msg.message_id))
+                deletion_scheduler.schedule(update.message.chat_id, msg.message_id)
             del context.user_data["awaiting_blacklist"]
-            logger.info(f"⛔ @{username[1:]} (ID: {user_id}) añadido a blacklist")
+            logger.info("⛔ @%s (ID: %s) añadido a blacklist", username[1:], user_id)
         except TelegramError as e:
-            msg = await update.message.reply_text(f"❌ Error al añadir a blacklist: {str(e)} - EntresHijos.", parse_mode="Markdown")
-            context.job_queue.run_once(auto_delete_message, AUTO_DELETE_TIME, data=(update.message.chat_id, msg.message_id))
+            msg = await update.message.reply_text(render("blacklist_error", error=e), parse_mode=PARSE_MODE)
+            deletion_scheduler.schedule(update.message.chat_id, msg.message_id)
             del context.user_data["awaiting_blacklist"]
-            logger.error(f"❌ Error al añadir a blacklist: {str(e)}")
+            logger.error("❌ Error al añadir a blacklist: %s", e)
     await update.message.delete()
 
-# === FUNCIÓN PRINCIPAL ===
-async def main():
-    # Verificar instancia única
-    check_single_instance()
+# === CICLO DE VIDA ===
+def register_gauges(application: Application):
+    metrics.gauge("storage_bytes", lambda: storage.size())
+    metrics.gauge("open_tickets", lambda: len(request_store.by_ticket))
+    metrics.gauge("blacklist_users", lambda: len(blacklist.by_user))
+    metrics.gauge("pending_deletions", lambda: len(deletion_scheduler))
+    metrics.gauge("outbound_queue_depth", outbound_limiter.queue_depth)
+    metrics.gauge("update_queue_depth", application.update_queue.qsize)
+    metrics.gauge("job_queue_jobs", lambda: len(application.job_queue.jobs()))
+    metrics.gauge("log_queue_depth", lambda: log_queue.qsize())
+    metrics.gauge("archive_pending", lambda: len(request_archive.pending))
 
-    # Crear la aplicación
-    application = Application.builder().token(TOKEN).job_queue(JobQueue()).build()
+async def on_startup(application: Application):
+    global storage, metrics_server, profiler
+    storage = create_storage()
+    with metrics.timer("storage_read_seconds", store="RequestStore"):
+        request_store.load(storage)
+    rate_limiter.rebuild(request_store.all())
+    request_store.rate_limiter = rate_limiter
+    with metrics.timer("storage_read_seconds", store="Blacklist"):
+        blacklist.load(storage)
+    storage_writer.register(blacklist)
+    with metrics.timer("storage_read_seconds", store="MessageRegistry"):
+        message_registry.load(storage)
+    storage_writer.register(message_registry)
+    with metrics.timer("storage_read_seconds", store="DeletionScheduler"):
+        deletion_scheduler.load(storage)
+    storage_writer.register(deletion_scheduler)
+    register_gauges(application)
+    if METRICS_PORT:
+        metrics_server = await asyncio.start_server(metrics_endpoint, METRICS_HOST, METRICS_PORT)
+        logger.info("📈 Métricas en http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    if PROFILE_INTERVAL:
+        profiler = SamplingProfiler(PROFILE_INTERVAL, PROFILE_FILE)
+        profiler.start()
+        logger.info("🔥 Perfilador activo cada %ss en %s", PROFILE_INTERVAL, PROFILE_FILE)
+    try:
+        admin_ids = await admin_cache.admin_ids(application.bot, ADMIN_GROUP_ID)
+        logger.info("👑 %s admins precargados (bot admin: %s)", len(admin_ids), admin_cache.bot_is_admin)
+    except TelegramError as e:
+        logger.warning("⚠️ No se pudo precargar la lista de admins: %s", e)
+    if RETENTION_ARCHIVE:
+        request_store.archive = request_archive
+        storage_writer.register(request_archive)
+    storage_writer.register(request_store)
+    storage_writer.start()
 
-    # Limpiar sesiones previas de Telegram
-    await clear_telegram_sessions(application)
+async def on_shutdown(application: Application):
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    if profiler:
+        profiler.stop()
+    storage_writer.stop()
+    storage.close()
+
+# === FUNCIÓN PRINCIPAL ===
+def build_application():
+    # Crear la aplicación
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .job_queue(JobQueue())
+        .rate_limiter(outbound_limiter)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if UPDATE_MODE == "webhook":
+        builder.update_queue(asyncio.Queue(WEBHOOK_QUEUE_SIZE))
+    application = builder.build()
 
     # Registrar manejadores
-    application.add_handler(CommandHandler("start", start_handler))
-    application.add_handler(CommandHandler("solicito", solicito_command))
-    application.add_handler(CommandHandler("tickets", tickets_command))
-    application.add_handler(CommandHandler("blacklist", blacklist_command))
-    application.add_handler(CommandHandler("unblacklist", unblacklist_command))
-    application.add_handler(CommandHandler("reply", reply_command))
-    application.add_handler(CommandHandler("pendiente", pendiente_command))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, reply_handler))
+    application.add_handler(CommandHandler("start", serialized(start_handler)))
+    application.add_handler(CommandHandler("solicito", serialized(solicito_command)))
+    application.add_handler(CommandHandler("tickets", serialized(tickets_command)))
+    application.add_handler(CommandHandler("blacklist", serialized(blacklist_command)))
+    application.add_handler(CommandHandler("unblacklist", serialized(unblacklist_command)))
+    application.add_handler(CommandHandler("reply", serialized(reply_command)))
+    application.add_handler(CommandHandler("pendiente", serialized(pendiente_command)))
+    application.add_handler(CommandHandler("cupo", serialized(cupo_command)))
+    application.add_handler(CommandHandler("stats", serialized(stats_command)))
+    application.add_handler(CommandHandler("exportar", serialized(exportar_command)))
+    application.add_handler(CallbackQueryHandler(serialized(button_handler)))
+    application.add_handler(ChatMemberHandler(chat_member_handler, ChatMemberHandler.ANY_CHAT_MEMBER))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, serialized(reply_handler)))
     application.add_error_handler(error_handler)
 
-    logger.info(f"🚀 Bot de EntresHijos iniciado exitosamente (Entorno: {ENVIRONMENT})")
+    # Tareas periódicas
+    if not SHARED_STORAGE or WORKER_INDEX == 0:  # Con varios workers solo caduca el primero
+        application.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=10)
+    application.job_queue.run_repeating(deletion_sweep, interval=DELETE_SWEEP_INTERVAL, first=DELETE_SWEEP_INTERVAL)
+    return application
+
+async def main():
+    application = build_application()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    # Instancia única: esperar el liderazgo con el bot ya inicializado (con
+    # varios workers lo gestiona el supervisor)
+    lease = None
+    if not SHARED_STORAGE:
+        lease = create_leader_lease()
+        await application.initialize()
+        try:
+            if not await wait_for_leadership(lease, stop):
+                await application.shutdown()
+                return True
+        except BaseException:
+            lease.release()
+            raise
+        lease.start_heartbeat(lambda: loop.call_soon_threadsafe(stop.set))
+
+    logger.info("🚀 Bot de EntresHijos iniciado exitosamente (Entorno: %s, modo: %s)", ENVIRONMENT, UPDATE_MODE)
     print("🚀 Bot iniciado. Escuchando comandos...")
+    try:
+        ok = await run_application(application, stop)
+    finally:
+        if lease:
+            lease.release()
+    return ok and not (lease and lease.lost.is_set())
 
-    # Elegir entre polling y webhook dependiendo del entorno
-    max_retries = 5
-    retry_delay = 10
-
-    if ENVIRONMENT == "development":  # Replit
-        # Usar webhooks para Replit
-        webhook_url = "https://telegram-request-bot.xavirmyx.repl.co/webhook"
-        logger.info(f"🌐 Configurando webhook para Replit: {webhook_url}")
-        await application.bot.set_webhook(url=webhook_url)
-        await application.run_webhook(
-            webhook_url=webhook_url,
-            listen="0.0.0.0",
-            port=80
-        )
-    else:  # Vultr (production)
-        # Usar polling para Vultr
-        for attempt in range(max_retries):
+# === WORKERS ===
+# Con WEBHOOK_WORKERS > 1 el proceso principal solo supervisa: con el
+# liderazgo, lanza un worker por proceso (cada uno con su WORKER_INDEX, todos
+# en el mismo puerto), les reenvía SIGINT/SIGTERM y reinicia los que terminen
+# de forma inesperada.
+def run_workers():
+    if STORAGE_BACKEND != "sqlite":
+        logger.error("❌ WEBHOOK_WORKERS > 1 requiere STORAGE_BACKEND=sqlite. Deteniendo el bot...")
+        sys.exit(1)
+    lease = create_leader_lease()
+    while not lease.acquire():
+        time.sleep(lease.ttl / 3)
+    lease.start_heartbeat(lambda: os.kill(os.getpid(), signal.SIGTERM))
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        global WORKER_INDEX
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            WORKER_INDEX = index
+            # El hilo de logs no sobrevive al fork; cada worker rota su propio fichero
+            setup_logging(f"bot-{index}.log")
+            code = 1
             try:
-                await application.run_polling()
-                break
-            except NetworkError as e:
-                logger.error(f"❌ Error de red: {str(e)}. Reintentando en {retry_delay} segundos... (Intento {attempt + 1}/{max_retries})")
-                await asyncio.sleep(retry_delay)
-            except Exception as e:
-                if "Conflict: terminated by other getUpdates request" in str(e):
-                    logger.error(f"❌ Conflicto detectado: otra instancia del bot está corriendo. Reintentando en {retry_delay} segundos... (Intento {attempt + 1}/{max_retries})")
-                    await asyncio.sleep(retry_delay)
-                else:
-                    logger.error(f"❌ Error inesperado: {str(e)}. Deteniendo el bot...")
-                    break
-        else:
-            logger.error("❌ Máximo número de reintentos alcanzado. Deteniendo el bot...")
-            sys.exit(1)
+                code = 0 if asyncio.run(main()) else 1
+            finally:
+                stop_logging()
+                os._exit(code)
+        children[pid] = index
+        logger.info("👷 Worker %s iniciado (PID %s)", index, pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
 
-    # Eliminar el archivo PID al cerrar el bot
-    if os.path.exists(PID_FILE):
-        os.remove(PID_FILE)
-        logger.info("🗑️ Archivo PID eliminado al cerrar el bot")
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(WEBHOOK_WORKERS):
+        spawn(index)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            logger.error("❌ Worker %s (PID %s) terminó inesperadamente (estado %s), reiniciando...", index, pid, status)
+            time.sleep(1)
+            spawn(index)
+    lease.release()
+    if lease.lost.is_set():
+        sys.exit(1)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if SHARED_STORAGE:
+        run_workers()
+    elif not asyncio.run(main()):
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main.py lee la configuración y abre bot.log en el directorio actual al
+# importarse: se importa desde un directorio temporal, como hace bench.py.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "tests")
+os.chdir(tempfile.mkdtemp(prefix="tests_"))
+sys.path.insert(0, REPO_DIR)
+
+import main  # noqa: E402
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Los ficheros de datos usan rutas relativas (requests.json, requests.jsonl...)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def new_request(store, user_id=1, group_id=-100, message="Película de prueba", ts=1700000000):
+    return store.create(
+        user_id=user_id, username=f"usuario_{user_id}", message=message, group_id=group_id,
+        group_name="Grupo", ts=ts, source="EntresHijos", priority=False, status="en espera"
+    )
+
+def open_store(backend):
+    store = main.RequestStore()
+    store.load(backend)
+    return store
+
+def json_storage():
+    return main.JsonStorage(main.DB_FILE, main.JOURNAL_FILE, main.BLACKLIST_FILE, main.MESSAGES_FILE, main.DELETIONS_FILE)
@@ -0,0 +1,60 @@
+import csv
+import os
+from datetime import datetime
+
+import main
+from conftest import json_storage, new_request, open_store
+
+JANUARY = int(datetime(2024, 1, 15).timestamp())
+FEBRUARY = int(datetime(2024, 2, 15).timestamp())
+
+def archived_store(workdir):
+    store = open_store(json_storage())
+    store.archive = main.RequestArchive(str(workdir / "archive"))
+    return store
+
+def test_closed_tickets_are_found_in_their_monthly_segment(workdir):
+    store = archived_store(workdir)
+    for user_id in range(1, 4):
+        new_request(store, user_id=user_id, ts=JANUARY + user_id, message=f"Enero {user_id}")
+    new_request(store, user_id=4, ts=FEBRUARY, message="Febrero")
+    store.remove(1, status="subida")
+    store.remove_many([2, 4], "no aceptada")
+    store.archive.flush()
+    store.remove(3, status="subida")  # Otro lote en el mismo segmento
+
+    assert store.archive.find(3)["message"] == "Enero 3"
+    assert store.archive.segments() == ["2024-01", "2024-02"]
+    # Un proceso nuevo lee los índices desde el disco
+    archive = main.RequestArchive(str(workdir / "archive"))
+    assert [archive.find(ticket)["status"] for ticket in (1, 2, 3, 4)] == ["subida", "no aceptada", "subida", "no aceptada"]
+    assert archive.find(99) is None
+
+def test_expired_tickets_are_archived(workdir):
+    store = archived_store(workdir)
+    new_request(store, user_id=1, ts=JANUARY)
+    new_request(store, user_id=2, ts=FEBRUARY)
+    assert [request["ticket"] for request in store.expire(JANUARY + 1)] == [1]
+    assert store.archive.find(1)["status"] == "caducada"
+    assert store.archive.find(2) is None
+
+def test_export_writes_the_requested_range_as_csv(workdir):
+    store = archived_store(workdir)
+    for user_id, ts in ((1, JANUARY), (2, FEBRUARY), (3, FEBRUARY + 1)):
+        request = new_request(store, user_id=user_id, ts=ts, message=f"Mensaje, {user_id}")
+        store.remove(request["ticket"], status="subida")
+
+    path, count = store.archive.export(FEBRUARY, FEBRUARY + 86400)
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    finally:
+        os.remove(path)
+    assert count == 2
+    assert [row["ticket"] for row in rows] == ["2", "3"]
+    assert rows[0]["message"] == "Mensaje, 2"
+    assert list(rows[0]) == list(main.EXPORT_FIELDS)
+
+    path, count = store.archive.export(JANUARY - 86400, JANUARY)
+    os.remove(path)
+    assert count == 0
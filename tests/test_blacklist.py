@@ -0,0 +1,50 @@
+import json
+import os
+import time
+
+import main
+from conftest import json_storage
+
+def open_blacklist(reload_interval=3600):
+    blacklist = main.Blacklist(reload_interval)
+    blacklist.load(json_storage())
+    return blacklist
+
+def test_lookups_by_id_and_username(workdir):
+    blacklist = open_blacklist()
+    blacklist.add(7, "Usuario_Siete")
+    assert blacklist.contains(7)
+    assert not blacklist.contains(8)
+    assert blacklist.find_username("usuario_siete") == 7
+
+    blacklist.remove(7)
+    assert not blacklist.contains(7)
+    assert blacklist.find_username("usuario_siete") is None
+
+def test_flush_persists_and_reload_restores(workdir):
+    blacklist = open_blacklist()
+    blacklist.add(7, "siete")
+    assert blacklist.flush()
+    assert not blacklist.flush()  # Nada pendiente
+    assert [entry["user_id"] for entry in open_blacklist().entries()] == [7]
+
+def test_temporary_block_is_lifted_when_it_expires(workdir):
+    blacklist = open_blacklist()
+    blacklist.add(7, "siete", expires=time.time() + 3600)
+    blacklist.add(8, "ocho", expires=time.time() - 1)
+    assert blacklist.contains(7)
+    assert not blacklist.contains(8)
+    assert blacklist.find_username("ocho") is None
+
+def test_external_edit_is_reloaded(workdir):
+    blacklist = open_blacklist(reload_interval=0)
+    blacklist.add(7, "siete")
+    blacklist.flush()
+    with open(main.BLACKLIST_FILE, "w") as f:
+        json.dump([{"user_id": 9, "username": "nueve"}], f)
+    # Otra marca de tiempo aunque el sistema de ficheros tenga poca resolución
+    stat = os.stat(main.BLACKLIST_FILE)
+    os.utime(main.BLACKLIST_FILE, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert blacklist.contains(9)
+    assert not blacklist.contains(7)
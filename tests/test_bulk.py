@@ -0,0 +1,80 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from conftest import json_storage, new_request, open_store
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(message_id=len(self.sent))
+
+class FakeQuery:
+    def __init__(self):
+        self.message = SimpleNamespace(chat_id=-999)
+        self.edits = []
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append(text)
+        return SimpleNamespace(message_id=500)
+
+@pytest.fixture
+def store(workdir, monkeypatch):
+    store = open_store(json_storage())
+    monkeypatch.setattr(main, "request_store", store)
+    monkeypatch.setattr(main, "message_registry", main.MessageRegistry())
+    monkeypatch.setattr(main, "deletion_scheduler", main.DeletionScheduler(60))
+    for user_id in range(1, 6):
+        new_request(store, user_id=user_id, group_id=-100 if user_id <= 3 else -200, message=f"Película {user_id}")
+    return store
+
+def resolve(verb_code, target, selected=()):
+    query, bot = FakeQuery(), FakeBot()
+    context = SimpleNamespace(bot=bot, user_data={"selected": set(selected)})
+
+    async def runner():
+        tasks = []
+        context.application = SimpleNamespace(create_task=lambda coro: tasks.append(asyncio.ensure_future(coro)))
+        await main.resolve_bulk(query, context, verb_code, target)
+        await asyncio.gather(*tasks)
+    asyncio.run(runner())
+    return query, bot, context
+
+def test_group_accept_closes_its_tickets_with_one_notice(store):
+    main.message_registry.add(1, "queue_notice", -100, 42)
+    query, bot, _ = resolve("a", "g-100")
+
+    assert sorted(store.by_ticket) == [4, 5]
+    assert "3 tickets aceptados" in query.edits[0]
+    assert len(bot.sent) == 1
+    chat_id, text = bot.sent[0]
+    assert chat_id == -100
+    assert all(f"Ticket \\#{ticket}" in text for ticket in (1, 2, 3))
+    # El aviso de cola del ticket 1 se borra en el siguiente barrido
+    assert main.deletion_scheduler.pop_due(time.time() + 60) == {-100: [42]}
+
+def test_selection_deny_sends_one_notice_per_group_and_clears_the_selection(store):
+    _, bot, context = resolve("d", "s", selected={1, 4, 99})
+    assert sorted(store.by_ticket) == [2, 3, 5]
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [-200, -100]
+    assert context.user_data["selected"] == {99}
+
+def test_nothing_to_resolve(store):
+    query, bot, _ = resolve("a", "u42")
+    assert query.edits == [main.render("bulk_empty")]
+    assert not bot.sent
+    assert len(store.by_ticket) == 5
+
+def test_notices_are_split_at_the_message_limit(store, monkeypatch):
+    monkeypatch.setattr(main, "MESSAGE_LIMIT", 300)
+    requests = [new_request(store, user_id=10 + i, message="Película muy larga " * 3) for i in range(10)]
+    texts = main.bulk_notices(requests, "bulk_accepted")
+    assert len(texts) > 1
+    assert all(len(text) <= 300 and text.startswith(main.render("bulk_accepted", count=10)) for text in texts)
+    assert sum(text.count("Ticket \\#") for text in texts) == 10
@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+
+async def track(events, name, delay=0.01):
+    events.append(f"{name}+")
+    await asyncio.sleep(delay)
+    events.append(f"{name}-")
+
+def run_locked(*jobs):
+    locks = main.KeyedLocks()
+    events = []
+
+    async def runner():
+        await asyncio.gather(*(locks.run(keys, track, events, name) for name, keys in jobs))
+    asyncio.run(asyncio.wait_for(runner(), timeout=5))
+    return locks, events
+
+def test_same_key_is_serialized():
+    locks, events = run_locked(("a", [("user", 1)]), ("b", [("user", 1)]))
+    assert events == ["a+", "a-", "b+", "b-"]
+    assert locks.locks == {}  # Los locks sin usuarios se descartan
+
+def test_different_keys_run_in_parallel():
+    _, events = run_locked(("a", [("user", 1)]), ("b", [("user", 2)]))
+    assert events[:2] == ["a+", "b+"]
+
+def test_overlapping_keys_in_any_order_do_not_deadlock():
+    _, events = run_locked(
+        ("a", [("user", 1), ("ticket", 5)]),
+        ("b", [("ticket", 5), ("user", 1)]),
+        ("c", [("ticket", 5)])
+    )
+    assert events == ["a+", "a-", "b+", "b-", "c+", "c-"]
+
+def fake_update(user_id, data=None, text=None):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        callback_query=SimpleNamespace(data=data) if data else None,
+        message=SimpleNamespace(text=text) if text else None
+    )
+
+def test_update_keys_cover_user_ticket_and_command_arguments():
+    assert main.update_keys(fake_update(1, data="accept_12")) == [("user", 1), ("ticket", 12)]
+    assert main.update_keys(fake_update(1, data="remove_from_blacklist_7")) == [("user", 1), ("user", 7)]
+    assert main.update_keys(fake_update(1, text="/reply@bot 12 hola")) == [("user", 1), ("ticket", 12)]
+    assert main.update_keys(fake_update(1, text="/cupo 7 2")) == [("user", 1), ("user", 7)]
+    assert main.update_keys(fake_update(1, text="/solicito algo")) == [("user", 1)]
@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+import main
+from conftest import json_storage
+
+def test_pop_due_groups_expired_buckets_by_chat():
+    scheduler = main.DeletionScheduler(60)
+    scheduler.add(100, -1, 1)
+    scheduler.add(110, -2, 2)
+    scheduler.add(115, -1, 3)
+    scheduler.add(200, -1, 4)
+
+    assert scheduler.pop_due(119) == {}  # La cubeta 60..120 aún no ha vencido
+    assert scheduler.pop_due(120) == {-1: [1, 3], -2: [2]}
+    assert len(scheduler) == 1
+    assert scheduler.pop_due(240) == {-1: [4]}
+    assert len(scheduler) == 0
+
+def test_pending_deletions_survive_a_restart(workdir):
+    scheduler = main.DeletionScheduler(60)
+    scheduler.load(json_storage())
+    scheduler.add(100, -1, 1)
+    scheduler.add(200, -2, 2)
+    scheduler.mark_dirty()
+    assert scheduler.flush()
+
+    reloaded = main.DeletionScheduler(60)
+    reloaded.load(json_storage())
+    assert reloaded.pop_due(300) == {-1: [1], -2: [2]}
+
+class FakeBot:
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.deleted = []
+
+    async def delete_message(self, chat_id, message_id, rate_limit_args=None):
+        if message_id in self.missing:
+            raise BadRequest("Message to delete not found")
+        self.deleted.append((chat_id, message_id))
+        return True
+
+def test_delete_due_keeps_going_past_failed_deletions():
+    bot = FakeBot(missing={3, 150})
+    message_ids = list(range(1, 251))
+    asyncio.run(main.delete_due(SimpleNamespace(bot=bot), -1, message_ids))
+    assert sorted(message_id for _, message_id in bot.deleted) == [m for m in message_ids if m not in (3, 150)]
@@ -0,0 +1,44 @@
+import main
+from conftest import json_storage, new_request, open_store
+
+def test_normalize_text_drops_case_accents_and_stopwords():
+    assert main.normalize_text("Hola, necesito LA Película de Érase una vez 2") == {"pelicula", "erase", "vez", "2"}
+
+def test_similar_ranks_by_score_then_age():
+    index = main.TextIndex()
+    index.add(1, -100, "El señor de los anillos")
+    index.add(2, -100, "Señor de los anillos: la comunidad")
+    index.add(3, -100, "señor anillos")
+    index.add(4, -200, "El señor de los anillos")  # Otro grupo
+    assert index.similar("señor de los anillos", -100, 0.5) == [(1.0, 1), (1.0, 3), (2 / 3, 2)]
+    assert index.similar("Matrix", -100, 0.5) == []
+    assert index.similar("hola gracias", -100, 0.5) == []  # Solo palabras vacías
+
+def test_discard_removes_postings():
+    index = main.TextIndex()
+    index.add(1, -100, "Matrix")
+    index.discard(1)
+    index.discard(1)
+    assert index.postings == {} and index.tokens == {}
+
+def test_find_duplicate_only_sees_open_tickets_of_the_group(workdir):
+    store = open_store(json_storage())
+    original = new_request(store, user_id=1, message="Necesito Interstellar en 4K")
+    new_request(store, user_id=2, group_id=-200, message="Interstellar 4K")
+    assert store.find_duplicate("interstellar 4k porfa", -100)["ticket"] == original["ticket"]
+    assert store.find_duplicate("interstellar 4k", -100, threshold=0) is None  # Desactivado
+    assert store.find_duplicate("Oppenheimer", -100) is None
+
+    store.update(original["ticket"], message="Oppenheimer")
+    assert store.find_duplicate("oppenheimer", -100)["ticket"] == original["ticket"]
+    store.remove(original["ticket"], status="subida")
+    assert store.find_duplicate("oppenheimer", -100) is None
+
+def test_followers_are_persisted(workdir):
+    store = open_store(json_storage())
+    request = new_request(store, user_id=1)
+    store.add_follower(request["ticket"], 2, "dos")
+    store.flush()
+    followers = open_store(json_storage()).get(request["ticket"])["followers"]
+    assert [(follower["user_id"], follower["username"]) for follower in followers] == [(2, "dos")]
+    assert main.follows(request, 2) and not main.follows(request, 3)
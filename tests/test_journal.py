@@ -0,0 +1,58 @@
+import json
+import os
+
+import main
+from conftest import json_storage, new_request, open_store
+
+def test_journal_replay_restores_creates_updates_and_resolves(workdir):
+    store = open_store(json_storage())
+    for user_id in range(1, 4):
+        new_request(store, user_id=user_id, message=f"Solicitud {user_id}")
+    store.update(2, message="Solicitud editada", priority=True)
+    store.remove(3, status="subida")
+    assert store.flush()
+    assert not os.path.exists(main.DB_FILE)  # Todo está en el diario
+
+    reloaded = open_store(json_storage())
+    assert sorted(reloaded.by_ticket) == [1, 2]
+    assert reloaded.get(2)["message"] == "Solicitud editada"
+    assert reloaded.get(2)["priority"] is True
+    assert reloaded.last_ticket == 3
+
+def test_torn_last_journal_line_is_dropped_and_truncated(workdir):
+    store = open_store(json_storage())
+    new_request(store, user_id=1)
+    new_request(store, user_id=2)
+    store.flush()
+    valid_size = os.path.getsize(main.JOURNAL_FILE)
+    with open(main.JOURNAL_FILE, "ab") as f:
+        f.write(b'{"op": "create", "request": {"ticket": 3, "us')
+
+    backend = json_storage()
+    reloaded = open_store(backend)
+    assert sorted(reloaded.by_ticket) == [1, 2]
+    assert os.path.getsize(main.JOURNAL_FILE) == valid_size
+
+    # Lo que se escribe después queda en líneas válidas
+    new_request(reloaded, user_id=3)
+    reloaded.flush()
+    with open(main.JOURNAL_FILE) as f:
+        assert all(json.loads(line) for line in f)
+    assert sorted(open_store(json_storage()).by_ticket) == [1, 2, 51]
+
+def test_compaction_writes_snapshot_and_empties_journal(workdir):
+    store = open_store(json_storage())
+    for user_id in range(1, 6):
+        new_request(store, user_id=user_id)
+    store.remove(1, status="no aceptada")
+    store.mark_dirty()
+    store.flush()
+    assert os.path.getsize(main.JOURNAL_FILE) == 0
+    with open(main.DB_FILE) as f:
+        snapshot = json.load(f)
+    assert [req["ticket"] for req in snapshot["requests"]] == [2, 3, 4, 5]
+    assert snapshot["reserved_ticket"] == main.TICKET_BLOCK_SIZE
+
+    reloaded = open_store(json_storage())
+    assert sorted(reloaded.by_ticket) == [2, 3, 4, 5]
+    assert new_request(reloaded)["ticket"] == main.TICKET_BLOCK_SIZE + 1
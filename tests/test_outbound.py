@@ -0,0 +1,71 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+import main
+
+def test_token_bucket_waits_for_the_next_token():
+    bucket = main.TokenBucket(2, 2)
+    now = bucket.updated
+    for _ in range(2):
+        assert bucket.wait_time(now) == 0
+        bucket.take()
+    assert bucket.wait_time(now) == 0.5
+    assert bucket.wait_time(now + 0.5) == 0
+
+async def call_api(limiter, endpoint, chat_id, calls):
+    async def callback():
+        calls.append((endpoint, chat_id))
+        return True
+    return await limiter.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, None)
+
+def run_with_limiter(scenario, **limits):
+    async def runner():
+        limiter = main.OutboundRateLimiter(**{"global_rate": 1000, "group_rate": 0.01, "group_burst": 3, "private_rate": 1, "max_retries": 2, **limits})
+        await limiter.initialize()
+        try:
+            return await scenario(limiter)
+        finally:
+            await limiter.shutdown()
+    return asyncio.run(runner())
+
+def test_group_sends_are_limited_after_the_burst_but_edits_are_not():
+    calls = []
+
+    async def scenario(limiter):
+        for _ in range(3):
+            await call_api(limiter, "sendMessage", -100, calls)
+        blocked = asyncio.ensure_future(call_api(limiter, "sendMessage", -100, calls))
+        await call_api(limiter, "editMessageText", -100, calls)
+        await call_api(limiter, "sendMessage", -200, calls)  # Otro grupo tiene su propia cubeta
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        blocked.cancel()
+
+    run_with_limiter(scenario)
+    assert calls == [("sendMessage", -100)] * 3 + [("editMessageText", -100), ("sendMessage", -200)]
+
+def test_unthrottled_endpoints_skip_the_queue():
+    calls = []
+
+    async def scenario(limiter):
+        await call_api(limiter, "getChatAdministrators", -100, calls)
+        assert limiter.stats["sent"] == 0
+
+    run_with_limiter(scenario)
+    assert calls == [("getChatAdministrators", -100)]
+
+def test_retry_after_is_retried_up_to_max_retries():
+    attempts = []
+
+    async def scenario(limiter):
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise RetryAfter(0)
+            return True
+        assert await limiter.process_request(flaky, (), {}, "sendMessage", {"chat_id": 5}, None)
+        assert limiter.stats["retries"] == 2
+
+    run_with_limiter(scenario, private_rate=1000)
+    assert len(attempts) == 3
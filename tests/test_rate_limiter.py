@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import main
+from conftest import new_request
+
+NOW = 1700000000
+
+def test_check_counts_window_and_reports_reset_time():
+    limiter = main.RateLimiter(2, 3600, {})
+    limiter.record(1, NOW - 3000)
+    assert limiter.check(1, now=NOW) == (1, 2, None)
+    limiter.record(1, NOW - 1000)
+    # Al llegar al límite, el reinicio es cuando sale la más antigua de la ventana
+    assert limiter.check(1, now=NOW) == (2, 2, datetime.fromtimestamp(NOW - 3000 + 3600))
+    assert limiter.check(1, now=NOW + 700) == (1, 2, None)
+
+def test_group_limits_override_defaults():
+    limiter = main.RateLimiter(2, 3600, {"-5": {"limit": 1, "window": 60}})
+    limiter.record(1, NOW - 30)
+    assert limiter.check(1, -5, now=NOW) == (1, 1, datetime.fromtimestamp(NOW - 30 + 60))
+    assert limiter.check(1, -6, now=NOW) == (1, 2, None)
+
+def test_grant_raises_limit_and_is_consumed_by_requests():
+    limiter = main.RateLimiter(1, 3600, {})
+    assert limiter.grant(1, 2) == 2
+    limiter.record(1, NOW - 10, -5)
+    assert limiter.check(1, -5, now=NOW)[:2] == (1, 3)
+    limiter.record(1, NOW - 5, -5)  # Pasa del límite base: gasta una extra
+    assert limiter.extra_quota[1] == 1
+    assert limiter.check(1, -5, now=NOW)[:2] == (2, 2)
+    assert limiter.grant(1, -5) == 0
+
+def test_resolved_tickets_free_quota_as_after_a_restart(workdir):
+    store = main.RequestStore()
+    store.load(main.JsonStorage(main.DB_FILE, main.JOURNAL_FILE, main.BLACKLIST_FILE, main.MESSAGES_FILE, main.DELETIONS_FILE))
+    limiter = main.RateLimiter(2, 3600, {})
+    store.rate_limiter = limiter
+    for ts in (NOW - 20, NOW - 10):
+        request = new_request(store, ts=ts)
+        limiter.record(request["user_id"], request["ts"])
+    assert limiter.check(1, now=NOW)[0] == 2
+    store.remove(1, status="subida")
+    assert limiter.check(1, now=NOW)[0] == 1
+
+    rebuilt = main.RateLimiter(2, 3600, {})
+    rebuilt.rebuild(store.all())
+    assert rebuilt.check(1, now=NOW) == limiter.check(1, now=NOW)
@@ -0,0 +1,37 @@
+import json
+
+import main
+from conftest import json_storage, new_request, open_store
+
+def test_sqlite_store_round_trip(workdir):
+    store = open_store(main.SqliteStorage(main.SQLITE_FILE))
+    for user_id in range(1, 4):
+        new_request(store, user_id=user_id, message=f"Solicitud {user_id}")
+    store.update(2, message="Solicitud editada")
+    store.remove(3, status="subida")
+    assert store.flush()
+    store.backend.close()
+
+    reloaded = open_store(main.SqliteStorage(main.SQLITE_FILE))
+    assert sorted(reloaded.by_ticket) == [1, 2]
+    assert reloaded.get(2)["message"] == "Solicitud editada"
+    assert reloaded.last_ticket == 3
+
+def test_sqlite_migration_from_json(workdir):
+    store = open_store(json_storage())
+    new_request(store, user_id=1)
+    new_request(store, user_id=2)
+    store.remove(1, status="subida")
+    store.flush()
+    with open(main.BLACKLIST_FILE, "w") as f:
+        json.dump([{"user_id": 99, "username": "bloqueado"}], f)
+
+    sqlite_storage = main.SqliteStorage(main.SQLITE_FILE)
+    assert sqlite_storage.migrate_from(json_storage())
+    assert not sqlite_storage.migrate_from(json_storage())  # Solo la primera vez
+
+    migrated = open_store(sqlite_storage)
+    assert sorted(migrated.by_ticket) == [2]
+    assert migrated.last_ticket == 2
+    assert [entry["user_id"] for entry in sqlite_storage.load_blacklist()] == [99]
+    assert new_request(migrated, user_id=3)["ticket"] == main.TICKET_BLOCK_SIZE + 1
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import main
+from conftest import json_storage, new_request, open_store
+
+def test_changes_stay_in_memory_until_the_writer_flushes(workdir):
+    store = open_store(json_storage())
+    writer = main.StorageWriter(60)
+    writer.register(store)
+    request = new_request(store)
+    assert store.get(request["ticket"]) is request
+    with open(main.JOURNAL_FILE) as f:
+        # Solo la reserva del bloque de tickets se escribe en el momento
+        assert [json.loads(line)["op"] for line in f] == ["reserve"]
+
+    # stop() guarda lo pendiente aunque el hilo no llegara a arrancar
+    writer.stop()
+    assert not store.pending_ops
+    assert sorted(open_store(json_storage()).by_ticket) == [1]
+
+def test_failed_flush_keeps_pending_ops(workdir, monkeypatch):
+    backend = json_storage()
+    store = open_store(backend)
+    new_request(store, user_id=1)
+
+    def fail(ops, snapshot=None):
+        raise OSError("disco lleno")
+    monkeypatch.setattr(backend, "write", fail)
+    with pytest.raises(OSError):
+        store.flush()
+    monkeypatch.undo()
+
+    new_request(store, user_id=2)
+    assert store.flush()
+    assert sorted(open_store(json_storage()).by_ticket) == [1, 2]
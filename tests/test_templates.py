@@ -0,0 +1,33 @@
+import main
+from conftest import json_storage, new_request, open_store
+
+def test_template_text_is_escaped_but_markup_is_kept():
+    assert main.compile_template("*Hola* `/cmd <x>` ¡ya! (1.5)") == r"*Hola* `/cmd <x>` ¡ya\! \(1\.5\)"
+    assert main.compile_template("Ticket #{ticket}.") == r"Ticket \#{ticket}\."
+
+def test_values_are_escaped_when_rendered():
+    text = main.render("ticket_not_found", ticket="1_2*3")
+    assert text == r"❌ Ticket \#1\_2\*3 no encontrado \- EntresHijos\."
+    # Las llaves del usuario no se interpretan como campos
+    assert main.render("blacklist_exists", username="{ticket}") == r"⛔ @\{ticket\} ya está en la blacklist \- EntresHijos\. 😕"
+
+def test_every_template_renders_with_all_its_fields():
+    for name, template in main.TEMPLATES.items():
+        fields = {token[1:-1]: "x" for token in main.TEMPLATE_TOKEN.findall(main.TEMPLATE_TEXTS[name]) if token.startswith("{")}
+        assert template.format(**fields)
+
+def test_ticket_cards_are_cached_until_a_card_field_changes(workdir, monkeypatch):
+    store = open_store(json_storage())
+    monkeypatch.setattr(main, "request_store", store)
+    request = new_request(store, message="Película (2024)")
+    assert main.render("ticket_status", request).count(r"Película \(2024\)") == 1
+    assert request["ticket"] in main.ticket_cards.cache
+
+    store.update(request["ticket"], priority=True)  # No forma parte de la tarjeta
+    assert request["ticket"] in main.ticket_cards.cache
+    store.update(request["ticket"], message="Serie")
+    assert request["ticket"] not in main.ticket_cards.cache
+    assert "Mensaje: Serie" in main.render("ticket_status", request)
+
+    store.remove(request["ticket"], status="subida")
+    assert request["ticket"] not in main.ticket_cards.cache
@@ -0,0 +1,45 @@
+import main
+from conftest import json_storage, new_request, open_store
+
+def tickets(page):
+    requests, has_prev, has_next = page
+    return [request["ticket"] for request in requests], has_prev, has_next
+
+def fill_store():
+    # Tickets 1..12: los pares en el grupo -200 y los múltiplos de 3 con prioridad
+    store = open_store(json_storage())
+    for user_id in range(1, 13):
+        request = new_request(store, user_id=user_id, group_id=-200 if user_id % 2 == 0 else -100)
+        if user_id % 3 == 0:
+            store.update(request["ticket"], priority=True)
+    return store
+
+def test_pages_follow_the_cursor_both_ways(workdir):
+    store = fill_store()
+    assert tickets(store.page(size=5)) == ([1, 2, 3, 4, 5], False, True)
+    assert tickets(store.page(after=5, size=5)) == ([6, 7, 8, 9, 10], True, True)
+    assert tickets(store.page(after=10, size=5)) == ([11, 12], True, False)
+    assert tickets(store.page(before=11, size=5)) == ([6, 7, 8, 9, 10], True, True)
+    assert tickets(store.page(before=6, size=5)) == ([1, 2, 3, 4, 5], False, True)
+
+def test_filters_combine_and_follow_updates(workdir):
+    store = fill_store()
+    assert tickets(store.page({"group_id": -200}, size=3)) == ([2, 4, 6], False, True)
+    assert tickets(store.page({"group_id": -200, "priority": True}, size=3)) == ([6, 12], False, False)
+
+    store.update(6, priority=False)
+    store.remove(12, status="subida")
+    assert tickets(store.page({"priority": True}, size=3)) == ([3, 9], False, False)
+    assert store.index_values("group_id") == [-200, -100]
+
+def test_filters_round_trip_through_callback_data():
+    for filters in ({}, {"priority": True}, {"group_id": -1001234567890}, {"priority": True, "group_id": -5}):
+        assert main.decode_filters(main.encode_filters(filters)) == filters
+    assert main.encode_filters({}) == "a"
+
+def test_cycle_filter_walks_values_then_clears():
+    filters = main.cycle_filter({"priority": True}, "group_id", [-200, -100])
+    assert filters == {"priority": True, "group_id": -200}
+    filters = main.cycle_filter(filters, "group_id", [-200, -100])
+    assert filters["group_id"] == -100
+    assert main.cycle_filter(filters, "group_id", [-200, -100]) == {"priority": True}
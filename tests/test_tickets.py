@@ -0,0 +1,34 @@
+import pytest
+
+import main
+from conftest import json_storage, new_request, open_store
+
+class CountingBackend:
+    def __init__(self):
+        self.reserved = 0
+        self.calls = 0
+
+    def reserve_tickets(self, count):
+        self.calls += 1
+        start = self.reserved + 1
+        self.reserved += count
+        return start, self.reserved
+
+def test_allocator_reserves_a_block_only_when_it_runs_out():
+    backend = CountingBackend()
+    allocator = main.TicketAllocator(3)
+    allocator.reset(backend)
+    assert [allocator.allocate() for _ in range(7)] == [1, 2, 3, 4, 5, 6, 7]
+    assert backend.calls == 3
+
+@pytest.mark.parametrize("backend_factory", [json_storage, lambda: main.SqliteStorage(main.SQLITE_FILE)], ids=["json", "sqlite"])
+def test_ticket_reservation_resumes_after_restart(workdir, backend_factory):
+    backend = backend_factory()
+    store = open_store(backend)
+    assert new_request(store)["ticket"] == 1
+    store.flush()
+    backend.close()
+
+    # El bloque 1..TICKET_BLOCK_SIZE ya estaba reservado: se continúa después
+    store = open_store(backend_factory())
+    assert new_request(store, user_id=2)["ticket"] == main.TICKET_BLOCK_SIZE + 1 == 51
@@ -0,0 +1,102 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import main
+from conftest import new_request
+
+# Dos workers en el mismo proceso: cada uno con su RequestStore y su conexión
+# a la misma base, como los procesos que arranca run_workers().
+@pytest.fixture
+def workers(workdir, monkeypatch):
+    monkeypatch.setattr(main, "SHARED_STORAGE", True)
+    stores = []
+    for index in range(2):
+        store = main.RequestStore()
+        store.load(main.SqliteStorage(main.SQLITE_FILE, worker=index, changelog=True))
+        stores.append(store)
+    yield stores
+    for store in stores:
+        store.backend.close()
+
+def test_workers_see_each_others_changes(workers):
+    first, second = workers
+    ticket = new_request(first, message="Serie completa")["ticket"]
+    assert second.get(ticket) is None
+    second.sync()
+    assert second.get(ticket)["message"] == "Serie completa"
+
+    second.update(ticket, priority=True)
+    second.remove(ticket, status="subida")
+    first.sync()
+    assert first.get(ticket) is None
+
+def test_workers_allocate_distinct_tickets(workers):
+    first, second = workers
+    tickets = [new_request(store, user_id=i)["ticket"] for i in range(10) for store in workers]
+    assert len(set(tickets)) == len(tickets)
+    first.sync()
+    second.sync()
+    assert sorted(first.by_ticket) == sorted(second.by_ticket) == sorted(tickets)
+
+def test_ticket_resolved_once_across_workers(workers):
+    first, second = workers
+    ticket = new_request(first)["ticket"]
+    second.sync()
+    with first.backend.exclusive():
+        first.sync()
+        assert first.remove(ticket, status="subida")
+    with second.backend.exclusive():
+        second.sync()
+        assert second.remove(ticket, status="no aceptada") is None
+
+def test_purged_changes_trigger_full_reload(workers, monkeypatch):
+    first, second = workers
+    new_request(first, user_id=1)
+    second.sync()
+    monkeypatch.setattr(main, "CHANGES_KEEP", 1)
+    for user_id in range(2, 1100):
+        new_request(first, user_id=user_id)
+    assert second.sync() is None  # Faltan cambios purgados: se recarga todo
+    assert sorted(second.by_ticket) == sorted(first.by_ticket)
+
+def run_across_workers(workers, monkeypatch, hold_for):
+    first, second = workers
+    monkeypatch.setattr(main, "request_store", first)
+    monkeypatch.setattr(main, "storage", first.backend)
+    monkeypatch.setattr(main, "rate_limiter", main.RateLimiter(5, 3600, {}))
+    ticket = new_request(second)["ticket"]
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    async def runner():
+        task = asyncio.create_task(ticker())
+        try:
+            with second.backend.exclusive():
+                entering = asyncio.create_task(enter())
+                await asyncio.sleep(hold_for)
+            await entering
+        finally:
+            task.cancel()
+
+    async def enter():
+        async with main.across_workers():
+            # Dentro ya se ha puesto al día con lo que escribió el otro worker
+            assert first.get(ticket)
+
+    asyncio.run(runner())
+    return ticks
+
+def test_across_workers_waits_without_blocking_the_loop(workers, monkeypatch):
+    ticks = run_across_workers(workers, monkeypatch, hold_for=0.1)
+    assert len(ticks) >= 5
+
+def test_across_workers_gives_up_after_the_timeout(workers, monkeypatch):
+    monkeypatch.setattr(main, "WORKER_LOCK_TIMEOUT", 0.05)
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        run_across_workers(workers, monkeypatch, hold_for=0.2)